@@ -0,0 +1,3 @@
+from spotify_analysis.cli import main
+
+main(prog_name="spotify-analysis")
@@ -0,0 +1,59 @@
+import importlib
+
+import click
+
+# Subcommand -> (module, command within the module's app or None for its only command, help).
+# Modules are imported only when their subcommand runs, so `--help` and typos never pay for
+# pandas, pyarrow or matplotlib.
+COMMANDS = {
+    "dataset": ("spotify_analysis.dataset", None, "Build the fact, bridge and dimension tables."),
+    "features": ("spotify_analysis.features", None, "Compute the feature matrix for new dates."),
+    "star-schema": (
+        "spotify_analysis.star_schema",
+        None,
+        "Normalize the crawl into dimension and fact tables.",
+    ),
+    "rollups": ("spotify_analysis.rollups", None, "Roll new days up by track, artist, country."),
+    "query": ("spotify_analysis.query", "query", "Run SQL over the crawl outputs."),
+    "tables": ("spotify_analysis.query", "tables", "List the views `query` can use."),
+    "plots": ("spotify_analysis.plots", None, "Render the report figures."),
+    "train": ("spotify_analysis.modeling.train", None, "Train the next-day stream forecaster."),
+    "predict": (
+        "spotify_analysis.modeling.predict",
+        None,
+        "Score tracks in batch or serve a model.",
+    ),
+}
+
+
+class LazyGroup(click.Group):
+    """Click group whose subcommands are the typer apps of the package, imported on use."""
+
+    def list_commands(self, ctx):
+        return list(COMMANDS)
+
+    def get_command(self, ctx, name):
+        if name not in COMMANDS:
+            return None
+        module_name, command_name, _ = COMMANDS[name]
+        import typer.main
+
+        command = typer.main.get_command(importlib.import_module(module_name).app)
+        if command_name is not None:
+            command = command.get_command(ctx, command_name)
+        command.name = name
+        return command
+
+    def format_commands(self, ctx, formatter):
+        # The default implementation loads every subcommand to read its short help
+        with formatter.section("Commands"):
+            formatter.write_dl([(name, help) for name, (_, _, help) in COMMANDS.items()])
+
+
+@click.group(cls=LazyGroup)
+def main():
+    """Spotify chart analysis: datasets, features, rollups, SQL, figures and models."""
+
+
+if __name__ == "__main__":
+    main()
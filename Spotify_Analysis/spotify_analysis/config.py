@@ -1,32 +1,57 @@
+import os
+from functools import cache
 from pathlib import Path
 
-from dotenv import load_dotenv
-from loguru import logger
-
-# Load environment variables from .env file if it exists
-load_dotenv()
-
-# Paths
+# Nothing is resolved on import: the paths below are computed, and .env / logging set up, the
+# first time one of them is read, so commands like `spotify-analysis --help` start fast.
 PROJ_ROOT = Path(__file__).resolve().parents[1]
-logger.info(f"PROJ_ROOT path is: {PROJ_ROOT}")
-
-DATA_DIR = PROJ_ROOT / "data"
-RAW_DATA_DIR = DATA_DIR / "raw"
-INTERIM_DATA_DIR = DATA_DIR / "interim"
-PROCESSED_DATA_DIR = DATA_DIR / "processed"
-EXTERNAL_DATA_DIR = DATA_DIR / "external"
-
-MODELS_DIR = PROJ_ROOT / "models"
-
-REPORTS_DIR = PROJ_ROOT / "reports"
-FIGURES_DIR = REPORTS_DIR / "figures"
 
-# If tqdm is installed, configure loguru with tqdm.write
-# https://github.com/Delgan/loguru/issues/135
-try:
-    from tqdm import tqdm
 
-    logger.remove(0)
-    logger.add(lambda msg: tqdm.write(msg, end=""), colorize=True)
-except ModuleNotFoundError:
-    pass
+@cache
+def configure():
+    """Load environment variables from .env and route loguru through tqdm; runs once."""
+    from dotenv import load_dotenv
+    from loguru import logger
+
+    # Load environment variables from .env file if it exists
+    load_dotenv()
+
+    # If tqdm is installed, configure loguru with tqdm.write
+    # https://github.com/Delgan/loguru/issues/135
+    try:
+        from tqdm import tqdm
+
+        logger.remove(0)
+        logger.add(lambda msg: tqdm.write(msg, end=""), colorize=True)
+    except ModuleNotFoundError:
+        pass
+
+    logger.info(f"PROJ_ROOT path is: {PROJ_ROOT}")
+
+
+@cache
+def paths() -> dict[str, Path]:
+    configure()
+    data_dir = PROJ_ROOT / "data"
+    reports_dir = PROJ_ROOT / "reports"
+    return {
+        "DATA_DIR": data_dir,
+        "RAW_DATA_DIR": data_dir / "raw",
+        "INTERIM_DATA_DIR": data_dir / "interim",
+        "PROCESSED_DATA_DIR": data_dir / "processed",
+        "EXTERNAL_DATA_DIR": data_dir / "external",
+        # Output of the Airflow crawler (CSV files or partitioned Parquet datasets)
+        "CRAWL_DATA_DIR": Path(os.getenv("SPOTIFY_DATA_DIR", PROJ_ROOT.parent / "data")),
+        "MODELS_DIR": PROJ_ROOT / "models",
+        "REPORTS_DIR": reports_dir,
+        "FIGURES_DIR": reports_dir / "figures",
+    }
+
+
+def __getattr__(name: str):
+    # Only the path names trigger configure(); probes like hasattr(config, "__path__") do not
+    if name.endswith("_DIR"):
+        resolved = paths()
+        if name in resolved:
+            return resolved[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,28 +1,184 @@
 from pathlib import Path
 
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import typer
 from loguru import logger
 from tqdm import tqdm
 
-from spotify_analysis.config import PROCESSED_DATA_DIR, RAW_DATA_DIR
+from spotify_analysis.config import CRAWL_DATA_DIR, PROCESSED_DATA_DIR
+from spotify_analysis.schema import (
+    IdRegistry,
+    arrow_schema,
+    iter_tables,
+    read_table,
+    write_parquet,
+)
 
 app = typer.Typer()
 
+AUDIO_FEATURE_COLUMNS = [
+    "danceability",
+    "energy",
+    "key",
+    "loudness",
+    "mode",
+    "speechiness",
+    "acousticness",
+    "instrumentalness",
+    "liveness",
+    "valence",
+    "tempo",
+    "duration_ms",
+    "time_signature",
+]
+ARTIST_COLUMNS = [
+    "artist_id",
+    "artist_name",
+    "artist_genres",
+    "artist_popularity",
+    "artist_follower",
+]
+STREAM_COLUMNS = [
+    "track_id",
+    "date",
+    "stream_daily",
+    "stream_total",
+    "artists_id",
+    "album_id",
+    "track_name",
+]
+FACT_COLUMNS = [
+    "track_id",
+    "date",
+    "stream_daily",
+    "stream_total",
+    "track_name",
+    "album_id",
+    "artist_count",
+    "primary_artist_id",
+    "artist_name",
+    "artist_popularity",
+    "artist_follower",
+    *AUDIO_FEATURE_COLUMNS,
+]
+
+BRIDGE_SCHEMA = arrow_schema(
+    ["track_id", "artist_id", "artist_position"], extra={"artist_position": pa.int16()}
+)
+FACT_SCHEMA = arrow_schema(FACT_COLUMNS, extra={"artist_count": pa.int16()})
+
+
+def keep_latest(current: pd.DataFrame, chunk: pd.DataFrame, key: str) -> pd.DataFrame:
+    """Fold `chunk` into `current`, keeping the most recent row per `key`."""
+    if not current.empty:
+        chunk = pd.concat([current, chunk], ignore_index=True)
+    if "date" in chunk.columns:
+        chunk = chunk.sort_values("date", kind="stable")
+    return chunk.drop_duplicates(subset=key, keep="last").reset_index(drop=True)
+
+
+def load_audio_features(raw_dir: Path, registry: IdRegistry, chunksize: int) -> pd.DataFrame:
+    """One row per track_id; the crawler stores the features again for every chart day."""
+    features = pd.DataFrame()
+    columns = ["track_id", "date", *AUDIO_FEATURE_COLUMNS]
+    chunks = iter_tables(raw_dir, "tracks_audio_feature", registry, columns, chunksize)
+    for chunk in tqdm(chunks, desc="audio features"):
+        features = keep_latest(features, chunk, "track_id")
+    return features.drop(columns="date", errors="ignore")
+
+
+def load_artists(raw_dir: Path, registry: IdRegistry) -> pd.DataFrame:
+    """Current record per artist_id."""
+    artists = read_table(raw_dir, "artists", registry, [*ARTIST_COLUMNS, "date"])
+    return keep_latest(pd.DataFrame(), artists, "artist_id").drop(columns="date", errors="ignore")
+
+
+def build_bridge(tracks: pd.DataFrame, registry: IdRegistry) -> pd.DataFrame:
+    """Explode the comma-joined `artists_id` into one (track_id, artist_id) row per artist."""
+    bridge = tracks[["track_id", "artists_id"]].drop_duplicates(subset="track_id")
+    artist_ids = bridge["artists_id"].astype(object).str.split(",")
+    bridge = bridge.assign(artist_id=artist_ids).explode("artist_id")
+    bridge["artist_id"] = bridge["artist_id"].str.strip()
+    bridge = bridge[bridge["artist_id"].notna() & (bridge["artist_id"] != "")]
+    bridge["artist_id"] = registry.encode("artist", bridge["artist_id"])
+    bridge["artist_position"] = bridge.groupby("track_id").cumcount()
+    return bridge[["track_id", "artist_id", "artist_position"]].reset_index(drop=True)
+
+
+def build_fact(
+    streams: pd.DataFrame, bridge: pd.DataFrame, features: pd.DataFrame, artists: pd.DataFrame
+) -> pd.DataFrame:
+    """Join one chunk of daily streams 1:1 with its track's features and primary artist."""
+    artist_count = bridge.groupby("track_id").size().rename("artist_count")
+    primary = bridge[bridge["artist_position"] == 0][["track_id", "artist_id"]]
+    primary = primary.rename(columns={"artist_id": "primary_artist_id"}).merge(
+        artists.drop(columns="artist_genres").rename(columns={"artist_id": "primary_artist_id"}),
+        on="primary_artist_id",
+        how="left",
+    )
+
+    fact = streams.drop(columns="artists_id").drop_duplicates(subset=["track_id", "date"])
+    fact = fact.merge(artist_count, left_on="track_id", right_index=True, how="left")
+    fact = fact.merge(primary, on="track_id", how="left")
+    fact = fact.merge(features, on="track_id", how="left")
+    return fact[FACT_COLUMNS]
+
 
 @app.command()
 def main(
-    # ---- REPLACE DEFAULT PATHS AS APPROPRIATE ----
-    input_path: Path = RAW_DATA_DIR / "dataset.csv",
-    output_path: Path = PROCESSED_DATA_DIR / "dataset.csv",
-    # ----------------------------------------------
+    raw_dir: Path = CRAWL_DATA_DIR,
+    output_dir: Path = PROCESSED_DATA_DIR,
+    chunksize: int = 100_000,
 ):
-    # ---- REPLACE THIS WITH YOUR OWN CODE ----
-    logger.info("Processing dataset...")
-    for i in tqdm(range(10), total=10):
-        if i == 5:
-            logger.info("Something happened for iteration 5.")
-    logger.success("Processing dataset complete.")
-    # -----------------------------------------
+    """Build the joined stream fact table plus its artist bridge and dimension tables.
+
+    Daily streams are read `chunksize` rows at a time and appended to the fact table as
+    Parquet row groups, so memory is bounded by one chunk plus the per-track and per-artist
+    tables, however many days of history exist. IDs are written as int32 codes of the
+    IdRegistry kept in `output_dir / "id_registry"`.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    registry = IdRegistry(output_dir / "id_registry")
+
+    logger.info(f"Loading audio features and artists from {raw_dir}...")
+    features = load_audio_features(raw_dir, registry, chunksize)
+    artists = load_artists(raw_dir, registry)
+    write_parquet(
+        pa.Table.from_pandas(features, preserve_index=False), output_dir / "audio_features.parquet"
+    )
+    write_parquet(
+        pa.Table.from_pandas(artists, preserve_index=False), output_dir / "artists.parquet"
+    )
+    logger.info(f"{len(features)} tracks with audio features, {len(artists)} artists.")
+
+    seen_tracks = set()
+    rows = 0
+    bridge_writer = pq.ParquetWriter(output_dir / "artist_bridge.parquet", BRIDGE_SCHEMA)
+    fact_writer = pq.ParquetWriter(output_dir / "tracks_stream_fact.parquet", FACT_SCHEMA)
+    try:
+        chunks = iter_tables(raw_dir, "tracks_stream", registry, STREAM_COLUMNS, chunksize)
+        for streams in tqdm(chunks, desc="streams"):
+            bridge = build_bridge(streams, registry)
+
+            new_bridge = bridge[~bridge["track_id"].isin(seen_tracks)]
+            bridge_writer.write_table(
+                pa.Table.from_pandas(new_bridge, schema=BRIDGE_SCHEMA, preserve_index=False)
+            )
+            seen_tracks.update(new_bridge["track_id"])
+
+            fact = build_fact(streams, bridge, features, artists)
+            fact_writer.write_table(
+                pa.Table.from_pandas(fact, schema=FACT_SCHEMA, preserve_index=False)
+            )
+            rows += len(fact)
+    finally:
+        bridge_writer.close()
+        fact_writer.close()
+        registry.save()
+
+    logger.success(f"Wrote {rows} fact rows for {len(seen_tracks)} tracks to {output_dir}.")
 
 
 if __name__ == "__main__":
@@ -1,28 +1,272 @@
+import shutil
 from pathlib import Path
 
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import typer
 from loguru import logger
-from tqdm import tqdm
 
-from spotify_analysis.config import PROCESSED_DATA_DIR
+from spotify_analysis.config import CRAWL_DATA_DIR, PROCESSED_DATA_DIR
+from spotify_analysis.schema import (
+    IdRegistry,
+    changed_dates,
+    date_fingerprints,
+    read_table,
+    write_parquet,
+)
 
 app = typer.Typer()
 
+ROLLING_WINDOWS = [3, 7]
+GROWTH_PERIODS = [1, 7]
+# Stream rows per track carried over between runs: enough history for the longest window
+HISTORY_ROWS = max(*ROLLING_WINDOWS, *GROWTH_PERIODS)
+
+FEATURE_INPUT_COLUMNS = [
+    "track_id",
+    "date",
+    "stream_daily",
+    "stream_total",
+    "primary_artist_id",
+    "artist_popularity",
+    "artist_follower",
+    "danceability",
+    "energy",
+    "loudness",
+    "speechiness",
+    "acousticness",
+    "instrumentalness",
+    "liveness",
+    "valence",
+    "tempo",
+]
+CHART_COLUMNS = ["track_id", "country", "date", "track_position", "track_release_date"]
+
+
+def load_state(state_dir: Path) -> dict:
+    """Feature state of the previous run: stream history tail, last chart positions, releases
+    and the fingerprints of the fact table's dates it processed."""
+    state = {}
+    for name in ("history", "positions", "releases", "fingerprints"):
+        path = state_dir / f"{name}.parquet"
+        state[name] = pd.read_parquet(path) if path.exists() else None
+    state["last_date"] = state["history"]["date"].max() if state["history"] is not None else None
+    return state
+
+
+def save_state(state_dir: Path, **frames: pd.DataFrame):
+    for name, df in frames.items():
+        write_parquet(
+            pa.Table.from_pandas(df, preserve_index=False), state_dir / f"{name}.parquet"
+        )
+
+
+def read_new_streams(fact_path: Path, since: pd.Timestamp | None) -> pd.DataFrame:
+    # Row group statistics on `date` let Parquet skip everything already processed
+    filters = [("date", ">", since)] if since is not None else None
+    streams = pq.read_table(fact_path, columns=FEATURE_INPUT_COLUMNS, filters=filters)
+    return streams.to_pandas()
+
+
+def rewind_state(state: dict, fact_path: Path, charts: pd.DataFrame, start: pd.Timestamp) -> dict:
+    """The state as a run that stopped the day before `start` would have left it.
+
+    Only the last HISTORY_ROWS stream rows per track and the last chart position per (track,
+    country) before `start` are needed to recompute every feature from `start` on. Release
+    dates are kept: charts are never written for past dates.
+    """
+    before = pq.read_table(
+        fact_path, columns=FEATURE_INPUT_COLUMNS, filters=[("date", "<", start)]
+    ).to_pandas()
+    history = before.sort_values(["track_id", "date"], kind="stable")
+    history = history.groupby("track_id").tail(HISTORY_ROWS).reset_index(drop=True)
+    positions = charts.loc[
+        charts["date"] < start, ["track_id", "country", "date", "track_position"]
+    ]
+    positions = positions.sort_values("date", kind="stable").drop_duplicates(
+        subset=["track_id", "country"], keep="last"
+    )
+    return {
+        **state,
+        "history": history if not history.empty else None,
+        "positions": positions if not positions.empty else None,
+        "last_date": start - pd.Timedelta(days=1),
+    }
+
+
+def add_stream_features(frame: pd.DataFrame) -> pd.DataFrame:
+    """Rolling means and growth rates of daily streams per track; `frame` sorted by track, date."""
+    daily = frame["stream_daily"].astype("float64")
+    by_track = daily.groupby(frame["track_id"])
+
+    for window in ROLLING_WINDOWS:
+        rolling = by_track.rolling(window, min_periods=1).mean()
+        frame[f"stream_mean_{window}d"] = rolling.reset_index(level=0, drop=True).astype("float32")
+
+    for periods in GROWTH_PERIODS:
+        previous = by_track.shift(periods)
+        growth = (daily - previous) / previous.where(previous > 0)
+        frame[f"stream_growth_{periods}d"] = growth.astype("float32")
+    return frame
+
+
+def chart_features(charts: pd.DataFrame) -> pd.DataFrame:
+    """Per (track, date): best position, countries charting and mean position change.
+
+    `charts` holds the previous position of each (track, country) first, then the new days.
+    """
+    charts = charts.sort_values(["track_id", "country", "date"], kind="stable")
+    previous = charts.groupby(["track_id", "country"], observed=True)["track_position"].shift()
+    # Negative when the track climbed the chart
+    charts["position_delta"] = charts["track_position"].astype("float32") - previous.astype(
+        "float32"
+    )
+    return charts.groupby(["track_id", "date"], observed=True).agg(
+        best_position=("track_position", "min"),
+        countries_charting=("country", "nunique"),
+        position_delta_mean=("position_delta", "mean"),
+    )
+
+
+def add_artist_features(frame: pd.DataFrame) -> pd.DataFrame:
+    by_artist_day = frame.groupby(["primary_artist_id", "date"])["stream_daily"]
+    frame["artist_stream_daily"] = by_artist_day.transform("sum").astype("float64")
+    frame["artist_track_count"] = by_artist_day.transform("size").astype("int16")
+    frame["artist_stream_share"] = (
+        frame["stream_daily"]
+        / frame["artist_stream_daily"].where(frame["artist_stream_daily"] > 0)
+    ).astype("float32")
+    return frame
+
+
+def build_features(
+    new_streams: pd.DataFrame,
+    new_charts: pd.DataFrame,
+    state: dict,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Feature rows for the new dates plus the updated (history, positions, releases) state."""
+    history = state["history"]
+    frame = (
+        pd.concat([history, new_streams], ignore_index=True)
+        if history is not None
+        else new_streams
+    )
+    frame = frame.sort_values(["track_id", "date"], kind="stable").reset_index(drop=True)
+    frame = add_stream_features(frame)
+
+    # Release date per track with the day it was first seen on a chart
+    releases = new_charts[["track_id", "track_release_date", "date"]].dropna()
+    if state["releases"] is not None:
+        releases = pd.concat([state["releases"], releases], ignore_index=True)
+    releases = releases.sort_values("date", kind="stable").drop_duplicates(subset="track_id")
+
+    positions = new_charts[["track_id", "country", "date", "track_position"]]
+    if state["positions"] is not None:
+        positions = pd.concat([state["positions"], positions], ignore_index=True)
+
+    last_date = state["last_date"]
+    features = frame if last_date is None else frame[frame["date"] > last_date]
+    features = add_artist_features(features.copy())
+    features = features.merge(
+        releases.rename(columns={"date": "first_charted"}), on="track_id", how="left"
+    )
+    # Not known yet before the track first charted, whether this is a full or a daily run
+    released = features["track_release_date"].where(features["first_charted"] <= features["date"])
+    features["days_since_release"] = (features["date"] - released).dt.days.astype("Int32")
+    features["release_year"] = released.dt.year.astype("Int16")
+    features["release_month"] = released.dt.month.astype("Int8")
+    features["day_of_week"] = features["date"].dt.dayofweek.astype("int8")
+    features = features.drop(columns=["track_release_date", "first_charted"])
+    features = features.merge(
+        chart_features(positions), left_on=["track_id", "date"], right_index=True, how="left"
+    )
+    features["countries_charting"] = features["countries_charting"].fillna(0).astype("int8")
+
+    history = frame.groupby("track_id").tail(HISTORY_ROWS)[new_streams.columns]
+    positions = positions.sort_values("date", kind="stable").drop_duplicates(
+        subset=["track_id", "country"], keep="last"
+    )
+    return features, history, positions, releases
+
+
+def write_feature_partitions(features: pd.DataFrame, output_dir: Path) -> int:
+    """One Parquet file per date under `output_dir`, so each run only adds files."""
+    for date, day in features.groupby("date"):
+        path = output_dir / f"date={date:%Y-%m-%d}" / "part-0.parquet"
+        table = pa.Table.from_pandas(day.drop(columns="date"), preserve_index=False)
+        write_parquet(table, path)
+    return features["date"].nunique()
+
 
 @app.command()
 def main(
-    # ---- REPLACE DEFAULT PATHS AS APPROPRIATE ----
-    input_path: Path = PROCESSED_DATA_DIR / "dataset.csv",
-    output_path: Path = PROCESSED_DATA_DIR / "features.csv",
-    # -----------------------------------------
+    fact_path: Path = PROCESSED_DATA_DIR / "tracks_stream_fact.parquet",
+    raw_dir: Path = CRAWL_DATA_DIR,
+    output_dir: Path = PROCESSED_DATA_DIR / "features",
+    full: bool = typer.Option(False, help="Drop the feature state and recompute all history."),
 ):
-    # ---- REPLACE THIS WITH YOUR OWN CODE ----
-    logger.info("Generating features from dataset...")
-    for i in tqdm(range(10), total=10):
-        if i == 5:
-            logger.info("Something happened for iteration 5.")
-    logger.success("Features generation complete.")
-    # -----------------------------------------
+    """Compute the feature matrix for dates not processed yet.
+
+    The previous run's state (the last few stream rows per track, the last chart position per
+    track and country, release dates) is kept in `output_dir / "_state"`, so a daily run reads
+    and computes only the new `date` rows of the fact table and the crawl.
+
+    The crawler also writes stream rows for days before the newest one. When the fingerprint
+    of a date already processed has changed, the state is rewound to that date and every
+    feature from there on is recomputed, which gives the same rows as a full rebuild.
+    """
+    state_dir = output_dir / "_state"
+    if full and output_dir.exists():
+        shutil.rmtree(output_dir)
+
+    state = load_state(state_dir)
+    fingerprints = date_fingerprints(fact_path)
+    registry = IdRegistry(fact_path.parent / "id_registry")
+    charts = None
+    if state["last_date"] is not None and state["fingerprints"] is not None:
+        late = changed_dates(fingerprints, state["fingerprints"])
+        late = late[late <= state["last_date"]]
+        if not late.empty:
+            logger.info(f"Stream rows changed on {len(late)} dates already processed.")
+            charts = read_table(raw_dir, "tracks", registry, CHART_COLUMNS)
+            state = rewind_state(state, fact_path, charts, late.min())
+
+    last_date = state["last_date"]
+    if last_date is None:
+        logger.info("Computing features for all history...")
+    else:
+        logger.info(f"Computing features for dates after {last_date:%Y-%m-%d}...")
+
+    new_streams = read_new_streams(fact_path, last_date)
+    if new_streams.empty:
+        logger.success("Features are up to date.")
+        return
+
+    if charts is None:
+        charts = read_table(raw_dir, "tracks", registry, CHART_COLUMNS, since=last_date)
+    registry.save()
+    new_charts = charts if last_date is None else charts[charts["date"] > last_date]
+    # The crawl can be ahead of the fact table; later days are picked up by the next run
+    new_charts = new_charts[new_charts["date"] <= new_streams["date"].max()]
+
+    features, history, positions, releases = build_features(new_streams, new_charts, state)
+    days = write_feature_partitions(features, output_dir)
+    save_state(
+        state_dir,
+        history=history,
+        positions=positions,
+        releases=releases,
+        fingerprints=fingerprints,
+    )
+    logger.success(f"Wrote {len(features)} feature rows for {days} dates to {output_dir}.")
+
+
+def read_features(output_dir: Path = PROCESSED_DATA_DIR / "features") -> pd.DataFrame:
+    """The whole feature matrix, one row per (track_id, date)."""
+    features = pd.read_parquet(output_dir, partitioning="hive")
+    features["date"] = pd.to_datetime(features["date"].astype(str))
+    return features.sort_values(["date", "track_id"]).reset_index(drop=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+from spotify_analysis.schema import ID_COLUMNS
+
+TARGET = "target_stream_daily"
+
+
+def add_target(features: pd.DataFrame) -> pd.DataFrame:
+    """Label each row with the track's `stream_daily` of the next day, dropping unlabelled rows."""
+    features = features.sort_values(["track_id", "date"], kind="stable").reset_index(drop=True)
+    by_track = features.groupby("track_id")
+    next_date = by_track["date"].shift(-1)
+    next_streams = by_track["stream_daily"].shift(-1)
+    next_total = by_track["stream_total"].shift(-1)
+    # A gap in the crawl means the next row is not tomorrow
+    labelled = next_date == features["date"] + pd.Timedelta(days=1)
+    labelled &= plausible(features["stream_daily"], features["stream_total"])
+    labelled &= plausible(next_streams, next_total)
+    features[TARGET] = next_streams.where(labelled)
+    return features[features[TARGET].notna()].reset_index(drop=True)
+
+
+def plausible(daily: pd.Series, total: pd.Series) -> pd.Series:
+    """False for the stream source's glitches: zero or negative days, or a day holding the
+    whole all-time total (the first day after a counter reset)."""
+    return ((daily > 0) & (daily < total)).fillna(False).astype(bool)
+
+
+def feature_columns(features: pd.DataFrame) -> list[str]:
+    """Numeric columns usable as model inputs: everything but the ID codes, date and target."""
+    excluded = {*ID_COLUMNS, "date", TARGET}
+    return [
+        column
+        for column in features.columns
+        if column not in excluded and pd.api.types.is_numeric_dtype(features[column])
+    ]
+
+
+def signed_log(values: np.ndarray) -> np.ndarray:
+    # Stream counts span several orders of magnitude (and a few are negative crawl glitches)
+    return np.sign(values) * np.log1p(np.abs(values))
+
+
+def baseline(frame: pd.DataFrame) -> np.ndarray:
+    """log1p of today's streams, the persistence forecast the model corrects."""
+    streams = frame["stream_daily"].to_numpy(dtype="float64", na_value=0.0)
+    return np.log1p(np.maximum(streams, 0.0))
+
+
+class StreamForecaster:
+    """Ridge regression of the log change from today's to tomorrow's streams.
+
+    Predicting the change on top of the persistence forecast (tomorrow = today) keeps the
+    model from having to relearn each track's level. Features are log-scaled and standardized,
+    missing values filled with the training medians. Fitting solves the normal equations in
+    numpy, so the model needs nothing beyond the packages the project already depends on.
+    """
+
+    def __init__(self, features: list[str], alpha: float = 1.0):
+        self.features = list(features)
+        self.alpha = alpha
+
+    def design_matrix(self, frame: pd.DataFrame) -> np.ndarray:
+        values = frame[self.features].to_numpy(dtype="float64", na_value=np.nan)
+        values = signed_log(values)
+        values = np.where(np.isnan(values), self.medians_, values)
+        return (values - self.means_) / self.scales_
+
+    def fit(self, frame: pd.DataFrame, target: pd.Series) -> "StreamForecaster":
+        values = signed_log(frame[self.features].to_numpy(dtype="float64", na_value=np.nan))
+        medians = np.nanmedian(values, axis=0)
+        self.medians_ = np.where(np.isnan(medians), 0.0, medians)
+        values = np.where(np.isnan(values), self.medians_, values)
+        self.means_ = values.mean(axis=0)
+        scales = values.std(axis=0)
+        self.scales_ = np.where(scales > 0, scales, 1.0)
+
+        x = (values - self.means_) / self.scales_
+        y = np.log1p(target.to_numpy(dtype="float64")) - baseline(frame)
+        self.intercept_ = y.mean()
+        gram = x.T @ x + self.alpha * np.eye(x.shape[1])
+        self.coef_ = np.linalg.solve(gram, x.T @ (y - self.intercept_))
+        return self
+
+    def predict_log(self, frame: pd.DataFrame) -> np.ndarray:
+        return baseline(frame) + self.design_matrix(frame) @ self.coef_ + self.intercept_
+
+    def predict(self, frame: pd.DataFrame) -> np.ndarray:
+        """Forecast of next-day `stream_daily`, one value per row of `frame`."""
+        return np.expm1(np.maximum(self.predict_log(frame), 0.0))
+
+    def predict_design(self, design: np.ndarray, base: np.ndarray) -> np.ndarray:
+        """`predict` for rows already run through `design_matrix` and `baseline`."""
+        return np.expm1(np.maximum(base + design @ self.coef_ + self.intercept_, 0.0))
+
+
+def score(model: StreamForecaster, frame: pd.DataFrame, target: pd.Series) -> dict:
+    """RMSE on the log scale the model is fitted on (and of the persistence forecast), plus
+    MAE and MAPE in streams."""
+    actual = target.to_numpy(dtype="float64")
+    predicted = model.predict(frame)
+    log_error = model.predict_log(frame) - np.log1p(actual)
+    positive = actual > 0
+    return {
+        "rmse_log": float(np.sqrt(np.mean(log_error**2))),
+        "rmse_log_persistence": float(np.sqrt(np.mean((baseline(frame) - np.log1p(actual)) ** 2))),
+        "mae": float(np.mean(np.abs(predicted - actual))),
+        "mape": float(np.mean(np.abs(predicted - actual)[positive] / actual[positive])),
+    }
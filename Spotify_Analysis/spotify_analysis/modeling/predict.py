@@ -1,29 +1,363 @@
+import asyncio
+import hashlib
+import json
+import pickle
+import time
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import typer
+from aiohttp import web
 from loguru import logger
 from tqdm import tqdm
 
 from spotify_analysis.config import MODELS_DIR, PROCESSED_DATA_DIR
+from spotify_analysis.modeling.model import StreamForecaster, baseline
+from spotify_analysis.modeling.train import MODEL_FORMAT_VERSION
+from spotify_analysis.schema import ID_REGISTRY_DIR, IdRegistry, write_parquet
 
 app = typer.Typer()
 
+PREDICTIONS_DIR = PROCESSED_DATA_DIR / "predictions"
+LOOKUP_PATH = PREDICTIONS_DIR / "_lookup.parquet"
+
+
+def load_model(model_path: Path) -> tuple[StreamForecaster, dict]:
+    """The pickled model and its metadata sidecar, refusing models of another format."""
+    with open(model_path.with_suffix(".json")) as file:
+        metadata = json.load(file)
+    if metadata["format_version"] != MODEL_FORMAT_VERSION:
+        raise ValueError(
+            f"{model_path} has format version {metadata['format_version']}, "
+            f"expected {MODEL_FORMAT_VERSION}; retrain it."
+        )
+    with open(model_path, "rb") as file:
+        model = pickle.load(file)
+    return model, metadata
+
+
+def feature_partitions(features_dir: Path) -> list[Path]:
+    return sorted(features_dir.glob("date=*"))
+
+
+def partition_stamp(partition: Path) -> str:
+    """Size and modification time of a partition's files, which change when it is rewritten."""
+    return ",".join(
+        f"{path.name}:{path.stat().st_size}:{path.stat().st_mtime_ns}"
+        for path in sorted(partition.glob("*.parquet"))
+    )
+
+
+def partition_fingerprint(features_dir: Path) -> str:
+    # Late stream rows make features.py rewrite dates already written, not only add new ones,
+    # so every partition's stamp is hashed in; the count and newest date keep it readable
+    partitions = feature_partitions(features_dir)
+    if not partitions:
+        return "0:"
+    stamps = "\n".join(
+        f"{partition.name}/{partition_stamp(partition)}" for partition in partitions
+    )
+    digest = hashlib.sha1(stamps.encode()).hexdigest()[:12]
+    return f"{len(partitions)}:{partitions[-1].name}:{digest}"
+
+
+class FeatureLookup:
+    """Latest feature row per track, already turned into model inputs.
+
+    Built once per feature fingerprint and cached in `cache_path`, so the server answers a
+    single-track request with an array index and one dot product instead of reading and
+    transforming features.
+    """
+
+    def __init__(self, model: StreamForecaster, features_dir: Path, cache_path: Path):
+        self.model = model
+        self.features_dir = features_dir
+        self.cache_path = cache_path
+        self.fingerprint = None
+
+    def latest_rows(self, fingerprint: str) -> pd.DataFrame:
+        if self.cache_path.exists():
+            metadata = pq.read_schema(self.cache_path).metadata or {}
+            if metadata.get(b"fingerprint", b"").decode() == fingerprint:
+                return pd.read_parquet(self.cache_path)
+
+        columns = ["track_id", "stream_daily", *self.model.features]
+        frames = []
+        for partition in feature_partitions(self.features_dir):
+            frame = pd.read_parquet(partition, columns=list(dict.fromkeys(columns)))
+            frame["date"] = pd.Timestamp(partition.name.split("=", 1)[1])
+            frames.append(frame)
+        rows = pd.concat(frames, ignore_index=True)
+        rows = rows.drop_duplicates(subset="track_id", keep="last").reset_index(drop=True)
+
+        table = pa.Table.from_pandas(rows, preserve_index=False)
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}), b"fingerprint": fingerprint.encode()}
+        )
+        write_parquet(table, self.cache_path)
+        return rows
+
+    def refresh(self) -> bool:
+        """Reload if feature partitions were added or rewritten since the last load."""
+        fingerprint = partition_fingerprint(self.features_dir)
+        if fingerprint == self.fingerprint:
+            return False
+
+        rows = self.latest_rows(fingerprint)
+        codes = rows["track_id"].to_numpy()
+        position = np.full(codes.max() + 2 if len(codes) else 1, -1, dtype=np.int64)
+        position[codes] = np.arange(len(codes))
+        as_of = np.append(rows["date"].dt.strftime("%Y-%m-%d").to_numpy(dtype=object), None)
+        # Swapped in one assignment so requests scored during a refresh see one version
+        self.snapshot = (self.model.design_matrix(rows), baseline(rows), as_of, position)
+        self.fingerprint = fingerprint
+        logger.info(f"Feature lookup holds {len(rows)} tracks ({fingerprint}).")
+        return True
+
+    def predict(self, codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Forecasts for track codes (NaN for tracks without features) and their feature dates."""
+        design, base, as_of, position = self.snapshot
+        # -1 (unknown ID) and codes newer than the lookup land on the trailing -1 slot
+        codes = np.where((codes >= 0) & (codes < len(position)), codes, -1)
+        rows = position[codes]
+        known = rows >= 0
+        predictions = np.full(len(codes), np.nan)
+        if known.any():
+            predictions[known] = self.model.predict_design(design[rows[known]], base[rows[known]])
+        return predictions, as_of[rows]
+
+
+class MicroBatcher:
+    """Scores concurrent requests together in one vectorized call.
+
+    A batch takes every request queued by the time the scorer runs, then waits up to
+    `max_wait` seconds for more, up to `max_batch_size` tracks. With the default of no wait
+    a lone request is answered immediately and bursts still batch up.
+    """
+
+    def __init__(self, lookup: FeatureLookup, max_batch_size: int = 256, max_wait: float = 0.0):
+        self.lookup = lookup
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+
+    async def submit(self, codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Forecasts and feature dates for `codes`, scored with whatever else is queued."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((codes, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            size = len(pending[0][0])
+            # One loop iteration lets requests that are already being handled queue up too
+            await asyncio.sleep(0)
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch_size:
+                if not self.queue.empty():
+                    item = self.queue.get_nowait()
+                else:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                pending.append(item)
+                size += len(item[0])
+
+            try:
+                predictions, as_of = self.lookup.predict(
+                    np.concatenate([codes for codes, _ in pending])
+                )
+            except Exception as error:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            start = 0
+            for codes, future in pending:
+                end = start + len(codes)
+                if not future.done():
+                    future.set_result((predictions[start:end], as_of[start:end]))
+                start = end
+
+
+async def handle_predict(request: web.Request) -> web.Response:
+    """POST {"track_ids": [...]} or GET /predict/{track_id}."""
+    if request.method == "POST":
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text="body must be JSON")
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text='body must be an object like {"track_ids": [...]}')
+        track_ids = body.get("track_ids", [])
+    else:
+        track_ids = [request.match_info["track_id"]]
+    if not isinstance(track_ids, list) or not all(isinstance(id_, str) for id_ in track_ids):
+        raise web.HTTPBadRequest(text="track_ids must be a list of strings")
+
+    state = request.app["state"]
+    codes = state["track_index"].get_indexer(pd.Index(track_ids, dtype=object))
+    predictions, as_of = await state["batcher"].submit(codes.astype(np.int64))
+
+    results = [
+        {
+            "track_id": track_id,
+            "as_of": date,
+            "predicted_stream_daily": None if np.isnan(value) else round(float(value)),
+        }
+        for track_id, value, date in zip(track_ids, predictions, as_of)
+    ]
+    return web.json_response(
+        {"model_version": state["metadata"]["model_version"], "predictions": results}
+    )
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    state = request.app["state"]
+    return web.json_response(
+        {
+            "model_version": state["metadata"]["model_version"],
+            "features": state["lookup"].fingerprint,
+        }
+    )
+
+
+def create_app(
+    model_path: Path,
+    features_dir: Path,
+    lookup_path: Path,
+    registry_dir: Path,
+    max_batch_size: int = 256,
+    max_wait: float = 0.0,
+    refresh_interval: float = 60.0,
+) -> web.Application:
+    """Scoring app that loads the model and feature lookup once and keeps them warm."""
+
+    async def refresh_periodically(lookup: FeatureLookup, state: dict):
+        while True:
+            await asyncio.sleep(refresh_interval)
+            if await asyncio.to_thread(lookup.refresh):
+                # The new partitions may hold tracks the registry did not know before
+                state["track_index"] = IdRegistry(registry_dir).index("track")
+
+    async def start(app: web.Application):
+        model, metadata = load_model(model_path)
+        lookup = FeatureLookup(model, features_dir, lookup_path)
+        lookup.refresh()
+        batcher = MicroBatcher(lookup, max_batch_size, max_wait)
+        state = {
+            "metadata": metadata,
+            "lookup": lookup,
+            "batcher": batcher,
+            "track_index": IdRegistry(registry_dir).index("track"),
+        }
+        app["state"] = state
+        app["tasks"] = [
+            asyncio.create_task(batcher.run()),
+            asyncio.create_task(refresh_periodically(lookup, state)),
+        ]
+        logger.info(f"Serving model {metadata['model_version']} from {model_path}.")
+
+    async def stop(app: web.Application):
+        for task in app["tasks"]:
+            task.cancel()
+
+    app = web.Application()
+    app.router.add_post("/predict", handle_predict)
+    app.router.add_get("/predict/{track_id}", handle_predict)
+    app.router.add_get("/health", handle_health)
+    app.on_startup.append(start)
+    app.on_cleanup.append(stop)
+    return app
+
+
+@app.command()
+def batch(
+    features_dir: Path = PROCESSED_DATA_DIR / "features",
+    model_path: Path = MODELS_DIR / "model.pkl",
+    output_dir: Path = PREDICTIONS_DIR,
+    chunksize: int = 100_000,
+):
+    """Score every feature partition into `output_dir/date=YYYY-MM-DD/part-0.parquet`.
+
+    A partition already scored by the same model version from the same feature files is
+    skipped, so the daily run only scores the new date and the dates features.py rewrote for
+    late stream rows. Each row is the forecast of the track's streams on the next day.
+    """
+    model, metadata = load_model(model_path)
+    version = metadata["model_version"].encode()
+    columns = list(dict.fromkeys(["track_id", "stream_daily", *model.features]))
+
+    scored = rows = 0
+    started = time.perf_counter()
+    for partition in tqdm(feature_partitions(features_dir), desc="partitions"):
+        path = output_dir / partition.name / "part-0.parquet"
+        stamp = partition_stamp(partition).encode()
+        if path.exists():
+            scored_with = pq.read_schema(path).metadata or {}
+            if (
+                scored_with.get(b"model_version") == version
+                and scored_with.get(b"features") == stamp
+            ):
+                continue
+
+        parts = []
+        for file_path in sorted(partition.glob("*.parquet")):
+            for chunk in pq.ParquetFile(file_path).iter_batches(chunksize, columns=columns):
+                chunk = chunk.to_pandas()
+                predictions = model.predict(chunk).astype("float32")
+                parts.append(
+                    pa.table(
+                        {"track_id": chunk["track_id"], "predicted_stream_daily": predictions}
+                    )
+                )
+        table = pa.concat_tables(parts)
+        scored_by = {b"model_version": version, b"features": stamp}
+        write_parquet(table.replace_schema_metadata(scored_by), path)
+        scored += 1
+        rows += len(table)
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"Scored {rows} rows in {scored} new or changed partitions in {elapsed:.2f}s.")
+
+    # Warm the lookup the scoring server starts from
+    FeatureLookup(model, features_dir, output_dir / LOOKUP_PATH.name).refresh()
+    logger.success(f"Predictions of model {metadata['model_version']} are in {output_dir}.")
+
 
 @app.command()
-def main(
-    # ---- REPLACE DEFAULT PATHS AS APPROPRIATE ----
-    features_path: Path = PROCESSED_DATA_DIR / "test_features.csv",
+def serve(
+    features_dir: Path = PROCESSED_DATA_DIR / "features",
     model_path: Path = MODELS_DIR / "model.pkl",
-    predictions_path: Path = PROCESSED_DATA_DIR / "test_predictions.csv",
-    # -----------------------------------------
+    lookup_path: Path = LOOKUP_PATH,
+    registry_dir: Path = ID_REGISTRY_DIR,
+    host: str = "127.0.0.1",
+    port: int = 8085,
+    socket: Path = typer.Option(None, help="Listen on this Unix socket instead of host:port."),
+    max_batch_size: int = 256,
+    max_wait_ms: float = typer.Option(0.0, help="Extra wait for a batch to fill up."),
 ):
-    # ---- REPLACE THIS WITH YOUR OWN CODE ----
-    logger.info("Performing inference for model...")
-    for i in tqdm(range(10), total=10):
-        if i == 5:
-            logger.info("Something happened for iteration 5.")
-    logger.success("Inference complete.")
-    # -----------------------------------------
+    """Long-lived scoring server: GET /predict/<track_id> or POST /predict {"track_ids": [...]}.
+
+    Concurrent requests are micro-batched into one vectorized call (see MicroBatcher).
+    """
+    server = create_app(
+        model_path, features_dir, lookup_path, registry_dir, max_batch_size, max_wait_ms / 1000
+    )
+    if socket is not None:
+        web.run_app(server, path=str(socket), print=None)
+    else:
+        web.run_app(server, host=host, port=port, print=None)
 
 
 if __name__ == "__main__":
@@ -1,29 +1,198 @@
+import json
+import os
+import pickle
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
 import typer
 from loguru import logger
 from tqdm import tqdm
 
 from spotify_analysis.config import MODELS_DIR, PROCESSED_DATA_DIR
+from spotify_analysis.features import read_features
+from spotify_analysis.modeling.model import (
+    TARGET,
+    StreamForecaster,
+    add_target,
+    feature_columns,
+    score,
+)
 
 app = typer.Typer()
 
+# Bump when the pickled model or the sidecar layout changes incompatibly
+MODEL_FORMAT_VERSION = 1
+
+# Labelled feature matrix of a worker process, loaded once by `load_worker_data`
+worker_data = None
+
+
+def time_folds(dates: pd.Series, n_folds: int, validation_days: int) -> list[tuple]:
+    """Expanding-window splits: (train_end, validation_start, validation_end) per fold.
+
+    Each fold validates on the `validation_days` dates following its training window, with
+    one date left out in between since a row's target is the next day's streams.
+    """
+    days = np.sort(dates.unique())
+    folds = []
+    for fold in range(n_folds):
+        end = len(days) - (n_folds - 1 - fold) * validation_days
+        start = end - validation_days
+        if start < 2:
+            raise ValueError(
+                f"{len(days)} labelled dates are too few for {n_folds} folds of "
+                f"{validation_days} days."
+            )
+        folds.append((days[start - 2], days[start], days[end - 1]))
+    return folds
+
+
+def load_worker_data(features_dir: Path):
+    global worker_data
+    worker_data = add_target(read_features(features_dir))
+
+
+def evaluate(fold: int, split: tuple, alpha: float, features: list[str]) -> dict:
+    """Fit one candidate on one fold in a worker process; timed and memory-traced."""
+    train_end, validation_start, validation_end = split
+    train = worker_data[worker_data["date"] <= train_end]
+    validation = worker_data["date"].between(validation_start, validation_end)
+    validation = worker_data[validation]
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    model = StreamForecaster(features, alpha).fit(train, train[TARGET])
+    metrics = score(model, validation, validation[TARGET])
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "fold": fold,
+        "alpha": alpha,
+        "train_rows": len(train),
+        "validation_rows": len(validation),
+        "seconds": seconds,
+        "peak_mb": peak / 1024**2,
+        **metrics,
+    }
+
+
+def summarize(results: list[dict]) -> pd.DataFrame:
+    """Mean validation metrics per alpha, best (lowest log RMSE) first."""
+    frame = pd.DataFrame(results)
+    return (
+        frame.groupby("alpha")[["rmse_log", "rmse_log_persistence", "mae", "mape"]]
+        .mean()
+        .sort_values("rmse_log")
+        .reset_index()
+    )
+
+
+def save_model(model: StreamForecaster, model_path: Path, metadata: dict):
+    """Pickle the model and write its metadata to a JSON file next to it."""
+    model_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(model_path, "wb") as file:
+        pickle.dump(model, file)
+    with open(model_path.with_suffix(".json"), "w") as file:
+        json.dump(metadata, file, indent=2)
+
 
 @app.command()
 def main(
-    # ---- REPLACE DEFAULT PATHS AS APPROPRIATE ----
-    features_path: Path = PROCESSED_DATA_DIR / "features.csv",
-    labels_path: Path = PROCESSED_DATA_DIR / "labels.csv",
+    features_dir: Path = PROCESSED_DATA_DIR / "features",
     model_path: Path = MODELS_DIR / "model.pkl",
-    # -----------------------------------------
+    alphas: list[float] = typer.Option([1.0, 10.0, 100.0, 1000.0], "--alpha"),
+    n_folds: int = 4,
+    validation_days: int = 3,
+    workers: int = typer.Option(os.cpu_count(), help="Processes for the folds x alphas grid."),
+    force: bool = typer.Option(
+        False, help="Replace an existing model even if the new one does not beat persistence."
+    ),
 ):
-    # ---- REPLACE THIS WITH YOUR OWN CODE ----
-    logger.info("Training some model...")
-    for i in tqdm(range(10), total=10):
-        if i == 5:
-            logger.info("Something happened for iteration 5.")
-    logger.success("Modeling training complete.")
-    # -----------------------------------------
+    """Forecast next-day streams per track: time-based CV over `alphas`, then refit on all dates.
+
+    Every (fold, alpha) candidate runs in its own task of a process pool. Workers load the
+    feature matrix once each, so only the fold boundaries and the alpha are sent per task.
+
+    The best alpha's CV log RMSE is compared with persistence (tomorrow = today). A model that
+    does not beat it is only saved when there is no model yet, or with --force.
+    """
+    data = add_target(read_features(features_dir))
+    features = feature_columns(data)
+    folds = time_folds(data["date"], n_folds, validation_days)
+    logger.info(
+        f"Training on {len(data)} rows, {len(features)} features, "
+        f"{data['date'].nunique()} dates; {n_folds} folds x {len(alphas)} alphas."
+    )
+
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=load_worker_data, initargs=(features_dir,)
+    ) as pool:
+        tasks = [
+            pool.submit(evaluate, fold, split, alpha, features)
+            for fold, split in enumerate(folds)
+            for alpha in alphas
+        ]
+        for task in tqdm(as_completed(tasks), total=len(tasks), desc="folds"):
+            result = task.result()
+            logger.info(
+                f"Fold {result['fold']} alpha={result['alpha']:g}: "
+                f"rmse_log={result['rmse_log']:.4f}, mape={result['mape']:.3f} "
+                f"({result['train_rows']} train rows) in {result['seconds']:.2f}s, "
+                f"peak {result['peak_mb']:.1f} MB"
+            )
+            results.append(result)
+
+    summary = summarize(results)
+    best_alpha = float(summary["alpha"].iloc[0])
+    rmse_log = float(summary["rmse_log"].iloc[0])
+    rmse_log_persistence = float(summary["rmse_log_persistence"].iloc[0])
+    beats_persistence = rmse_log < rmse_log_persistence
+    logger.info(f"Cross-validation by alpha:\n{summary.to_string(index=False)}")
+    if not beats_persistence:
+        logger.warning(
+            f"Best model (alpha={best_alpha:g}, rmse_log={rmse_log:.4f}) does not beat "
+            f"persistence (rmse_log={rmse_log_persistence:.4f})."
+        )
+        if model_path.exists() and not force:
+            logger.warning(f"Keeping the current {model_path}; pass --force to replace it.")
+            return
+
+    started = time.perf_counter()
+    model = StreamForecaster(features, best_alpha).fit(data, data[TARGET])
+    logger.info(f"Refit on all {len(data)} rows in {time.perf_counter() - started:.2f}s.")
+
+    trained_at = datetime.now(timezone.utc)
+    metadata = {
+        "format_version": MODEL_FORMAT_VERSION,
+        "model_version": trained_at.strftime("%Y%m%d%H%M%S"),
+        "trained_at": trained_at.isoformat(),
+        "model": type(model).__name__,
+        "target": "stream_daily of the next day",
+        "features": features,
+        "alpha": best_alpha,
+        "train_window": {
+            "start": f"{data['date'].min():%Y-%m-%d}",
+            "end": f"{data['date'].max():%Y-%m-%d}",
+            "rows": len(data),
+        },
+        "metrics": {
+            "rmse_log": rmse_log,
+            "rmse_log_persistence": rmse_log_persistence,
+            "beats_persistence": beats_persistence,
+            "cv": summary.to_dict(orient="records"),
+            "folds": sorted(results, key=lambda result: (result["fold"], result["alpha"])),
+        },
+    }
+    save_model(model, model_path, metadata)
+    logger.success(f"Saved model (alpha={best_alpha:g}) to {model_path}.")
 
 
 if __name__ == "__main__":
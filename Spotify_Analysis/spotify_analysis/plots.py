@@ -1,28 +1,232 @@
+import hashlib
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
 import typer
 from loguru import logger
 from tqdm import tqdm
 
 from spotify_analysis.config import FIGURES_DIR, PROCESSED_DATA_DIR
+from spotify_analysis.rollups import ROLLUP_DIR, Rollups
+from spotify_analysis.schema import IdRegistry
 
 app = typer.Typer()
 
+# Bump to re-render every figure after changing how they are drawn
+FIGURE_STYLE_VERSION = 1
+FINGERPRINTS_FILE = ".fingerprints.json"
+BOX_STATS_FILE = ".box_stats.json"
+
+BOXPLOT_COLUMNS = [
+    "stream_daily",
+    "stream_total",
+    "artist_popularity",
+    "artist_follower",
+    "danceability",
+    "energy",
+    "acousticness",
+    "valence",
+    "tempo",
+]
+
+
+def box_stats(fact_path: Path) -> list[dict]:
+    """Quartiles and 1.5 IQR whiskers per numeric column, the input of Axes.bxp.
+
+    Columns without any value are left out, as there is nothing to draw for them.
+    """
+    values = pd.read_parquet(fact_path, columns=BOXPLOT_COLUMNS)
+    stats = []
+    for column in BOXPLOT_COLUMNS:
+        data = values[column].dropna().to_numpy(dtype="float64")
+        if not len(data):
+            logger.warning(f"{column} has no values; it is left out of the boxplots.")
+            continue
+        q1, med, q3 = np.percentile(data, [25, 50, 75])
+        iqr = q3 - q1
+        inside = data[(data >= q1 - 1.5 * iqr) & (data <= q3 + 1.5 * iqr)]
+        stats.append(
+            {
+                "label": column,
+                "q1": float(q1),
+                "med": float(med),
+                "q3": float(q3),
+                "whislo": float(inside.min()),
+                "whishi": float(inside.max()),
+                "fliers": [],
+            }
+        )
+    return stats
+
+
+def cached_box_stats(fact_path: Path, cache_path: Path) -> list[dict]:
+    """`box_stats` of the fact table, recomputed only when the file changed since the last run.
+
+    The rollups do not carry the audio features, so the stats come from the whole fact table;
+    they are kept next to the figures with the table's size and modification time.
+    """
+    stat = fact_path.stat()
+    stamp = f"{stat.st_size}:{stat.st_mtime_ns}"
+    if cache_path.exists():
+        cached = json.loads(cache_path.read_text())
+        if cached["fact"] == stamp:
+            return cached["stats"]
+    stats = box_stats(fact_path)
+    cache_path.write_text(json.dumps({"fact": stamp, "stats": stats}, indent=2))
+    return stats
+
+
+def figure_data(rollups: Rollups, fact_path: Path, box_stats_path: Path) -> dict:
+    """The small aggregates each figure is drawn from, read from the rollups."""
+    country_daily = rollups.frame("country_daily")
+    by_release = rollups.streams_by_release_date()
+    top_artists = rollups.top_artists(10)
+    # Names come from artists.parquet of the dataset command; without it the IDs label the bars
+    artist_labels = top_artists["artist_id"]
+    if "artist_name" in top_artists.columns:
+        artist_labels = top_artists["artist_name"].fillna(artist_labels)
+    data = {
+        "top_tracks": rollups.top_tracks(10).set_index("track_name")["stream_total"],
+        "top_artists": top_artists.set_index(artist_labels)["stream_total"],
+        "daily_streams": rollups.time_series("track"),
+        "country_trends": country_daily.pivot(
+            index="date", columns="country", values="stream_daily"
+        ),
+        "streams_by_release_year": by_release.groupby(by_release.index.year).sum(),
+        "daily_leaders": rollups.daily_leaders().set_index("date")[["track_name", "stream_daily"]],
+    }
+    if fact_path.exists():
+        stats = cached_box_stats(fact_path, box_stats_path)
+        if stats:
+            data["numeric_boxplots"] = stats
+    return data
+
+
+def fingerprint(name: str, data) -> str:
+    digest = hashlib.sha256(f"{name}:{FIGURE_STYLE_VERSION}".encode())
+    if isinstance(data, (pd.Series, pd.DataFrame)):
+        digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+        labels = data.columns if isinstance(data, pd.DataFrame) else [data.name]
+        digest.update(repr(list(labels)).encode())
+    else:
+        digest.update(pickle.dumps(data))
+    return digest.hexdigest()
+
+
+def render_top_bars(data: pd.Series, ax, title: str, horizontal: bool):
+    # Log scale as in the notebook: the top entries differ by orders of magnitude otherwise
+    (ax.barh if horizontal else ax.bar)(data.index.astype(str), data.to_numpy())
+    if horizontal:
+        ax.set_xscale("log")
+        ax.invert_yaxis()
+    else:
+        ax.set_yscale("log")
+        ax.tick_params(axis="x", labelrotation=45)
+        for label in ax.get_xticklabels():
+            label.set_horizontalalignment("right")
+    ax.set_title(title)
+
+
+def draw(name: str, data, ax):
+    if name == "top_tracks":
+        render_top_bars(data, ax, "Top 10 tracks by total streams", horizontal=False)
+    elif name == "top_artists":
+        render_top_bars(data, ax, "Top 10 artists by total streams", horizontal=True)
+    elif name == "daily_streams":
+        ax.plot(data.index, data.to_numpy(), marker="o")
+        ax.set_title("Daily streams of charting tracks")
+    elif name == "country_trends":
+        for country in data.columns:
+            ax.plot(data.index, data[country].to_numpy(), label=str(country))
+        ax.legend()
+        ax.set_title("Daily streams of each country's chart")
+    elif name == "streams_by_release_year":
+        ax.bar(data.index.astype(int).astype(str), data.to_numpy())
+        ax.tick_params(axis="x", labelrotation=90)
+        ax.set_title("Streams by track release year")
+    elif name == "daily_leaders":
+        ax.bar(data.index.strftime("%m-%d"), data["stream_daily"].to_numpy())
+        # Names at the foot of the bars, where they cannot run into the title
+        for x, track in enumerate(data["track_name"]):
+            ax.annotate(str(track), (x, 0), rotation=90, fontsize=7, ha="center", va="bottom")
+        ax.set_title("Most streamed track per day")
+    elif name == "numeric_boxplots":
+        # One panel per column: their scales differ by up to nine orders of magnitude
+        for axis, stats in zip(ax, data):
+            axis.bxp([stats], showfliers=False)
+    else:
+        raise ValueError(f"Unknown figure {name}")
+
+
+def render(name: str, data, path: Path) -> str:
+    """Draw one figure with the Agg backend in a worker process."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    if name == "numeric_boxplots":
+        fig, ax = plt.subplots(1, len(data), figsize=(2 * len(data), 5), squeeze=False)
+        ax = ax[0]
+        fig.suptitle("Distribution of numeric columns")
+    else:
+        fig, ax = plt.subplots(figsize=(14, 6))
+    draw(name, data, ax)
+    fig.tight_layout()
+    tmp_path = path.with_name(f".{path.name}")
+    fig.savefig(tmp_path, dpi=100, format=path.suffix[1:])
+    plt.close(fig)
+    os.replace(tmp_path, path)
+    return name
+
 
 @app.command()
 def main(
-    # ---- REPLACE DEFAULT PATHS AS APPROPRIATE ----
-    input_path: Path = PROCESSED_DATA_DIR / "dataset.csv",
-    output_path: Path = FIGURES_DIR / "plot.png",
-    # -----------------------------------------
+    rollup_dir: Path = ROLLUP_DIR,
+    fact_path: Path = PROCESSED_DATA_DIR / "tracks_stream_fact.parquet",
+    output_dir: Path = FIGURES_DIR,
+    workers: int = typer.Option(os.cpu_count(), help="Processes rendering figures."),
+    force: bool = typer.Option(False, help="Re-render figures whose data did not change."),
 ):
-    # ---- REPLACE THIS WITH YOUR OWN CODE ----
-    logger.info("Generating plot from data...")
-    for i in tqdm(range(10), total=10):
-        if i == 5:
-            logger.info("Something happened for iteration 5.")
-    logger.success("Plot generation complete.")
-    # -----------------------------------------
+    """Render the report figures from the rollups into `output_dir`.
+
+    Each figure's input aggregate is fingerprinted; figures whose fingerprint matches the
+    last render (kept in `output_dir/.fingerprints.json`) are skipped, the others are drawn
+    in parallel worker processes. The boxplot stats of the fact table are only recomputed
+    when the table changed (see `cached_box_stats`).
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    fingerprints_path = output_dir / FINGERPRINTS_FILE
+    previous = json.loads(fingerprints_path.read_text()) if fingerprints_path.exists() else {}
+
+    rollups = Rollups(rollup_dir, IdRegistry(rollup_dir.parent / "id_registry"))
+    data = figure_data(rollups, fact_path, output_dir / BOX_STATS_FILE)
+    current = {name: fingerprint(name, value) for name, value in data.items()}
+    stale = [
+        name
+        for name in data
+        if force
+        or previous.get(name) != current[name]
+        or not (output_dir / f"{name}.png").exists()
+    ]
+    logger.info(f"Rendering {len(stale)} of {len(data)} figures into {output_dir}...")
+
+    rendered = dict(previous)
+    if stale:
+        with ProcessPoolExecutor(max_workers=min(workers, len(stale))) as pool:
+            tasks = [
+                pool.submit(render, name, data[name], output_dir / f"{name}.png") for name in stale
+            ]
+            for task in tqdm(as_completed(tasks), total=len(tasks), desc="figures"):
+                name = task.result()
+                rendered[name] = current[name]
+    fingerprints_path.write_text(json.dumps(rendered, indent=2))
+    logger.success(f"Figures are up to date ({len(data) - len(stale)} unchanged).")
 
 
 if __name__ == "__main__":
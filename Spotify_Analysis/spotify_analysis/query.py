@@ -0,0 +1,178 @@
+import hashlib
+import os
+import re
+import time
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import typer
+from loguru import logger
+
+from spotify_analysis.config import CRAWL_DATA_DIR, PROCESSED_DATA_DIR
+from spotify_analysis.schema import write_parquet
+
+app = typer.Typer()
+
+QUERY_CACHE_DIR = PROCESSED_DATA_DIR / "query_cache"
+
+
+def quote(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def discover_sources(raw_dir: Path, processed_dir: Path) -> dict[str, tuple[Path, str]]:
+    """View name -> (path, kind) for every dataset the crawler and the package have written.
+
+    Partitioned Parquet directories under `raw_dir` win over a CSV of the same name; Parquet
+    files at the top of `processed_dir` (fact table, bridge, dimensions) are added by stem.
+    """
+    sources = {}
+    if raw_dir.is_dir():
+        for path in sorted(raw_dir.glob("*.csv")):
+            sources[path.stem] = (path, "csv")
+        for path in sorted(raw_dir.iterdir()):
+            if path.is_dir() and next(path.rglob("*.parquet"), None) is not None:
+                sources[path.name] = (path, "parquet_dir")
+    if processed_dir.is_dir():
+        for path in sorted(processed_dir.glob("*.parquet")):
+            sources.setdefault(path.stem, (path, "parquet"))
+    return sources
+
+
+def source_fingerprint(path: Path, kind: str) -> str:
+    """Changes whenever a file of the source is added, removed or rewritten."""
+    files = sorted(path.rglob("*.parquet")) if kind == "parquet_dir" else [path]
+    digest = hashlib.sha256()
+    for file_path in files:
+        stat = file_path.stat()
+        digest.update(
+            f"{file_path.relative_to(path.parent)}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+        )
+    return digest.hexdigest()
+
+
+class QueryEngine:
+    """SQL over the crawl outputs with an embedded DuckDB, no database server needed.
+
+    Each dataset is a view over its files, so DuckDB reads only the columns a query uses,
+    skips Parquet row groups and `date=`/`country=` partitions excluded by its filters, and
+    scans with `threads` threads. Results are cached as Parquet keyed by the query text and
+    the fingerprints of the views it references, so a repeated query returns without
+    scanning until one of its inputs gets a new partition.
+    """
+
+    def __init__(
+        self,
+        raw_dir: Path = CRAWL_DATA_DIR,
+        processed_dir: Path = PROCESSED_DATA_DIR,
+        cache_dir: Path | None = QUERY_CACHE_DIR,
+        threads: int | None = None,
+        max_cache_entries: int = 256,
+    ):
+        self.cache_dir = cache_dir
+        self.max_cache_entries = max_cache_entries
+        self.sources = discover_sources(Path(raw_dir), Path(processed_dir))
+        self.connection = duckdb.connect()
+        self.connection.execute(f"SET threads TO {threads or os.cpu_count()}")
+        for name, (path, kind) in self.sources.items():
+            self.connection.execute(
+                f'CREATE VIEW "{name}" AS SELECT * FROM {self.scan(path, kind)}'
+            )
+
+    @staticmethod
+    def scan(path: Path, kind: str) -> str:
+        if kind == "csv":
+            return f"read_csv_auto({quote(path)}, header = true)"
+        if kind == "parquet_dir":
+            pattern = quote(path / "**" / "*.parquet")
+            return f"read_parquet({pattern}, hive_partitioning = true, union_by_name = true)"
+        return f"read_parquet({quote(path)})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def referenced_views(self, sql: str) -> list[str]:
+        return [name for name in self.sources if re.search(rf"\b{re.escape(name)}\b", sql)]
+
+    def cache_key(self, sql: str) -> str:
+        digest = hashlib.sha256(" ".join(sql.split()).encode())
+        for name in self.referenced_views(sql):
+            digest.update(f"{name}={source_fingerprint(*self.sources[name])}".encode())
+        return digest.hexdigest()
+
+    def prune_cache(self):
+        entries = sorted(self.cache_dir.glob("*.parquet"), key=lambda path: path.stat().st_mtime)
+        for path in entries[: max(len(entries) - self.max_cache_entries, 0)]:
+            path.unlink(missing_ok=True)
+
+    def sql(self, sql: str, use_cache: bool = True) -> pd.DataFrame:
+        """Run `sql` and return the result, from the cache if its inputs are unchanged."""
+        if not use_cache or self.cache_dir is None:
+            return self.connection.execute(sql).df()
+
+        path = self.cache_dir / f"{self.cache_key(sql)}.parquet"
+        if path.exists():
+            # Touch so pruning drops the least recently used results first
+            path.touch()
+            return pd.read_parquet(path)
+
+        result = self.connection.execute(sql).df()
+        write_parquet(pa.Table.from_pandas(result, preserve_index=False), path)
+        self.prune_cache()
+        return result
+
+    def explain(self, sql: str) -> str:
+        """DuckDB's physical plan, showing the pushed-down filters and projected columns."""
+        return "\n".join(row[1] for row in self.connection.execute(f"EXPLAIN {sql}").fetchall())
+
+
+@app.command()
+def query(
+    sql: str = typer.Argument(..., help="SQL over the views listed by the `tables` command."),
+    output: Path = typer.Option(None, help="Write the result to a .csv or .parquet file."),
+    raw_dir: Path = CRAWL_DATA_DIR,
+    processed_dir: Path = PROCESSED_DATA_DIR,
+    threads: int = typer.Option(None, help="Worker threads (default: all cores)."),
+    cache: bool = typer.Option(True, help="Reuse results of the same query on unchanged inputs."),
+    explain: bool = typer.Option(False, help="Print the query plan instead of running it."),
+    max_rows: int = 50,
+):
+    """Run SQL across tracks, artists, audio features, streams and the processed tables."""
+    with QueryEngine(raw_dir, processed_dir, threads=threads) as engine:
+        if explain:
+            typer.echo(engine.explain(sql))
+            return
+
+        started = time.perf_counter()
+        result = engine.sql(sql, use_cache=cache)
+        logger.info(f"{len(result)} rows in {(time.perf_counter() - started) * 1000:.1f} ms.")
+
+    if output is None:
+        typer.echo(result.to_string(max_rows=max_rows))
+    elif output.suffix == ".parquet":
+        pq.write_table(pa.Table.from_pandas(result, preserve_index=False), output)
+    else:
+        result.to_csv(output, index=False)
+
+
+@app.command()
+def tables(raw_dir: Path = CRAWL_DATA_DIR, processed_dir: Path = PROCESSED_DATA_DIR):
+    """List the views `query` can use, with their columns."""
+    with QueryEngine(raw_dir, processed_dir, cache_dir=None) as engine:
+        for name, (path, kind) in engine.sources.items():
+            columns = engine.connection.execute(f'DESCRIBE "{name}"').fetchall()
+            typer.echo(f"{name} ({kind}: {path})")
+            typer.echo("    " + ", ".join(f"{column[0]} {column[1]}" for column in columns))
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,269 @@
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import typer
+from loguru import logger
+
+from spotify_analysis.config import CRAWL_DATA_DIR, PROCESSED_DATA_DIR
+from spotify_analysis.schema import (
+    COLUMN_TYPES,
+    IdRegistry,
+    changed_dates,
+    date_fingerprints,
+    read_table,
+    write_parquet,
+)
+
+app = typer.Typer()
+
+ROLLUP_DIR = PROCESSED_DATA_DIR / "rollups"
+
+FACT_COLUMNS = [
+    "track_id",
+    "date",
+    "stream_daily",
+    "stream_total",
+    "track_name",
+    "primary_artist_id",
+]
+CHART_COLUMNS = ["track_id", "country", "date", "track_position", "track_release_date"]
+
+
+def rollup_path(rollup_dir: Path, name: str) -> Path:
+    return rollup_dir / f"{name}.parquet"
+
+
+def last_rolled_date(rollup_dir: Path) -> pd.Timestamp | None:
+    """Newest date all rollups hold; the track rollup is written last."""
+    path = rollup_path(rollup_dir, "track_daily")
+    if not path.exists():
+        return None
+    dates = pd.read_parquet(path, columns=["date"])["date"]
+    return dates.max() if len(dates) else None
+
+
+def first_releases(charts: pd.DataFrame, releases: pd.DataFrame | None = None) -> pd.DataFrame:
+    """Release date per track as first seen on a chart, with that day (`first_charted`)."""
+    first_seen = charts[["track_id", "track_release_date", "date"]].dropna()
+    first_seen = first_seen.rename(columns={"date": "first_charted"})
+    releases = pd.concat([releases, first_seen]).sort_values("first_charted", kind="stable")
+    return releases.drop_duplicates("track_id").reset_index(drop=True)
+
+
+def track_daily(
+    streams: pd.DataFrame, charts: pd.DataFrame, releases: pd.DataFrame
+) -> pd.DataFrame:
+    """One row per (date, track): streams plus the track's chart presence that day.
+
+    The release date is only filled in from the day the track first charted, as a daily update
+    learns it then, so rebuilding from scratch gives the same rows as updating day by day.
+    """
+    chart_days = charts.groupby(["date", "track_id"], observed=True).agg(
+        countries_charting=("country", "nunique"),
+        best_position=("track_position", "min"),
+    )
+    rollup = streams.merge(chart_days, left_on=["date", "track_id"], right_index=True, how="left")
+    rollup = rollup.merge(releases, on="track_id", how="left")
+    rollup["track_release_date"] = rollup["track_release_date"].where(
+        rollup["first_charted"] <= rollup["date"]
+    )
+    rollup["countries_charting"] = rollup["countries_charting"].fillna(0).astype("int8")
+    rollup = rollup.drop(columns="first_charted")
+    return rollup.sort_values(["date", "track_id"]).reset_index(drop=True)
+
+
+def artist_daily(streams: pd.DataFrame, bridge: pd.DataFrame) -> pd.DataFrame:
+    """One row per (date, artist), crediting every artist of a track with its streams."""
+    credited = streams[["date", "track_id", "stream_daily", "stream_total"]].merge(
+        bridge[["track_id", "artist_id"]], on="track_id"
+    )
+    return (
+        credited.groupby(["date", "artist_id"])
+        .agg(
+            stream_daily=("stream_daily", "sum"),
+            stream_total=("stream_total", "sum"),
+            track_count=("track_id", "nunique"),
+        )
+        .reset_index()
+    )
+
+
+def country_daily(streams: pd.DataFrame, charts: pd.DataFrame) -> pd.DataFrame:
+    """One row per (date, country): the chart's size and the streams of the tracks on it."""
+    charting = charts[["date", "country", "track_id"]].drop_duplicates()
+    charting = charting.merge(
+        streams[["date", "track_id", "stream_daily", "stream_total"]],
+        on=["date", "track_id"],
+        how="left",
+    )
+    # Tracks whose streams are not crawled yet count as 0, keeping the sums integers on every run
+    streams_columns = ["stream_daily", "stream_total"]
+    charting[streams_columns] = charting[streams_columns].fillna(0).astype("int64")
+    return (
+        charting.groupby(["date", "country"], observed=True)
+        .agg(
+            track_count=("track_id", "nunique"),
+            stream_daily=("stream_daily", "sum"),
+            stream_total=("stream_total", "sum"),
+        )
+        .reset_index()
+    )
+
+
+def append_rollup(path: Path, new_rows: pd.DataFrame):
+    """Add new dates to a rollup file, replacing any rows it already had for those dates."""
+    if path.exists():
+        current = pd.read_parquet(path)
+        current = current[~current["date"].isin(new_rows["date"].unique())]
+        new_rows = pd.concat([current, new_rows], ignore_index=True)
+        # Categoricals with different categories concatenate to plain strings
+        for column in new_rows.columns:
+            if COLUMN_TYPES.get(column) == "category" and new_rows[column].dtype != "category":
+                new_rows[column] = new_rows[column].astype("category")
+    new_rows = new_rows.sort_values(["date", new_rows.columns[1]], kind="stable")
+    write_parquet(pa.Table.from_pandas(new_rows, preserve_index=False), path)
+
+
+@app.command()
+def main(
+    fact_path: Path = PROCESSED_DATA_DIR / "tracks_stream_fact.parquet",
+    raw_dir: Path = CRAWL_DATA_DIR,
+    output_dir: Path = ROLLUP_DIR,
+    full: bool = typer.Option(False, help="Drop the rollups and rebuild them from all history."),
+):
+    """Roll changed days of the fact table up by (date, track), (date, artist) and (date, country).
+
+    The crawler writes stream rows for past days too, so the fingerprint of every fact date
+    is kept next to the rollups. Only fact rows and crawl partitions of dates that are new or
+    whose fingerprint changed are read, so the daily update costs a few days of raw rows plus
+    rewriting the (small) rollup files.
+    """
+    if full and output_dir.exists():
+        shutil.rmtree(output_dir)
+
+    fingerprints = date_fingerprints(fact_path)
+    fingerprints_path = rollup_path(output_dir, "_fingerprints")
+    if fingerprints_path.exists():
+        dates = changed_dates(fingerprints, pd.read_parquet(fingerprints_path))
+    else:
+        # Rolled up before fingerprints were kept: only later dates can be told apart
+        last_date = last_rolled_date(output_dir)
+        dates = fingerprints["date"]
+        dates = dates[dates > last_date] if last_date is not None else dates
+    if dates.empty:
+        logger.success("Rollups are up to date.")
+        return
+
+    filters = [("date", "in", list(dates))]
+    streams = pq.read_table(fact_path, columns=FACT_COLUMNS, filters=filters).to_pandas()
+    registry = IdRegistry(fact_path.parent / "id_registry")
+    since = dates.min() - pd.Timedelta(days=1)
+    charts = read_table(raw_dir, "tracks", registry, CHART_COLUMNS, since=since)
+    registry.save()
+    charts = charts[charts["date"].isin(dates)]
+    bridge = pd.read_parquet(fact_path.parent / "artist_bridge.parquet")
+
+    logger.info(
+        f"Rolling up {len(streams)} stream rows and {len(charts)} chart rows over "
+        f"{len(dates)} new or changed dates..."
+    )
+    append_rollup(rollup_path(output_dir, "artist_daily"), artist_daily(streams, bridge))
+    append_rollup(rollup_path(output_dir, "country_daily"), country_daily(streams, charts))
+    releases_path = rollup_path(output_dir, "releases")
+    releases = pd.read_parquet(releases_path) if releases_path.exists() else None
+    releases = first_releases(charts, releases)
+    write_parquet(pa.Table.from_pandas(releases, preserve_index=False), releases_path)
+    append_rollup(rollup_path(output_dir, "track_daily"), track_daily(streams, charts, releases))
+    write_parquet(pa.Table.from_pandas(fingerprints, preserve_index=False), fingerprints_path)
+    logger.success(f"Rollups up to {streams['date'].max():%Y-%m-%d} are in {output_dir}.")
+
+
+class Rollups:
+    """Top-N and time-series queries answered from the rollup files.
+
+    Each rollup is read once and kept in memory until its file changes, so repeated queries
+    are groupbys over at most one row per (date, key) instead of over raw chart rows.
+    """
+
+    def __init__(self, rollup_dir: Path = ROLLUP_DIR, registry: IdRegistry | None = None):
+        self.rollup_dir = Path(rollup_dir)
+        self.registry = registry or IdRegistry(PROCESSED_DATA_DIR / "id_registry")
+        self.frames = {}
+
+    def frame(self, name: str) -> pd.DataFrame:
+        path = rollup_path(self.rollup_dir, name)
+        mtime = path.stat().st_mtime_ns
+        if name not in self.frames or self.frames[name][0] != mtime:
+            self.frames[name] = (mtime, pd.read_parquet(path))
+        return self.frames[name][1]
+
+    def window(self, name: str, start=None, end=None) -> pd.DataFrame:
+        frame = self.frame(name)
+        if start is not None:
+            frame = frame[frame["date"] >= pd.Timestamp(start)]
+        if end is not None:
+            frame = frame[frame["date"] <= pd.Timestamp(end)]
+        return frame
+
+    def aggregate(self, frame: pd.DataFrame, key: str, metric: str) -> pd.Series:
+        # stream_total is cumulative, so its value for a window is the latest one
+        how = "max" if metric == "stream_total" else "sum"
+        return frame.groupby(key, observed=True)[metric].agg(how)
+
+    def top_tracks(self, n: int = 10, metric: str = "stream_total", start=None, end=None):
+        """The `n` tracks with the most streams in [start, end], with their names."""
+        frame = self.window("track_daily", start, end)
+        top = self.aggregate(frame, "track_id", metric).nlargest(n)
+        names = frame[frame["track_id"].isin(top.index)]
+        names = names.drop_duplicates("track_id", keep="last").set_index("track_id")
+        result = top.rename(metric).to_frame()
+        result["track_name"] = names["track_name"].astype(object).reindex(top.index)
+        result.index = self.registry.decode("track", pd.Series(top.index)).to_numpy()
+        return result.rename_axis("track_id").reset_index()
+
+    def top_artists(self, n: int = 10, metric: str = "stream_total", start=None, end=None):
+        """The `n` artists with the most streams over all their tracks in [start, end]."""
+        frame = self.window("artist_daily", start, end)
+        top = self.aggregate(frame, "artist_id", metric).nlargest(n)
+        result = top.rename(metric).to_frame()
+        # Names come from the artist dimension the dataset command writes next to the rollups
+        artists_path = self.rollup_dir.parent / "artists.parquet"
+        if artists_path.exists():
+            artists = pd.read_parquet(artists_path, columns=["artist_id", "artist_name"])
+            names = artists.set_index("artist_id")["artist_name"].astype(object)
+            result["artist_name"] = names.reindex(top.index).to_numpy()
+        result.index = self.registry.decode("artist", pd.Series(top.index)).to_numpy()
+        return result.rename_axis("artist_id").reset_index()
+
+    def time_series(
+        self, level: str = "country", key=None, metric: str = "stream_daily", start=None, end=None
+    ) -> pd.Series:
+        """Daily `metric` of one track, artist or country (`key`), or of everything."""
+        name = f"{level}_daily"
+        frame = self.window(name, start, end)
+        if key is not None:
+            column = f"{level}_id" if level != "country" else "country"
+            if level != "country" and isinstance(key, str):
+                key = self.registry.index(level).get_loc(key)
+            frame = frame[frame[column] == key]
+        return frame.groupby("date")[metric].sum()
+
+    def daily_leaders(self, metric: str = "stream_daily", start=None, end=None) -> pd.DataFrame:
+        """The track with the most `metric` streams on each day."""
+        frame = self.window("track_daily", start, end)
+        leaders = frame.loc[frame.groupby("date")[metric].idxmax()]
+        leaders = leaders[["date", "track_id", "track_name", metric]].reset_index(drop=True)
+        leaders["track_id"] = self.registry.decode("track", leaders["track_id"])
+        return leaders
+
+    def streams_by_release_date(self, start=None, end=None) -> pd.Series:
+        """Daily streams in [start, end] summed by the tracks' release date."""
+        frame = self.window("track_daily", start, end)
+        return frame.groupby("track_release_date")["stream_daily"].sum()
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,353 @@
+import ast
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from spotify_analysis.config import PROCESSED_DATA_DIR
+
+ID_REGISTRY_DIR = PROCESSED_DATA_DIR / "id_registry"
+
+# Base62 ID columns and the registry namespace they are encoded in
+ID_COLUMNS = {
+    "track_id": "track",
+    "album_id": "album",
+    "artist_id": "artist",
+    "primary_artist_id": "artist",
+    "playlist_id": "playlist",
+    "country_id": "country",
+}
+# Derivable from the IDs ("spotify:track:<track_id>"), so never loaded
+DERIVED_COLUMNS = ["track_uri", "artist_uri"]
+
+# Column types shared by every dataset under `airflow dags/Data Schema/`: "id" columns are
+# int32 registry codes, everything else is a pandas dtype.
+COLUMN_TYPES = {
+    # Playlist
+    "playlist_id": "id",
+    "playlist_name": "category",
+    "country": "category",
+    "country_id": "id",
+    # Track
+    "artists_id": "category",
+    "album_id": "id",
+    "track_id": "id",
+    "track_name": "category",
+    "track_release_date": "datetime64[ns]",
+    "track_date_added": "datetime64[ns]",
+    "track_duration_ms": "Int32",
+    "track_popularity": "Int8",
+    "track_position": "Int16",
+    "is_explicit": "boolean",
+    "date": "datetime64[ns]",
+    # Artist
+    "artist_id": "id",
+    "primary_artist_id": "id",
+    "artist_name": "category",
+    "artist_genres": "object",
+    "artist_popularity": "Int8",
+    "artist_follower": "Int64",
+    "artist_image_url": "category",
+    # Audio feature
+    "danceability": "float32",
+    "energy": "float32",
+    "key": "Int8",
+    "loudness": "float32",
+    "mode": "Int8",
+    "speechiness": "float32",
+    "acousticness": "float32",
+    "instrumentalness": "float32",
+    "liveness": "float32",
+    "valence": "float32",
+    "tempo": "float32",
+    "duration_ms": "Int32",
+    "time_signature": "Int8",
+    # Track stream
+    "stream_daily": "Int64",
+    "stream_total": "Int64",
+}
+
+SCHEMAS = {
+    "playlists": ["playlist_id", "playlist_name", "country", "date"],
+    "tracks": [
+        "artists_id",
+        "album_id",
+        "track_id",
+        "track_name",
+        "track_release_date",
+        "track_date_added",
+        "track_duration_ms",
+        "track_popularity",
+        "track_position",
+        "is_explicit",
+        "country",
+        "date",
+    ],
+    "artists": [
+        "artist_id",
+        "artist_name",
+        "artist_genres",
+        "artist_popularity",
+        "artist_follower",
+        "artist_image_url",
+        "date",
+    ],
+    "tracks_audio_feature": [
+        "track_id",
+        "country",
+        "date",
+        "danceability",
+        "energy",
+        "key",
+        "loudness",
+        "mode",
+        "speechiness",
+        "acousticness",
+        "instrumentalness",
+        "liveness",
+        "valence",
+        "tempo",
+        "duration_ms",
+        "time_signature",
+    ],
+    "tracks_stream": [
+        "artists_id",
+        "album_id",
+        "track_id",
+        "track_name",
+        "date",
+        "stream_daily",
+        "stream_total",
+    ],
+}
+
+ARROW_TYPES = {
+    "id": pa.int32(),
+    "category": pa.dictionary(pa.int32(), pa.string()),
+    "datetime64[ns]": pa.timestamp("ns"),
+    "boolean": pa.bool_(),
+    "Int8": pa.int8(),
+    "Int16": pa.int16(),
+    "Int32": pa.int32(),
+    "Int64": pa.int64(),
+    "float32": pa.float32(),
+}
+
+
+class IdRegistry:
+    """Persistent string ID -> int32 code mapping, one namespace per entity kind.
+
+    Codes are assigned in order of first appearance and never change, so tables encoded on
+    different days join on the codes directly. Missing IDs encode to -1. One writer at a time.
+    """
+
+    def __init__(self, path: Path = ID_REGISTRY_DIR):
+        self.path = Path(path)
+        self.indexes = {}
+        self.changed = set()
+
+    def index(self, namespace: str) -> pd.Index:
+        if namespace not in self.indexes:
+            file_path = self.path / f"{namespace}.parquet"
+            ids = pd.read_parquet(file_path)["id"] if file_path.exists() else []
+            self.indexes[namespace] = pd.Index(ids, dtype=object)
+        return self.indexes[namespace]
+
+    def encode(self, namespace: str, values: pd.Series) -> pd.Series:
+        values = pd.Series(values).astype(object)
+        index = self.index(namespace)
+        codes = index.get_indexer(values)
+
+        new_ids = pd.unique(values[(codes == -1) & values.notna()])
+        if len(new_ids):
+            index = index.append(pd.Index(new_ids, dtype=object))
+            self.indexes[namespace] = index
+            self.changed.add(namespace)
+            codes = index.get_indexer(values)
+
+        return pd.Series(codes.astype(np.int32), index=values.index, name=values.name)
+
+    def decode(self, namespace: str, codes: pd.Series) -> pd.Series:
+        codes = pd.Series(codes)
+        ids = np.append(self.index(namespace).to_numpy(dtype=object), None)
+        # -1 picks the trailing None
+        return pd.Series(ids[codes.to_numpy()], index=codes.index, name=codes.name)
+
+    def save(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        for namespace in self.changed:
+            table = pa.table({"id": pa.array(self.indexes[namespace], pa.string())})
+            write_parquet(table, self.path / f"{namespace}.parquet")
+        self.changed.clear()
+
+
+def write_parquet(table: pa.Table, path: Path):
+    """Write next to `path` and rename into place so readers never see a partial file."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.parent / f".{uuid.uuid4().hex}.tmp"
+    try:
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def parse_genres(value) -> list:
+    if isinstance(value, str):
+        return ast.literal_eval(value) if value.startswith("[") else []
+    return list(value) if value is not None and not isinstance(value, float) else []
+
+
+def cast_column(series: pd.Series, dtype: str) -> pd.Series:
+    if dtype == "datetime64[ns]":
+        # track_date_added is an ISO timestamp in UTC; everything else is a plain date
+        parsed = pd.to_datetime(series, errors="coerce", utc=True)
+        return parsed.dt.tz_localize(None).astype("datetime64[ns]")
+    if dtype == "category":
+        return series.astype("category")
+    if dtype == "boolean":
+        return series.map({True: True, False: False, "True": True, "False": False}).astype(
+            "boolean"
+        )
+    if dtype == "object":
+        return series.map(parse_genres)
+    numeric = pd.to_numeric(series, errors="coerce")
+    if dtype.startswith("Int"):
+        # Nullable integers refuse non-integral floats, which only come from bad rows
+        numeric = numeric.round()
+    return numeric.astype(dtype)
+
+
+def apply_schema(df: pd.DataFrame, registry: IdRegistry) -> pd.DataFrame:
+    """Cast known columns to their compact types, encode IDs and drop derivable URIs."""
+    df = df.drop(columns=[column for column in DERIVED_COLUMNS if column in df.columns])
+    for column in df.columns.intersection(list(COLUMN_TYPES)):
+        dtype = COLUMN_TYPES[column]
+        if dtype == "id":
+            if not pd.api.types.is_integer_dtype(df[column]):
+                df[column] = registry.encode(ID_COLUMNS[column], df[column])
+        elif df[column].dtype != dtype:
+            df[column] = cast_column(df[column], dtype)
+    return df
+
+
+def restore_ids(df: pd.DataFrame, registry: IdRegistry) -> pd.DataFrame:
+    """Decode ID codes back to the base62 strings, e.g. before writing for the crawler side."""
+    df = df.copy()
+    for column in df.columns.intersection(list(ID_COLUMNS)):
+        df[column] = registry.decode(ID_COLUMNS[column], df[column])
+    return df
+
+
+def arrow_schema(columns: list[str], extra: dict | None = None) -> pa.Schema:
+    """Arrow schema for writing typed frames; `extra` maps other columns to Arrow types."""
+    extra = extra or {}
+    fields = []
+    for column in columns:
+        if column in extra:
+            fields.append((column, extra[column]))
+        elif column == "artist_genres":
+            fields.append((column, pa.list_(pa.string())))
+        else:
+            fields.append((column, ARROW_TYPES[COLUMN_TYPES[column]]))
+    return pa.schema(fields)
+
+
+def iter_raw_chunks(
+    raw_dir: Path, name: str, columns: list[str], chunksize: int, since: str | None = None
+):
+    """Yield untyped frames of at most `chunksize` rows from `<name>/` (Parquet) or `<name>.csv`.
+
+    `since` ("YYYY-MM-DD") skips Parquet date partitions up to and including that day.
+    """
+    parquet_dir = raw_dir / name
+    if parquet_dir.is_dir():
+        dataset = ds.dataset(parquet_dir, format="parquet", partitioning="hive")
+        columns = [column for column in columns if column in dataset.schema.names]
+        expression = None
+        if since is not None and "date" in dataset.schema.names:
+            expression = ds.field("date") > since
+        for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        csv_path = raw_dir / f"{name}.csv"
+        header = pd.read_csv(csv_path, nrows=0).columns
+        usecols = [column for column in columns if column in header]
+        # Read every column as text so chunks never disagree on inferred types
+        yield from pd.read_csv(csv_path, usecols=usecols, dtype=str, chunksize=chunksize)
+
+
+def iter_tables(
+    raw_dir: Path,
+    name: str,
+    registry: IdRegistry,
+    columns: list[str] | None = None,
+    chunksize: int = 100_000,
+    since: pd.Timestamp | None = None,
+):
+    """Yield typed chunks of one of the SCHEMAS datasets, only rows dated after `since`."""
+    since_day = since.strftime("%Y-%m-%d") if since is not None else None
+    for chunk in iter_raw_chunks(raw_dir, name, columns or SCHEMAS[name], chunksize, since_day):
+        chunk = apply_schema(chunk, registry)
+        if since is not None and "date" in chunk.columns:
+            chunk = chunk[chunk["date"] > since]
+        yield chunk
+
+
+def read_table(
+    raw_dir: Path,
+    name: str,
+    registry: IdRegistry,
+    columns: list[str] | None = None,
+    since: pd.Timestamp | None = None,
+) -> pd.DataFrame:
+    """Whole typed dataset; use iter_tables for anything that may not fit in memory."""
+    chunks = list(iter_tables(raw_dir, name, registry, columns, since=since))
+    if not chunks:
+        return apply_schema(pd.DataFrame(columns=columns or SCHEMAS[name]), registry)
+    # Chunks with different categories concatenate to object columns
+    df = pd.concat(chunks, ignore_index=True)
+    for column in df.columns:
+        if COLUMN_TYPES.get(column) == "category" and df[column].dtype != "category":
+            df[column] = df[column].astype("category")
+    return df
+
+
+def date_fingerprints(fact_path: Path, columns: list[str] | None = None) -> pd.DataFrame:
+    """Row count and an order-independent hash of the fact table's rows per `date`.
+
+    The crawler writes stream rows for past dates too, so a date already processed can gain or
+    change rows later; comparing fingerprints tells incremental jobs which dates to redo.
+    """
+    columns = columns or ["track_id", "date", "stream_daily", "stream_total"]
+    parts = []
+    for batch in pq.ParquetFile(fact_path).iter_batches(columns=columns):
+        rows = batch.to_pandas()
+        # Kept below 2**32 so the per-date sums cannot overflow int64
+        hashes = (pd.util.hash_pandas_object(rows, index=False) % (1 << 32)).astype("int64")
+        parts.append(hashes.groupby(rows["date"]).agg(["size", "sum"]))
+    if not parts:
+        return pd.DataFrame(
+            {"date": pd.Series(dtype="datetime64[ns]"), "rows": [], "fingerprint": []}
+        )
+    fingerprints = pd.concat(parts).groupby(level=0).sum()
+    fingerprints.columns = ["rows", "fingerprint"]
+    return fingerprints.rename_axis("date").reset_index()
+
+
+def changed_dates(current: pd.DataFrame, previous: pd.DataFrame | None) -> pd.Series:
+    """Dates in `current` that `previous` fingerprints lack or have different rows for."""
+    if previous is None:
+        return current["date"]
+    merged = current.merge(previous, on="date", how="left", suffixes=("", "_previous"))
+    changed = (merged["rows"] != merged["rows_previous"]) | (
+        merged["fingerprint"] != merged["fingerprint_previous"]
+    )
+    return merged.loc[changed, "date"].reset_index(drop=True)
@@ -0,0 +1,276 @@
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import typer
+from loguru import logger
+from tqdm import tqdm
+
+from spotify_analysis.config import CRAWL_DATA_DIR, PROCESSED_DATA_DIR
+from spotify_analysis.dataset import (
+    AUDIO_FEATURE_COLUMNS,
+    build_bridge,
+    keep_latest,
+    load_artists,
+    load_audio_features,
+)
+from spotify_analysis.schema import (
+    SCHEMAS,
+    IdRegistry,
+    arrow_schema,
+    iter_tables,
+    read_table,
+    write_parquet,
+)
+
+app = typer.Typer()
+
+STAR_DIR = PROCESSED_DATA_DIR / "star"
+
+# Attributes of a track that do not change from one chart day to the next
+TRACK_COLUMNS = [
+    "track_id",
+    "album_id",
+    "track_name",
+    "track_release_date",
+    "track_duration_ms",
+    "is_explicit",
+]
+CHART_COLUMNS = [
+    "date",
+    "country_id",
+    "track_id",
+    "track_position",
+    "track_popularity",
+    "track_date_added",
+]
+STREAM_COLUMNS = ["date", "track_id", "stream_daily", "stream_total"]
+
+BRIDGE_SCHEMA = arrow_schema(
+    ["track_id", "artist_id", "artist_position"], extra={"artist_position": pa.int16()}
+)
+CHART_SCHEMA = arrow_schema(CHART_COLUMNS)
+STREAM_SCHEMA = arrow_schema(STREAM_COLUMNS)
+
+
+def star_path(star_dir: Path, name: str) -> Path:
+    return star_dir / f"{name}.parquet"
+
+
+def write_frame(frame: pd.DataFrame, path: Path):
+    write_parquet(pa.Table.from_pandas(frame, preserve_index=False), path)
+
+
+class FactWriter:
+    """Appends one fact table as Parquet row groups of about `row_group_size` rows.
+
+    Partitioned crawls arrive as one small batch per day and country; buffering them keeps the
+    file from splitting into hundreds of tiny row groups. A key already written is dropped
+    wherever it repeats, so the rows do not depend on `row_group_size`; only a 64-bit hash
+    per key is kept in memory for that.
+    """
+
+    def __init__(self, path: Path, schema: pa.Schema, key: list[str], row_group_size: int):
+        self.writer = pq.ParquetWriter(path, schema)
+        self.schema = schema
+        self.key = key
+        self.row_group_size = row_group_size
+        self.pending = []
+        self.seen = set()
+        self.rows = 0
+
+    def write(self, chunk: pd.DataFrame):
+        self.pending.append(chunk[self.schema.names])
+        if sum(len(frame) for frame in self.pending) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        chunk = pd.concat(self.pending, ignore_index=True)
+        hashes = pd.util.hash_pandas_object(chunk[self.key], index=False)
+        chunk = chunk[~hashes.duplicated().to_numpy() & ~hashes.isin(self.seen).to_numpy()]
+        self.seen.update(hashes.loc[chunk.index])
+        self.writer.write_table(
+            pa.Table.from_pandas(chunk, schema=self.schema, preserve_index=False)
+        )
+        self.pending = []
+        self.rows += len(chunk)
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def build_track_dim(
+    tracks: pd.DataFrame, bridge: pd.DataFrame, features: pd.DataFrame
+) -> pd.DataFrame:
+    """One row per track: its latest static attributes, artist count and audio features."""
+    artists = bridge.groupby("track_id").agg(
+        artist_count=("artist_id", "size"),
+        primary_artist_id=("artist_id", "first"),
+    )
+    dim = tracks[TRACK_COLUMNS].merge(artists, left_on="track_id", right_index=True, how="left")
+    dim["artist_count"] = dim["artist_count"].astype("Int16")
+    dim["primary_artist_id"] = dim["primary_artist_id"].fillna(-1).astype("int32")
+    return dim.merge(features, on="track_id", how="left").sort_values("track_id")
+
+
+def build_album_dim(tracks: pd.DataFrame) -> pd.DataFrame:
+    """One row per album; the crawler only sees albums through their charting tracks."""
+    return (
+        tracks.groupby("album_id")
+        .agg(
+            album_release_date=("track_release_date", "min"),
+            track_count=("track_id", "nunique"),
+        )
+        .reset_index()
+    )
+
+
+def build_country_dim(registry: IdRegistry) -> pd.DataFrame:
+    countries = registry.index("country")
+    return pd.DataFrame(
+        {
+            "country_id": pd.RangeIndex(len(countries)).astype("int32"),
+            "country": pd.Categorical(countries),
+        }
+    )
+
+
+def build_playlist_dim(raw_dir: Path, registry: IdRegistry) -> pd.DataFrame:
+    playlists = read_table(raw_dir, "playlists", registry)
+    playlists = keep_latest(pd.DataFrame(), playlists, "playlist_id")
+    playlists["country_id"] = registry.encode("country", playlists["country"])
+    # `date` (the last crawl that saw the playlist) is only there in partitioned crawls
+    columns = ["playlist_id", "playlist_name", "country_id", "date"]
+    return playlists[[column for column in columns if column in playlists.columns]]
+
+
+@app.command()
+def main(
+    raw_dir: Path = CRAWL_DATA_DIR,
+    output_dir: Path = STAR_DIR,
+    chunksize: int = 100_000,
+):
+    """Normalize the crawl into a star schema of dimension and narrow fact tables.
+
+    Writes `dim_track`, `dim_artist`, `dim_album`, `dim_country`, `dim_playlist`, the
+    `track_artist` bridge and the `fact_chart` (one row per date, country and track) and
+    `fact_stream` (one row per date and track) tables. All keys are int32 codes of the
+    IdRegistry in `output_dir.parent / "id_registry"`, so the facts carry no repeated strings
+    and grow with new chart entries and stream counts only. `wide_table` joins them back.
+
+    The crawler keeps writing the wide partitions: they are its landing format, mirrored by
+    the Postgres tables it upserts and read by its backfill and by `dataset`. The registry
+    also allows one writer at a time, while the DAG's mapped tasks write concurrently. So the
+    normalization runs here, once per crawl, rather than inside the DAG.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    registry = IdRegistry(output_dir.parent / "id_registry")
+
+    logger.info(f"Loading audio features and artists from {raw_dir}...")
+    features = load_audio_features(raw_dir, registry, chunksize)
+    write_frame(load_artists(raw_dir, registry), star_path(output_dir, "dim_artist"))
+    write_frame(build_playlist_dim(raw_dir, registry), star_path(output_dir, "dim_playlist"))
+
+    # Latest attributes per track from the chart crawl; streams only add tracks never charted
+    tracks, stream_tracks = pd.DataFrame(), pd.DataFrame()
+    bridge, seen_tracks = [], set()
+    charts = FactWriter(
+        star_path(output_dir, "fact_chart"), CHART_SCHEMA, CHART_COLUMNS[:3], chunksize
+    )
+    streams = FactWriter(
+        star_path(output_dir, "fact_stream"), STREAM_SCHEMA, ["date", "track_id"], chunksize
+    )
+    try:
+        for name, writer in [("tracks", charts), ("tracks_stream", streams)]:
+            for chunk in tqdm(
+                iter_tables(raw_dir, name, registry, chunksize=chunksize), desc=name
+            ):
+                if "country" in chunk.columns:
+                    chunk["country_id"] = registry.encode("country", chunk["country"])
+                writer.write(chunk)
+
+                new_bridge = build_bridge(chunk, registry)
+                new_bridge = new_bridge[~new_bridge["track_id"].isin(seen_tracks)]
+                seen_tracks.update(new_bridge["track_id"])
+                bridge.append(new_bridge)
+
+                columns = chunk.columns.intersection([*TRACK_COLUMNS, "date"])
+                if name == "tracks":
+                    tracks = keep_latest(tracks, chunk[columns], "track_id")
+                else:
+                    stream_tracks = keep_latest(stream_tracks, chunk[columns], "track_id")
+    finally:
+        charts.close()
+        streams.close()
+
+    bridge = pd.concat(bridge, ignore_index=True)
+    write_parquet(
+        pa.Table.from_pandas(bridge, schema=BRIDGE_SCHEMA, preserve_index=False),
+        star_path(output_dir, "track_artist"),
+    )
+    stream_tracks = stream_tracks[~stream_tracks["track_id"].isin(tracks["track_id"])]
+    tracks = pd.concat([tracks, stream_tracks], ignore_index=True).reindex(columns=TRACK_COLUMNS)
+    tracks["track_name"] = tracks["track_name"].astype("category")
+    write_frame(build_track_dim(tracks, bridge, features), star_path(output_dir, "dim_track"))
+    write_frame(build_album_dim(tracks), star_path(output_dir, "dim_album"))
+    write_frame(build_country_dim(registry), star_path(output_dir, "dim_country"))
+    registry.save()
+
+    logger.success(
+        f"Wrote {charts.rows} chart rows, {streams.rows} stream rows and {len(tracks)} tracks "
+        f"to {output_dir}."
+    )
+
+
+def artists_id_column(bridge: pd.DataFrame, registry: IdRegistry) -> pd.Series:
+    """The crawler's comma-joined `artists_id` per track, rebuilt from the bridge."""
+    bridge = bridge.sort_values(["track_id", "artist_position"])
+    ids = registry.decode("artist", bridge["artist_id"])
+    return ids.groupby(bridge["track_id"].to_numpy()).agg(", ".join).astype("category")
+
+
+def wide_table(
+    name: str,
+    star_dir: Path = STAR_DIR,
+    registry: IdRegistry | None = None,
+    columns: list[str] | None = None,
+) -> pd.DataFrame:
+    """Join the star schema back into one of the crawler's wide SCHEMAS datasets.
+
+    Returns the same typed columns as `schema.read_table(raw_dir, name, ...)` for consumers
+    written against the old layout; track attributes are each track's latest values.
+    """
+    registry = registry or IdRegistry(star_dir.parent / "id_registry")
+    columns = columns or SCHEMAS[name]
+    countries = pd.read_parquet(star_path(star_dir, "dim_country"))
+
+    if name == "artists":
+        frame = pd.read_parquet(star_path(star_dir, "dim_artist"))
+    elif name == "playlists":
+        frame = pd.read_parquet(star_path(star_dir, "dim_playlist"))
+        frame = frame.merge(countries, on="country_id", how="left")
+    else:
+        fact = "fact_stream" if name == "tracks_stream" else "fact_chart"
+        frame = pd.read_parquet(star_path(star_dir, fact))
+        tracks = pd.read_parquet(star_path(star_dir, "dim_track"))
+        how = "left"
+        if name == "tracks_audio_feature":
+            # Only tracks the crawler got audio features for had rows there
+            tracks = tracks.dropna(subset=AUDIO_FEATURE_COLUMNS, how="all")
+            how = "inner"
+        frame = frame.merge(tracks, on="track_id", how=how)
+        if "country_id" in frame.columns:
+            frame = frame.merge(countries, on="country_id", how="left")
+        if "artists_id" in columns:
+            bridge = pd.read_parquet(star_path(star_dir, "track_artist"))
+            artists_id = artists_id_column(bridge, registry)
+            frame["artists_id"] = frame["track_id"].map(artists_id).astype("category")
+    return frame[[column for column in columns if column in frame.columns]]
+
+
+if __name__ == "__main__":
+    app()
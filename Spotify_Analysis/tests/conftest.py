@@ -0,0 +1,117 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from spotify_analysis import dataset
+from spotify_analysis.dataset import AUDIO_FEATURE_COLUMNS
+
+TRACKS = [f"track{number}" for number in range(6)]
+COUNTRIES = ["Vietnam", "Thailand"]
+
+
+def write_crawl(raw_dir: Path, days: int, missing: tuple = ()):
+    """A small crawl in the CSV layout: `days` chart days from 2024-11-01 and their streams.
+
+    `missing` holds (track_id, day) stream rows the crawler has not written yet.
+    """
+    raw_dir.mkdir(parents=True, exist_ok=True)
+    dates = pd.date_range("2024-11-01", periods=days).strftime("%Y-%m-%d")
+    charts, streams, features = [], [], []
+    for day, date in enumerate(dates):
+        for number, track_id in enumerate(TRACKS):
+            artists_id = f"artist{number % 3}, artist{(number + 1) % 3}"
+            for rank, country in enumerate(COUNTRIES):
+                # Every track charts in one or both countries, climbing and falling over time
+                if (number + day + rank) % 3:
+                    charts.append(
+                        {
+                            "track_id": track_id,
+                            "artists_id": artists_id,
+                            "album_id": f"album{number}",
+                            "track_name": f"Track {number}",
+                            "track_release_date": f"2024-10-{number + 1:02d}",
+                            "track_position": (number * 7 + day * (rank + 2)) % 50 + 1,
+                            "country": country,
+                            "date": date,
+                        }
+                    )
+            if (track_id, day) not in missing:
+                streams.append(
+                    {
+                        "track_id": track_id,
+                        "date": date,
+                        "stream_daily": 1000 * (number + 1) + 37 * day * (day % 4 + number),
+                        "stream_total": 100_000 * (number + 1) + 5000 * day,
+                        "artists_id": artists_id,
+                        "album_id": f"album{number}",
+                        "track_name": f"Track {number}",
+                    }
+                )
+            features.append(
+                {
+                    "track_id": track_id,
+                    "date": date,
+                    **{
+                        column: 0.1 * number + 0.01 * position
+                        for position, column in enumerate(AUDIO_FEATURE_COLUMNS)
+                    },
+                }
+            )
+
+    artists = [
+        {
+            "artist_id": f"artist{number}",
+            "artist_name": f"Artist {number}",
+            "artist_genres": "['pop']",
+            "artist_popularity": 50 + number,
+            "artist_follower": 1000 * number,
+            "date": dates[0],
+        }
+        for number in range(3)
+    ]
+    pd.DataFrame(charts).to_csv(raw_dir / "tracks.csv", index=False)
+    pd.DataFrame(streams).to_csv(raw_dir / "tracks_stream.csv", index=False)
+    pd.DataFrame(features).to_csv(raw_dir / "tracks_audio_feature.csv", index=False)
+    pd.DataFrame(artists).to_csv(raw_dir / "artists.csv", index=False)
+
+
+@pytest.fixture
+def crawl(tmp_path):
+    """Write a crawl of `days` days and rebuild the fact table from it; returns its paths."""
+    raw_dir = tmp_path / "raw"
+    processed_dir = tmp_path / "processed"
+
+    def build(days: int, missing: tuple = ()):
+        write_crawl(raw_dir, days, missing)
+        dataset.main(raw_dir=raw_dir, output_dir=processed_dir, chunksize=7)
+        return raw_dir, processed_dir / "tracks_stream_fact.parquet"
+
+    return build
+
+
+# Stream rows the crawler writes for days already processed: a track's stream window reaches
+# back a week, so a later run fills days an earlier one had no counts for yet
+LATE_ROWS = (("track1", 2), ("track1", 4), ("track2", 3), ("track2", 4), ("track4", 4))
+
+
+@pytest.fixture
+def late_rows(crawl, tmp_path):
+    """Run an incremental `update` (a command's `main`) over six days missing LATE_ROWS, then
+    over the next day's crawl that brings them, and a full rebuild of the same crawl.
+
+    Returns the (incremental, rebuilt) output directories.
+    """
+
+    def run(update):
+        incremental_dir = tmp_path / "incremental"
+        raw_dir, fact_path = crawl(days=6, missing=LATE_ROWS)
+        update(fact_path=fact_path, raw_dir=raw_dir, output_dir=incremental_dir, full=False)
+        raw_dir, fact_path = crawl(days=7)
+        update(fact_path=fact_path, raw_dir=raw_dir, output_dir=incremental_dir, full=False)
+
+        rebuilt_dir = tmp_path / "rebuilt"
+        update(fact_path=fact_path, raw_dir=raw_dir, output_dir=rebuilt_dir, full=True)
+        return incremental_dir, rebuilt_dir
+
+    return run
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+from pathlib import Path
+
+# Same budget as benchmarks/bench_cli_startup.py: imports of `spotify-analysis --help`, in ms
+IMPORT_BUDGET_MS = 150
+# Only the subcommands need these
+HEAVY_MODULES = {"pandas", "numpy", "pyarrow", "duckdb", "matplotlib", "sklearn", "aiohttp"}
+
+PACKAGE_DIR = Path(__file__).resolve().parents[1]
+
+
+def cli_help() -> tuple[str, float, set[str]]:
+    """Output, total import ms and imported modules of one `spotify-analysis --help`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "spotify_analysis.cli", "--help"],
+        cwd=PACKAGE_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total_us, modules = 0, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line.split(":", 1)[1].split("|")
+        total_us += int(self_us)
+        modules.add(name.strip())
+    return result.stdout, total_us / 1000, modules
+
+
+def test_help_lists_the_commands_without_heavy_imports():
+    output, _, modules = cli_help()
+
+    assert "Usage:" in output
+    assert "star-schema" in output
+    assert not HEAVY_MODULES & {name.split(".")[0] for name in modules}
+
+
+def test_help_imports_stay_within_budget():
+    # Best of three, so a busy machine does not fail the check
+    import_ms = min(cli_help()[1] for _ in range(3))
+
+    assert import_ms <= IMPORT_BUDGET_MS
@@ -0,0 +1,26 @@
+import pandas as pd
+
+from spotify_analysis import features
+
+
+def test_late_stream_rows_match_a_full_rebuild(late_rows):
+    incremental_dir, rebuilt_dir = late_rows(features.main)
+
+    incremental = features.read_features(incremental_dir)
+    rebuilt = features.read_features(rebuilt_dir)
+    assert len(rebuilt) == 6 * 7
+    pd.testing.assert_frame_equal(incremental, rebuilt)
+
+
+def test_unchanged_days_are_not_recomputed(crawl, tmp_path):
+    output_dir = tmp_path / "features"
+    raw_dir, fact_path = crawl(days=5)
+    features.main(fact_path=fact_path, raw_dir=raw_dir, output_dir=output_dir, full=False)
+    first_day = output_dir / "date=2024-11-01" / "part-0.parquet"
+    written = first_day.stat().st_mtime_ns
+
+    raw_dir, fact_path = crawl(days=6)
+    features.main(fact_path=fact_path, raw_dir=raw_dir, output_dir=output_dir, full=False)
+
+    assert first_day.stat().st_mtime_ns == written
+    assert features.read_features(output_dir)["date"].nunique() == 6
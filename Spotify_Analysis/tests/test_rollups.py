@@ -0,0 +1,13 @@
+import pandas as pd
+import pytest
+
+from spotify_analysis import rollups
+
+
+@pytest.mark.parametrize("name", ["track_daily", "artist_daily", "country_daily", "releases"])
+def test_late_stream_rows_match_a_full_rebuild(late_rows, name):
+    incremental_dir, rebuilt_dir = late_rows(rollups.main)
+
+    incremental = pd.read_parquet(rollups.rollup_path(incremental_dir, name))
+    rebuilt = pd.read_parquet(rollups.rollup_path(rebuilt_dir, name))
+    pd.testing.assert_frame_equal(incremental, rebuilt)
@@ -0,0 +1,53 @@
+import pandas as pd
+
+from spotify_analysis import star_schema
+
+
+def chart_crawl(crawl, days: int, repeated_date: str | None = None):
+    """`crawl` plus what only the star schema reads: more chart columns and playlists.
+
+    The playlists are seen on two days, and the chart rows of `repeated_date` land twice.
+    """
+    raw_dir, _ = crawl(days=days)
+    charts = pd.read_csv(raw_dir / "tracks.csv")
+    charts["track_popularity"] = 90 - charts["track_position"]
+    charts["track_date_added"] = charts["track_release_date"]
+    # The crawler re-writes a day it already landed, e.g. when a chart task is retried
+    repeated = charts[charts["date"] == repeated_date]
+    pd.concat([charts, repeated]).to_csv(raw_dir / "tracks.csv", index=False)
+    pd.DataFrame(
+        {
+            "playlist_id": ["playlist0", "playlist1", "playlist0"],
+            "playlist_name": ["Top 50 - Vietnam", "Top 50 - Thailand", "Top 50 - Vietnam"],
+            "country": ["Vietnam", "Thailand", "Vietnam"],
+            "date": ["2024-11-01", "2024-11-01", "2024-11-02"],
+        }
+    ).to_csv(raw_dir / "playlists.csv", index=False)
+    return raw_dir, len(charts)
+
+
+def test_facts_hold_each_key_once_whatever_the_chunk_size(crawl, tmp_path):
+    raw_dir, chart_rows = chart_crawl(crawl, days=4, repeated_date="2024-11-02")
+
+    facts = {}
+    for chunksize in (5, 10_000):
+        star_dir = tmp_path / f"star{chunksize}"
+        star_schema.main(raw_dir=raw_dir, output_dir=star_dir, chunksize=chunksize)
+        facts[chunksize] = pd.read_parquet(star_schema.star_path(star_dir, "fact_chart"))
+
+    assert len(facts[5]) == chart_rows
+    pd.testing.assert_frame_equal(facts[5], facts[10_000])
+
+
+def test_playlists_keep_the_date_they_were_crawled(crawl, tmp_path):
+    raw_dir, _ = chart_crawl(crawl, days=2)
+
+    star_dir = tmp_path / "star"
+    star_schema.main(raw_dir=raw_dir, output_dir=star_dir, chunksize=5)
+    playlists = star_schema.wide_table("playlists", star_dir).set_index("playlist_id")
+
+    assert playlists.columns.tolist() == ["playlist_name", "country", "date"]
+    assert playlists["date"].dt.strftime("%Y-%m-%d").sort_index().tolist() == [
+        "2024-11-02",
+        "2024-11-01",
+    ]
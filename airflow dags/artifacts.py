@@ -0,0 +1,94 @@
+# Artifact exchange between DAG tasks: each task writes its output once as an Arrow IPC file
+# under <artifact_dir>/<run_id>/ and pushes only {'path', 'rows'} through XCom.
+# Layout: <artifact_dir>/<run_id>/<name>.arrow
+import logging
+import os
+import shutil
+import time
+import uuid
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow as pa
+
+from storage import normalize_types
+from telemetry import stage
+
+ARTIFACT_DIR = os.environ.get('SPOTIFY_ARTIFACT_DIR', './data/artifacts')
+ARTIFACT_RETENTION_DAYS = float(os.environ.get('SPOTIFY_ARTIFACT_RETENTION_DAYS', 7))
+
+
+def artifact_path(run_id, name, artifact_dir=None):
+    return os.path.join(artifact_dir or ARTIFACT_DIR, quote(run_id, safe=''), f"{quote(name, safe='')}.arrow")
+
+
+# Uncompressed IPC so readers can memory-map the file instead of copying it
+def write_artifact(df, run_id, name, artifact_dir=None):
+    file_path = artifact_path(run_id, name, artifact_dir)
+    directory = os.path.dirname(file_path)
+    os.makedirs(directory, exist_ok=True)
+    table = pa.Table.from_pandas(normalize_types(df), preserve_index=False)
+
+    tmp_path = os.path.join(directory, f'.{uuid.uuid4().hex}.tmp')
+    try:
+        with stage('artifacts'), pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return {'path': file_path, 'rows': table.num_rows}
+
+
+def read_artifact(reference, columns=None):
+    with stage('artifacts'), pa.memory_map(reference['path'], 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+        return table.to_pandas()
+
+
+# `name` defaults to the XCom key; mapped tasks pass a per-instance name (e.g. the country)
+def push_artifact(ti, key, df, run_id, name=None):
+    reference = write_artifact(df, run_id, name or key)
+    ti.xcom_push(key=key, value=reference)
+    logging.info(f"Artifact {key}: {reference['rows']} rows at {reference['path']}")
+    return reference
+
+
+# Empty frame when the upstream task pushed nothing (e.g. it found no rows)
+def pull_artifact(ti, key, task_ids, columns=None):
+    reference = ti.xcom_pull(key=key, task_ids=task_ids)
+    if not reference:
+        return pd.DataFrame(columns=columns or [])
+    return read_artifact(reference, columns=columns)
+
+
+# Concatenate the artifacts pushed under `key` by every instance of a mapped task
+def pull_artifacts(ti, key, task_ids, columns=None):
+    references = ti.xcom_pull(key=key, task_ids=task_ids)
+    if isinstance(references, dict):
+        references = [references]
+    frames = [read_artifact(reference, columns=columns) for reference in references or [] if reference]
+    if not frames:
+        return pd.DataFrame(columns=columns or [])
+    return pd.concat(frames, ignore_index=True)
+
+
+# Remove run directories not modified within the retention period
+def cleanup_artifacts(retention_days=None, artifact_dir=None):
+    root = artifact_dir or ARTIFACT_DIR
+    retention_days = ARTIFACT_RETENTION_DAYS if retention_days is None else retention_days
+    if not os.path.isdir(root):
+        return []
+
+    oldest = time.time() - retention_days * 86400
+    removed = []
+    for entry in os.scandir(root):
+        if entry.is_dir() and entry.stat().st_mtime < oldest:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed.append(entry.path)
+
+    logging.info(f'Removed {len(removed)} artifact runs older than {retention_days} days from {root}')
+    return removed
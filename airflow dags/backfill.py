@@ -0,0 +1,156 @@
+# Backfill stream counts and audio features for a range of chart dates in one pass, e.g.
+#   python "airflow dags/backfill.py" --start 2024-11-06 --end 2024-11-20 --dry-run
+# Chart date D gets the same rows the DAG writes for it:
+#   tracks_stream         stream counts for the windows of the tracks charting on D, dated by
+#                         stream day (the DAG run of D + 1 crawls them from D's tracks)
+#   tracks_audio_feature  D's tracks joined with their audio features, under date=D (written
+#                         by the DAG run of D itself, next to D's tracks)
+# Past charts themselves cannot be crawled again, so only dates whose tracks partitions exist
+# are backfilled.
+import argparse
+import logging
+import os
+from datetime import date
+
+import pandas as pd
+
+from entity_index import EntityIndex
+from rate_limiter import create_limiter
+from storage import DATA_DIR, partition_values, read_dataset, write_partitions
+from stream_crawler import StreamCache, StreamJob, crawl_streams, stream_window
+
+# Same stores as the DAG, so the backfill shares its rate budget and caches
+rate_limit_store_url = os.environ.get('SPOTIFY_RATE_LIMIT_STORE', 'sqlite:///./data/rate_limits.sqlite')
+stream_cache_path = os.environ.get('STREAM_CACHE_PATH', './data/stream_cache.sqlite')
+entity_index_path = os.environ.get('ENTITY_INDEX_PATH', './data/entity_index.sqlite')
+
+STREAM_TRACK_COLUMNS = ['track_id', 'artists_id', 'album_id', 'track_uri', 'track_name']
+
+
+# (chart_date, track_id, start_date, end_date) for every track charting in the range
+def plan_windows(tracks):
+    windows = []
+    charted = tracks[['date', 'track_id', 'track_release_date']].drop_duplicates(subset=['date', 'track_id'])
+    for chart in charted.itertuples(index=False):
+        release_date = pd.to_datetime(chart.track_release_date).date()
+        window = stream_window(release_date, date.fromisoformat(chart.date))
+        if window is not None:
+            windows.append((chart.date, chart.track_id, *window))
+    return pd.DataFrame(windows, columns=['chart_date', 'track_id', 'start_date', 'end_date'])
+
+
+# One job per track spanning all of its windows: the endpoint returns the whole history, so a
+# single request serves every chart date the track appears on
+def plan_stream_jobs(windows):
+    spans = windows.groupby('track_id').agg(start_date=('start_date', 'min'), end_date=('end_date', 'max'))
+    return [StreamJob(track_id, start, end) for track_id, start, end in spans.itertuples()]
+
+
+def log_stream_plan(windows, jobs):
+    cache = StreamCache(stream_cache_path)
+    try:
+        requests = sum(not cache.covers(job.track_id, job.start_date, job.end_date) for job in jobs)
+    finally:
+        cache.close()
+    logging.info(f'{len(windows)} (chart date, track) windows over {windows["chart_date"].nunique()} dates: '
+                 f'{len(jobs)} tracks, {requests} mystreamcount requests ({len(jobs) - requests} tracks '
+                 f'already cached) instead of {len(windows)} when run day by day')
+
+
+def backfill_streams(tracks, windows, jobs, concurrency, data_dir):
+    limiter = create_limiter(rate_limit_store_url, time_window=60, rate_limit=20)
+    results = crawl_streams(jobs, stream_cache_path, limiter=limiter, concurrency=concurrency)
+
+    rows = pd.DataFrame(
+        [row for track_rows in results.values() if track_rows for row in track_rows],
+        columns=['track_id', 'date', 'stream_daily', 'stream_total']
+    )
+    failed = sum(1 for track_rows in results.values() if track_rows is None)
+    if rows.empty:
+        logging.info(f'No stream counts to write ({failed} tracks failed)')
+        return 0
+
+    # Cut each chart date's window out of its track's history, with that date's track metadata
+    stream_df = windows.merge(rows, on='track_id')
+    stream_df = stream_df[
+        (stream_df['date'] >= stream_df['start_date'].map(date.isoformat))
+        & (stream_df['date'] <= stream_df['end_date'].map(date.isoformat))
+    ]
+    metadata = tracks[['date', *STREAM_TRACK_COLUMNS]].rename(columns={'date': 'chart_date'})
+    stream_df = stream_df.merge(
+        metadata.drop_duplicates(subset=['chart_date', 'track_id']), on=['chart_date', 'track_id'], how='left'
+    )
+    # Windows of consecutive chart dates overlap; the latest chart date's metadata wins
+    stream_df = stream_df.sort_values('chart_date').drop_duplicates(subset=['track_id', 'date'], keep='last')
+    stream_df = stream_df.drop(columns=['chart_date', 'start_date', 'end_date'])
+
+    written = write_partitions(stream_df, 'tracks_stream', data_dir=data_dir)
+    logging.info(f'Wrote {len(stream_df)} stream rows into {len(written)} tracks_stream partitions '
+                 f'({failed} tracks failed)')
+    return len(stream_df)
+
+
+# Audio features never change, so the entity index filled by the daily runs is enough;
+# no Spotify request is made. Dates that already have a partition are kept unless overwrite.
+def backfill_audio_features(tracks, overwrite, data_dir):
+    if not overwrite:
+        existing = set(partition_values('tracks_audio_feature', 'date', data_dir=data_dir))
+        tracks = tracks[~tracks['date'].isin(existing)]
+    if tracks.empty:
+        logging.info('Every chart date already has audio features')
+        return 0
+
+    index = EntityIndex(entity_index_path)
+    try:
+        known, missing = index.lookup('audio_features', tracks['track_id'].unique())
+    finally:
+        index.close()
+    # Tracks Spotify has no audio features for are stored as None
+    missing += [track_id for track_id, record in known.items() if record is None]
+    known = {track_id: record for track_id, record in known.items() if record is not None}
+    if missing:
+        logging.warning(f'{len(missing)} tracks have no audio features in the entity index; '
+                        f'their rows are written without them')
+
+    features_df = pd.DataFrame(list(known.values())) if known else pd.DataFrame(columns=['track_id'])
+    tracks_audio_feature_df = tracks.merge(features_df, on='track_id', how='left')
+    written = write_partitions(tracks_audio_feature_df, 'tracks_audio_feature', data_dir=data_dir)
+    logging.info(f'Wrote {len(tracks_audio_feature_df)} audio feature rows for '
+                 f'{tracks["date"].nunique()} dates into {len(written)} partitions')
+    return len(tracks_audio_feature_df)
+
+
+def backfill(start, end, datasets, concurrency=4, overwrite=False, dry_run=False, data_dir=None):
+    # One scan of every chart partition in the range instead of one read per day
+    tracks = read_dataset('tracks', filters=[('date', '>=', start), ('date', '<=', end)], data_dir=data_dir)
+    if tracks.empty:
+        logging.info(f'No tracks partitions between {start} and {end}')
+        return
+    tracks = tracks.drop_duplicates(subset=['date', 'country', 'track_id'])
+    logging.info(f'{len(tracks)} chart rows on {tracks["date"].nunique()} dates between {start} and {end}')
+
+    if 'streams' in datasets:
+        windows = plan_windows(tracks)
+        jobs = plan_stream_jobs(windows)
+        log_stream_plan(windows, jobs)
+        if not dry_run:
+            backfill_streams(tracks, windows, jobs, concurrency, data_dir)
+    if 'audio_features' in datasets and not dry_run:
+        backfill_audio_features(tracks, overwrite, data_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backfill stream counts and audio features for a date range.')
+    parser.add_argument('--start', required=True, help='first chart date, YYYY-MM-DD')
+    parser.add_argument('--end', required=True, help='last chart date, YYYY-MM-DD')
+    parser.add_argument('--datasets', nargs='+', choices=['streams', 'audio_features'],
+                        default=['streams', 'audio_features'])
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent mystreamcount requests')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='rewrite tracks_audio_feature partitions that already exist')
+    parser.add_argument('--dry-run', action='store_true', help='only log the planned requests')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    backfill(args.start, args.end, args.datasets, args.concurrency, args.overwrite, args.dry_run, args.data_dir)
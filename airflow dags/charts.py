@@ -0,0 +1,31 @@
+# Charts crawled every day. Each entry needs a country and a market; entries without a
+# playlist_id are resolved by searching for the official "Top 50 - <country>" playlist.
+# Set SPOTIFY_CHARTS_CONFIG to a JSON file with the same list to crawl other charts, e.g.
+#   [{"country": "Vietnam", "market": "VN"},
+#    {"country": "Vietnam", "market": "VN", "playlist_id": "<viral 50 playlist id>"}]
+import json
+import os
+
+DEFAULT_CHARTS = [
+    {'country': 'Indonesia', 'market': 'ID'},
+    {'country': 'Malaysia', 'market': 'MY'},
+    {'country': 'Philippines', 'market': 'PH'},
+    {'country': 'Singapore', 'market': 'SG'},
+    {'country': 'Thailand', 'market': 'TH'},
+    {'country': 'Vietnam', 'market': 'VN'},
+]
+
+
+def load_charts(path=None):
+    path = path or os.environ.get('SPOTIFY_CHARTS_CONFIG')
+    if not path:
+        return DEFAULT_CHARTS
+
+    with open(path) as file:
+        charts = json.load(file)
+
+    for chart in charts:
+        missing = {'country', 'market'} - chart.keys()
+        if missing:
+            raise ValueError(f'Chart {chart} in {path} is missing {sorted(missing)}')
+    return charts
@@ -0,0 +1,107 @@
+# Per-unit checkpoints of the crawl tasks (one playlist, one ID batch, one stream track), so a
+# retry or manual re-run of a DAG run only fetches the units that did not complete yet.
+# Units are keyed by (run date, task, unit); trigger with conf {"force": true} (every task) or
+# {"force": ["fetch_tracks", ...]} to ignore checkpoints written before that DAG run started.
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+
+class Checkpoints:
+    def __init__(self, path, run_date, task, completed_after=None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.run_date = run_date
+        self.task = task
+        # Mapped task instances of one run record into the same file concurrently
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS units (
+                run_date TEXT NOT NULL,
+                task TEXT NOT NULL,
+                unit TEXT NOT NULL,
+                result TEXT NOT NULL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (run_date, task, unit)
+            )
+        """)
+        self.connection.commit()
+
+        rows = self.connection.execute(
+            'SELECT unit, result FROM units WHERE run_date = ? AND task = ? AND completed_at >= ?',
+            (run_date, task, completed_after if completed_after is not None else float('-inf'))
+        ).fetchall()
+        self.completed = {unit: json.loads(result) for unit, result in rows}
+        self.skipped = 0
+
+    def record(self, unit, result):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO units (run_date, task, unit, result, completed_at) VALUES (?, ?, ?, ?, ?)',
+            (self.run_date, self.task, unit, json.dumps(result, default=str), time.time())
+        )
+        self.connection.commit()
+        self.completed[unit] = result
+
+    # Result of a completed unit, or await coroutine_function(*args) and record it.
+    # None means the unit failed and is tried again on the next attempt.
+    async def run(self, unit, coroutine_function, *args):
+        if unit in self.completed:
+            self.skipped += 1
+            return self.completed[unit]
+
+        result = await coroutine_function(*args)
+        if result is not None:
+            self.record(unit, result)
+        return result
+
+    def log_skipped(self, total):
+        logging.info(f'{self.task}: {self.skipped}/{total} units completed by an earlier attempt of '
+                     f'the {self.run_date} run, {total - self.skipped} fetched')
+
+    def close(self):
+        self.connection.close()
+
+
+# Short stable unit name for a batch of IDs
+def batch_unit(ids):
+    return hashlib.sha1(','.join(ids).encode()).hexdigest()[:16]
+
+
+# The day a DAG run crawls: the end of its data interval, so retries and re-runs of the same
+# run key their checkpoints and partitions by the same date even days later
+def run_date(context):
+    return context['data_interval_end'].strftime('%Y-%m-%d')
+
+
+def is_forced(context, task):
+    force = (context['dag_run'].conf or {}).get('force', False)
+    return force is True or (isinstance(force, list) and task in force)
+
+
+def open_checkpoints(path, task, context):
+    completed_after = None
+    if is_forced(context, task):
+        # Units recorded by earlier attempts of this forced run still count
+        completed_after = context['dag_run'].start_date.timestamp()
+        logging.info(f'{task}: forced, ignoring checkpoints from before this DAG run started')
+    return Checkpoints(path, run_date(context), task, completed_after)
+
+
+# Drop the checkpoints of runs older than `retention_days`
+def prune_checkpoints(path, retention_days):
+    if not os.path.exists(path):
+        return 0
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        removed = connection.execute(
+            'DELETE FROM units WHERE completed_at < ?', (time.time() - retention_days * 86400,)
+        ).rowcount
+        connection.commit()
+    finally:
+        connection.close()
+    logging.info(f'Removed {removed} crawl checkpoints older than {retention_days} days from {path}')
+    return removed
@@ -1,20 +1,28 @@
 # Airflow
 from airflow import DAG
+from airflow.models.xcom_arg import XComArg
 from airflow.operators.python import PythonOperator
 # PostgreSQL
-import psycopg2
-from psycopg2 import errors
+from pg_loader import upsert_records
+# Storage
+from storage import read_dataset, write_partitions
+from stream_crawler import StreamJob, crawl_streams, stream_window
+from entity_index import fetch_with_index, plan_fetch, store_entities
+from artifacts import cleanup_artifacts, pull_artifact, pull_artifacts, push_artifact
+from checkpoints import batch_unit, is_forced, open_checkpoints, prune_checkpoints, run_date
+from charts import load_charts
 # Date and time
-from datetime import datetime, timedelta, timezone  
-import time
+from datetime import datetime, timedelta  
 import pytz
-from collections import deque
 # Requesting API
-import requests
+import asyncio
 import logging
+from rate_limiter import create_limiter
+from http_cache import HttpCache
+from telemetry import instrumented_task, stage
+from spotify_client import SpotifyAuthError, SpotifyClient
 
 import pandas as pd
-import numpy as np
 import os
 
 connection_params = {
@@ -32,399 +40,266 @@ client_credentials = [
     # Add more credentials here as needed
 ]
 
-current_credential_index = 0
-request_timestamps = deque()
+# memory:// (one process), sqlite:///path (processes on one host) or redis://host:port/db (several hosts)
+rate_limit_store_url = os.environ.get('SPOTIFY_RATE_LIMIT_STORE', 'sqlite:///./data/rate_limits.sqlite')
+# (track_id, date) stream counts already downloaded from mystreamcount
+stream_cache_path = os.environ.get('STREAM_CACHE_PATH', './data/stream_cache.sqlite')
+# Seconds before a track mystreamcount is still 'processing' is asked for again (doubling per attempt)
+stream_processing_delay = float(os.environ.get('STREAM_PROCESSING_DELAY', 30))
+# Audio features and artist records already fetched; artists are re-fetched after the TTL
+entity_index_path = os.environ.get('ENTITY_INDEX_PATH', './data/entity_index.sqlite')
+artist_ttl_hours = float(os.environ.get('ARTIST_TTL_HOURS', 24))
+# IDs Spotify answered with null (no artist record or audio features) are asked for again after this
+not_found_ttl_hours = float(os.environ.get('NOT_FOUND_TTL_HOURS', 7 * 24))
+# Responses of rarely changing endpoints (search, playlists, audio features); see http_cache.CACHE_RULES
+http_cache_path = os.environ.get('HTTP_CACHE_PATH', './data/http_cache.sqlite')
+http_cache_max_mb = float(os.environ.get('HTTP_CACHE_MAX_MB', 256))
+# Playlists, ID batches and stream tracks completed by each run, so retries resume where they failed
+checkpoint_path = os.environ.get('CHECKPOINT_PATH', './data/checkpoints.sqlite')
+checkpoint_retention_days = float(os.environ.get('CHECKPOINT_RETENTION_DAYS', 7))
+# IDs handled by one mapped batch task (several API calls each, so task overhead stays small)
+ids_per_mapped_task = int(os.environ.get('IDS_PER_MAPPED_TASK', 500))
+artist_batch_size = 50
+audio_feature_batch_size = 100
+# Playlist pages are read with only the fields used by get_tracks_from_playlist
+playlist_page_size = 100
+playlist_track_fields = (
+    'total,items(added_at,track(id,uri,name,duration_ms,popularity,explicit,album(id,release_date),artists(id)))'
+)
 hochiminh_tz = pytz.timezone("Asia/Ho_Chi_Minh")
 
-# Function to get access token using a given client ID and secret
-def request_access_token(client_id, client_secret):
-    import base64  
-    
-    auth_string = f'{client_id}:{client_secret}'
-    auth_encoded = base64.b64encode(auth_string.encode()).decode()
-
-    response = requests.post(
-        'https://accounts.spotify.com/api/token',
-        headers={
-            'Authorization': f'Basic {auth_encoded}',
-            'Content-Type': 'application/x-www-form-urlencoded'
-        },
-        data={'grant_type': 'client_credentials'}
-    )
-
-    if response.status_code == 200:
-        return response.json().get('access_token')
-    else:
-        return None
-    
-def refresh_access_token():
-  global current_credential_index
+# Open one pooled async client for a task and run the coroutine with it
+def run_with_client(coroutine_function, *args):
+    async def runner():
+        limiter = create_limiter(rate_limit_store_url)
+        async with SpotifyClient(client_credentials, limiter=limiter, cache=cache) as client:
+            return await coroutine_function(client, *args)
 
-  creds = client_credentials[current_credential_index]
-  access_token = request_access_token(creds['client_id'], creds['client_secret'])
-
-  if access_token:
-    return access_token
-  else:
-    return None
+    cache = HttpCache(http_cache_path, max_bytes=int(http_cache_max_mb * 1024 * 1024))
+    try:
+        with stage('fetch'):
+            return asyncio.run(runner())
+    finally:
+        cache.close()
 
-def switch_client_credentials():
-  global current_credential_index
-  current_credential_index = (current_credential_index + 1) % len(client_credentials)
-  logging.info('Switched to client ID: %s', client_credentials[current_credential_index]['client_id'])
-
-def check_rate_limit(time_window=30, rate_limit=60):
-    global request_timestamps
-
-    # Current time
-    now = time.time()
-
-    # Remove timestamps older than the time_window
-    while request_timestamps and request_timestamps[0] < now - time_window:
-        request_timestamps.popleft()  # Remove the old timestamp
-
-    # If the rate_limit was reached, sleep until the window resets
-    if len(request_timestamps) >= rate_limit:
-        wait_time = time_window - (now - request_timestamps[0])
-        if wait_time > 0:  # Only sleep if there is actual wait time
-            logging.info(f'\n\t\tRATE LIMIT\nRate limit reached. Waiting for {wait_time:.3f} seconds.')
-            time.sleep(wait_time)
-            logging.info('Sleep completed\n')
-        # Clear any timestamps older than the time_window after sleeping
-        while request_timestamps and request_timestamps[0] < now - time_window:
-            request_timestamps.popleft()
-
-    # Log the new request timestamp
-    request_timestamps.append(now)
-
-# Task 1: fetch playlists from the official top 50 for all Southeast Asian countries
-def get_playlist_from_top50_country(country, market, headers):
-    # Construct the URL for searching playlists
-    url = 'https://api.spotify.com/v1/search'
+# Task 1: fetch the configured chart playlists (by default the official top 50 of every Southeast Asian country)
+async def get_playlist_from_top50_country(client, country, market):
     params = {
         'q': f'Top 50 - {country}',
         'type': 'playlist',
         'market': market,
         'limit': 1
     }
-    retry_attempts = 3
-    
-    for attempt in range(retry_attempts):
-        try:
-            check_rate_limit()
-            response = requests.get(url, headers=headers, params=params, timeout=10)
-
-            if response.status_code == 200:
-                result = response.json()
-                playlist_info = result.get('playlists', {})
-                playlist = playlist_info.get('items', [])
-
-                if not playlist:
-                    logging.info('No more playlists for query: %s', country)
-                    continue
-
-                playlist = playlist[0]  # Access the first playlist
-                if playlist['owner']['id'] == 'spotify' and \
-                   playlist['description'] == f'Your daily update of the most played tracks right now - {country}.':
-                    # Create a dictionary with playlist information
-                    playlist_details = {
-                        'playlist_id': playlist.get('id', 'Unknown'),
-                        'playlist_name': playlist.get('name', 'Unknown')
-                    }
-                    time.sleep(0.5)  # Sleep after processing the playlist
-                    return playlist_details
-
-            elif response.status_code == 401:
-                logging.warning('Access token expired. Requesting a new one...\n')
-                time.sleep(60)
-                access_token = refresh_access_token()
-                if access_token:
-                    headers['Authorization'] = f'Bearer {access_token}'
-                    continue
-                else:
-                    logging.error('Failed to refresh access token. Exiting...\n')
-                    break
-
-            elif response.status_code == 429:
-                logging.warning(f'Attempt {attempt + 1}/{retry_attempts}: Rate limit exceeded. Switching credentials...')
-                time.sleep(60)
-                switch_client_credentials()
-                access_token = refresh_access_token()
-                if access_token:
-                    headers['Authorization'] = f'Bearer {access_token}'
-                    continue
-                else:
-                    logging.error('Failed to refresh access token after switching credentials. Exiting...\n')
-                    break
-
-            else:
-                logging.error('Error searching %s: %s, %s\n', 
-                              country, response.status_code, response.text)
-                break
-
-        except requests.exceptions.RequestException as e:
-            logging.error('Network error occurred: %s', e)
-            continue
+    result = await client.get('/v1/search', params=params)
+
+    if result is None:
+        logging.error('Failed to fetch playlist for %s after multiple attempts.', country)
+        return None
+
+    playlist = result.get('playlists', {}).get('items', [])
+    if not playlist:
+        logging.info('No more playlists for query: %s', country)
+        return None
+
+    playlist = playlist[0]  # Access the first playlist
+    if playlist['owner']['id'] == 'spotify' and \
+       playlist['description'] == f'Your daily update of the most played tracks right now - {country}.':
+        # Create a dictionary with playlist information
+        return {
+            'playlist_id': playlist.get('id', 'Unknown'),
+            'playlist_name': playlist.get('name', 'Unknown')
+        }
 
-    logging.error('Failed to fetch tracks after multiple attempts.')
     return None
     
 def save_playlists_to_postgres(playlists_data):
-    insert_query = """
-    INSERT INTO playlists (
-        country, 
-        playlist_id, 
-        playlist_name
+    return upsert_records(
+        connection_params, 'playlists',
+        ['country', 'playlist_id', 'playlist_name'],
+        playlists_data,
+        conflict_columns=['playlist_id']
     )
-    VALUES (%s, %s, %s)
-    ON CONFLICT (playlist_id) DO NOTHING;
-    """
     
-    try:
-        connection = psycopg2.connect(**connection_params)
-        cursor = connection.cursor()
-        
-        for playlist in playlists_data:
-            cursor.execute(insert_query, (playlist['country'], playlist['playlist_id'], playlist['playlist_name']))
-        
-        # Commit changes once after all insertions
-        connection.commit()
+# Charts with a configured playlist_id skip the search; only the playlist name is requested
+async def get_playlist_from_chart(client, chart):
+    if not chart.get('playlist_id'):
+        return await get_playlist_from_top50_country(client, chart['country'], chart['market'])
 
-    except errors.UniqueViolation:
-        logging.warning("A duplicate entry was found. No action taken.")
-    except Exception as e:
-        logging.error('An unexpected error occurred: %s', e)
-        return False
-    finally:
-        # Ensure resources are closed
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
+    result = await client.get(
+        f"/v1/playlists/{chart['playlist_id']}", params={'fields': 'id,name', 'market': chart['market']}
+    )
+    if result is None:
+        logging.error('Failed to fetch playlist %s after multiple attempts.', chart['playlist_id'])
+        return None
 
-    return True
-    
+    return {
+        'playlist_id': result.get('id', chart['playlist_id']),
+        'playlist_name': result.get('name', 'Unknown')
+    }
+
+async def get_playlists_from_charts(client, charts, checkpoints):
+    async def search(chart):
+        now = datetime.now(hochiminh_tz)
+        readable_time = now.strftime('%Y-%m-%d %H:%M:%S')
+        logging.info(f"Search playlist for: {chart['country']} {chart.get('playlist_id', 'Top 50')}\nStart time: {readable_time}")
+        unit = f"{chart['country']}:{chart.get('playlist_id', 'Top 50')}"
+        return await checkpoints.run(unit, get_playlist_from_chart, client, chart)
+
+    # All charts are looked up concurrently; the client bounds concurrency and rate
+    return await asyncio.gather(*(search(chart) for chart in charts))
+
+@instrumented_task
 def fetch_playlists(**kwargs):
-    retry_attempts = 3
-    for attempt in range(retry_attempts):
-        access_token = refresh_access_token()
-        
-        if access_token:
-            break  # Exit the loop if we successfully get an access token
-        else:
-            logging.error(f'Failed to obtain access token on attempt {attempt + 1}/{retry_attempts}.')
-            
-            if attempt < retry_attempts - 1:
-                time.sleep(60)
-                switch_client_credentials()
-    else:
+    charts = load_charts()
+    checkpoints = open_checkpoints(checkpoint_path, 'fetch_playlists', kwargs)
+    try:
+        playlists = run_with_client(get_playlists_from_charts, charts, checkpoints)
+    except SpotifyAuthError:
         logging.error('Exhausted all attempts to obtain access token. Exiting...')
         return []
+    finally:
+        checkpoints.log_skipped(len(charts))
+        checkpoints.close()
 
-    headers = {'Authorization': f'Bearer {access_token}'}
-    sea_countries_list = {
-        'Indonesia': 'ID', 'Malaysia': 'MY', 'Philippines': 'PH',
-        'Singapore': 'SG', 'Thailand': 'TH', 'Vietnam': 'VN'
-    }
     all_playlists = []
     
-    for country_name, country_code in sea_countries_list.items():
-        now = datetime.now(hochiminh_tz)
-        readable_time = now.strftime('%Y-%m-%d %H:%M:%S')
-        logging.info(f'Search playlist with name: {country_name}\nStart time: {readable_time}')
-        playlist = get_playlist_from_top50_country(country_name, country_code, headers)
-
+    for chart, playlist in zip(charts, playlists):
         if playlist:  # Check if playlists_list is not None
-            playlist['country'] = country_name
+            playlist['country'] = chart['country']
             all_playlists.append(playlist)
             logging.info(f'Playlist found: {playlist}\n')
         else:
-            logging.info(f'No playlists found for: {country_name}\n')
+            logging.info(f"No playlists found for: {chart['country']}\n")
     
     if all_playlists:
         playlists_df = pd.DataFrame(all_playlists)
         playlists_data = playlists_df.to_dict(orient='records')
         
-        file_path = './data/playlists.csv'
-        playlists_df.to_csv(file_path, mode='w', index=False, header=True)       
+        date_str = run_date(kwargs)
+        write_partitions(playlists_df.assign(date=date_str), 'playlists')
         
-        kwargs['ti'].xcom_push(key='playlists_df', value=playlists_data)
-        logging.info('Playlists dataframe saved successfully in XCom.')
+        # XCom only carries the artifact path and row count
+        push_artifact(kwargs['ti'], 'playlists_df', playlists_df, kwargs['run_id'])
+        logging.info('Playlists dataframe saved successfully.')
         
         save_playlists_to_postgres(playlists_data)
-        return True
+        # One mapped fetch_tracks task per country that has a playlist
+        return [{'country': country} for country in playlists_df['country'].unique()]
     else:
         logging.info('No playlists to save.')
-        return False
+        return []
 
 # Task 2: fetch tracks from specific playlists
-def get_tracks_from_playlist(playlist_id, headers):
+async def get_playlist_items(client, playlist_id):
+    url = f'/v1/playlists/{playlist_id}/tracks'
+    params = {'fields': playlist_track_fields, 'limit': playlist_page_size}
+    first_page = await client.get(url, params={**params, 'offset': 0})
+
+    if first_page is None:
+        return None
+
+    # The first page gives the total, so all remaining pages are requested at once
+    offsets = range(playlist_page_size, first_page.get('total', 0), playlist_page_size)
+    pages = await asyncio.gather(*(client.get(url, params={**params, 'offset': offset}) for offset in offsets))
+
+    if any(page is None for page in pages):
+        logging.error('Failed to fetch all pages of playlist %s.', playlist_id)
+        return None
+
+    return [item for page in [first_page, *pages] for item in page.get('items', [])]
+
+async def get_tracks_from_playlist(client, playlist_id):
     tracks_list = []
-    # Construct the URL for searching tracks
-    url = f'https://api.spotify.com/v1/playlists/{playlist_id}'
     current_track_position = 1
-    retry_attempts = 3
-
-    for attempt in range(retry_attempts):
-        try:
-            check_rate_limit()
-            response = requests.get(url, headers=headers, timeout=15)
-
-            if response.status_code == 200:
-                results = response.json()  # Decode the response as JSON
-                playlist_info = results
-                items = playlist_info.get('tracks', {}).get('items', [])
-
-                # Collect track information
-                for item in items:
-                    track = item.get('track', {})
-
-                    if not track:
-                        logging.warning('Missing track data in playlist: %s', playlist_id)
-                        continue
-
-                    # Safely access the 'artists' field within the 'track'
-                    artists = track.get('artists', [])
-                    if not artists:
-                        logging.warning('No artists found for track: %s', track.get('id', 'Unknown'))
-
-                    # Extract artist IDs, or provide a fallback in case of missing data
-                    artists_id = [artist['id'] for artist in artists if artist.get('id') is not None]
-                    artists_id_string = ', '.join(artists_id) if artists_id else 'Unknown'
-
-                    # Create the track info dictionary
-                    track_info = {
-                        'artists_id': artists_id_string,                              # List of artist IDs
-                        'album_id': track.get('album', {}).get('id', 'Unknown'),      # Album ID
-                        'track_id': track.get('id', 'Unknown'),                       # Track ID
-                        'track_uri': track.get('uri', 'Unknown'),                     # Track URI
-                        'track_name': track.get('name', 'Unknown'),                   # Track name
-                        'track_release_date': track.get('album', {})
-                                                .get('release_date', 'Unknown'),   # Release date
-                        'track_date_added': item.get('added_at', 'Unknown'),          # Track's date added in the playlist
-                        'track_duration_ms': track.get('duration_ms', 0),             # Duration in milliseconds
-                        'track_popularity': track.get('popularity', 0),               # Popularity (0-100)
-                        'track_position': current_track_position,                                # The position of track in playlist
-                        'is_explicit': track.get('explicit', False)                   # Whether the track is explicit
-                    }
-
-                    current_track_position += 1  # Increment the track count for each track
-                    # Add the track info to the tracks list
-                    tracks_list.append(track_info)
-
-                return tracks_list
-
-            elif response.status_code == 401:  # Access token expired
-                logging.warning(f'Attempt {attempt + 1}/{retry_attempts}: Access token expired. Refreshing...')
-                time.sleep(60)
-                access_token = refresh_access_token()
-                if access_token:
-                    headers['Authorization'] = f'Bearer {access_token}'
-                    continue
-                else:
-                    logging.error('Failed to refresh access token. Exiting...\n')
-                    break
-
-            elif response.status_code == 429:  # Too many requests
-                logging.warning(f'Attempt {attempt + 1}/{retry_attempts}: Rate limit exceeded. Switching credentials...')
-                time.sleep(60)
-                switch_client_credentials()
-                access_token = refresh_access_token()
-                if access_token:
-                    headers['Authorization'] = f'Bearer {access_token}'
-                    continue
-                else:
-                    logging.error('Failed to refresh access token after switching credentials. Exiting...\n')
-                    break
-
-            else:  # Handle other errors
-                logging.error('Error searching tracks for playlist ID %s: %s, %s\n', 
-                              playlist_id, response.status_code, response.text)
-                break
-            
-        except requests.exceptions.RequestException as e:
-            logging.error('Network error occurred: %s', e)
+    items = await get_playlist_items(client, playlist_id)
+
+    if items is None:
+        logging.error('Failed to fetch tracks after multiple attempts.')
+        return None
+
+    # Collect track information
+    for item in items:
+        track = item.get('track', {})
+
+        if not track:
+            logging.warning('Missing track data in playlist: %s', playlist_id)
             continue
 
-    logging.error('Failed to fetch tracks after multiple attempts.')
-    return None
+        # Safely access the 'artists' field within the 'track'
+        artists = track.get('artists', [])
+        if not artists:
+            logging.warning('No artists found for track: %s', track.get('id', 'Unknown'))
+
+        # Extract artist IDs, or provide a fallback in case of missing data
+        artists_id = [artist['id'] for artist in artists if artist.get('id') is not None]
+        artists_id_string = ', '.join(artists_id) if artists_id else 'Unknown'
+
+        # Create the track info dictionary
+        track_info = {
+            'artists_id': artists_id_string,                              # List of artist IDs
+            'album_id': track.get('album', {}).get('id', 'Unknown'),      # Album ID
+            'track_id': track.get('id', 'Unknown'),                       # Track ID
+            'track_uri': track.get('uri', 'Unknown'),                     # Track URI
+            'track_name': track.get('name', 'Unknown'),                   # Track name
+            'track_release_date': track.get('album', {})
+                                    .get('release_date', 'Unknown'),   # Release date
+            'track_date_added': item.get('added_at', 'Unknown'),          # Track's date added in the playlist
+            'track_duration_ms': track.get('duration_ms', 0),             # Duration in milliseconds
+            'track_popularity': track.get('popularity', 0),               # Popularity (0-100)
+            'track_position': current_track_position,                                # The position of track in playlist
+            'is_explicit': track.get('explicit', False)                   # Whether the track is explicit
+        }
+
+        current_track_position += 1  # Increment the track count for each track
+        # Add the track info to the tracks list
+        tracks_list.append(track_info)
+
+    return tracks_list
 
 def save_tracks_to_postgres(tracks_data):
-    insert_query = """
-    INSERT INTO tracks (
-        artists_id,         album_id, 
-        track_id,           track_uri, 
-        track_name,         track_release_date, 
-        track_date_added,   track_duration_ms, 
-        track_popularity,   track_position, 
-        is_explicit,        country, 
-        date
-    ) 
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    ON CONFLICT (track_id, country, date) DO NOTHING;
-    """
-    connection = None
-    cursor = None
-    
-    try:
-        insert_values = [
-            (track['artists_id'],       track['album_id'], 
-             track['track_id'],         track['track_uri'], 
-             track['track_name'],       track['track_release_date'], 
-             track['track_date_added'], track['track_duration_ms'], 
-             track['track_popularity'], track['track_position'], 
-             track['is_explicit'],      track['country'], 
-             track['date'],)
-            for track in tracks_data
-        ]
-        
-        # Get the database connection
-        connection = psycopg2.connect(**connection_params)
-        cursor = connection.cursor()
-        
-        # Execute the batch insert
-        cursor.executemany(insert_query, insert_values)
-        # Commit the transaction
-        connection.commit()
-    except Exception as e:
-        logging.error('An error occurred: %s', e)
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
-            
-    return True
+    return upsert_records(
+        connection_params, 'tracks',
+        ['artists_id',         'album_id',
+         'track_id',           'track_uri',
+         'track_name',         'track_release_date',
+         'track_date_added',   'track_duration_ms',
+         'track_popularity',   'track_position',
+         'is_explicit',        'country',
+         'date'],
+        tracks_data,
+        conflict_columns=['track_id', 'country', 'date']
+    )
 
-def fetch_tracks(**kwargs):
-    retry_attempts = 3
-    for attempt in range(retry_attempts):
-        access_token = refresh_access_token()
-        
-        if access_token:
-            break  # Exit the loop if we successfully get an access token
-        else:
-            logging.error(f'Failed to obtain access token on attempt {attempt + 1}/{retry_attempts}.')
-            
-            if attempt < retry_attempts - 1:
-                time.sleep(60)
-                switch_client_credentials()
-    else:
+async def get_tracks_from_playlists(client, playlists_df, checkpoints):
+    async def fetch(playlist_count, playlist):
+        now = datetime.now(hochiminh_tz)
+        readable_time = now.strftime('%Y-%m-%d %H:%M:%S')
+        logging.info(f"Search playlist number: {playlist_count}, playlist name: {playlist['playlist_name']}\nStart time: {readable_time}")
+        return await checkpoints.run(playlist['playlist_id'], get_tracks_from_playlist, client, playlist['playlist_id'])
+
+    playlists = playlists_df.to_dict(orient='records')
+    tracks = await asyncio.gather(*(fetch(count, playlist) for count, playlist in enumerate(playlists, start=1)))
+    return list(zip(playlists, tracks))
+
+# Mapped per country
+@instrumented_task
+def fetch_tracks(country, **kwargs):
+    playlists_df = pull_artifact(kwargs['ti'], 'playlists_df', 'fetch_playlists')
+    playlists_df = playlists_df[playlists_df['country'] == country]
+
+    checkpoints = open_checkpoints(checkpoint_path, 'fetch_tracks', kwargs)
+    try:
+        playlists_tracks = run_with_client(get_tracks_from_playlists, playlists_df, checkpoints)
+    except SpotifyAuthError:
         logging.error('Exhausted all attempts to obtain access token. Exiting...')
         return []
+    finally:
+        checkpoints.log_skipped(len(playlists_df))
+        checkpoints.close()
 
-    headers = {'Authorization': f'Bearer {access_token}'}
     all_tracks = []
-    playlist_count = 1
     
-    playlists_df = pd.DataFrame(kwargs['ti'].xcom_pull(key='playlists_df', task_ids='fetch_playlists'))
-    
-    for index, playlist in playlists_df.iterrows():
-        now = datetime.now(hochiminh_tz)
-        readable_time = now.strftime('%Y-%m-%d %H:%M:%S')
-        logging.info(f"Search playlist number: {playlist_count}, playlist name: {playlist['playlist_name']}\nStart time: {readable_time}")
-        tracks = get_tracks_from_playlist(playlist['playlist_id'], headers)
-        
+    for playlist, tracks in playlists_tracks:
         if tracks:
             logging.info(f'Number of tracks found: {len(tracks)}\n')
             tracks = [{**track, 'country': playlist['country']} for track in tracks]
@@ -433,205 +308,174 @@ def fetch_tracks(**kwargs):
                 all_tracks.append(track)
         else:
             logging.info(f"No tracks found for: {playlist['playlist_id']}\n")
-            
-        playlist_count += 1
     
     if all_tracks:
-        tracks_df = pd.DataFrame(all_tracks)
+        # A track on several charts of one country keeps the first chart's row
+        tracks_df = pd.DataFrame(all_tracks).drop_duplicates(subset='track_id', keep='first')
         tracks_df['track_release_date'] = pd.to_datetime(tracks_df['track_release_date'], errors='coerce')
         default_date = pd.to_datetime('2001-01-01')
         tracks_df['track_release_date'] = tracks_df['track_release_date'].fillna(default_date)
         tracks_df['track_release_date'] = tracks_df['track_release_date'].dt.strftime('%Y-%m-%d')
         
-        date_str = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        date_str = run_date(kwargs)
         tracks_df['date'] = date_str
         tracks_data = tracks_df.to_dict(orient='records')
         
-        file_path = './data/tracks.csv'
-    
-        if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
-            tracks_df.to_csv(file_path, mode='a', index=False, header=False)
-        else:
-            tracks_df.to_csv(file_path, mode='w', index=False, header=True)
+        write_partitions(tracks_df, 'tracks')
         
-        kwargs['ti'].xcom_push(key='tracks_df', value=tracks_data)
+        push_artifact(kwargs['ti'], 'tracks_df', tracks_df, kwargs['run_id'], name=f'tracks_df_{country}')
         logging.info('Tracks dataframe saved successfully.')
         
         save_tracks_to_postgres(tracks_data)
         return True
     else:
-        logging.info('No tracks to save.')
+        logging.info(f'No tracks to save for: {country}')
         return False
 
+def get_unique_artist_ids(tracks_df):
+    artist_ids = tracks_df['artists_id'].str.split(', ').explode().str.strip()
+    return artist_ids.dropna().unique()
+
+# Join the per-country tracks and plan the mapped artist and audio feature batches,
+# leaving out IDs the entity index already knows
+@instrumented_task
+def combine_tracks(**kwargs):
+    tracks_df = pull_artifacts(kwargs['ti'], 'tracks_df', 'fetch_tracks')
+    push_artifact(kwargs['ti'], 'tracks_df', tracks_df, kwargs['run_id'])
+
+    if tracks_df.empty:
+        artist_batches, audio_feature_batches = [], []
+    else:
+        artist_batches = plan_fetch(
+            entity_index_path, 'artists', get_unique_artist_ids(tracks_df),
+            ids_per_mapped_task, artist_batch_size, ttl=artist_ttl_hours * 3600,
+            not_found_ttl=not_found_ttl_hours * 3600
+        )
+        audio_feature_batches = plan_fetch(
+            entity_index_path, 'audio_features', tracks_df['track_id'].unique(),
+            ids_per_mapped_task, audio_feature_batch_size, not_found_ttl=not_found_ttl_hours * 3600
+        )
+
+    kwargs['ti'].xcom_push(key='artist_batches', value=[{'artist_ids': batch} for batch in artist_batches])
+    kwargs['ti'].xcom_push(key='audio_feature_batches', value=[{'track_ids': batch} for batch in audio_feature_batches])
+    return len(tracks_df)
+
 # Task 3: fetch artist information from specific artists id
-def get_artists_from_batch_artists_id(batch_artists_id, headers):
-    url = 'https://api.spotify.com/v1/artists'
+async def get_artists_from_batch_artists_id(client, batch_artists_id):
     params = {'ids': ','.join(batch_artists_id)}  # Join IDs into a comma-separated string
-    retry_attempts = 3
-
-    for attempt in range(retry_attempts):
-        try:
-            check_rate_limit()
-            response = requests.get(url, headers=headers, params=params)
-
-            if response.status_code == 200:
-                artists = response.json().get('artists', [])
-                artists_list = []
-
-                for artist in artists:
-                    if artist:
-                        artist_info = {
-                            'artist_id': artist.get('id', 'Unknown'),
-                            'artist_uri': artist.get('uri', 'Unknown'),
-                            'artist_name': artist.get('name', 'Unknown'),
-                            'artist_genres': artist.get('genres', []),
-                            'artist_popularity': artist.get('popularity', 0),
-                            'artist_follower': artist.get('followers', {}).get('total', 0),
-                            'artist_image_url': artist['images'][0]['url'] if artist['images'] else ''
-                        }
-                        
-                        artists_list.append(artist_info)
-
-                return artists_list
-
-            elif response.status_code == 401:  # Access token expired
-                logging.warning(f'Attempt {attempt + 1}/{retry_attempts}: Access token expired. Refreshing...')
-                time.sleep(60)
-                access_token = refresh_access_token()
-                if access_token:
-                    headers['Authorization'] = f'Bearer {access_token}'
-                    continue
-                else:
-                    logging.error('Failed to refresh access token. Exiting...\n')
-                    break
-
-            elif response.status_code == 429:  # Too many requests
-                logging.warning(f'Attempt {attempt + 1}/{retry_attempts}: Rate limit exceeded. Switching credentials...')
-                time.sleep(60)
-                switch_client_credentials()
-                access_token = refresh_access_token()
-                if access_token:
-                    headers['Authorization'] = f'Bearer {access_token}'
-                    continue
-                else:
-                    logging.error('Failed to refresh access token after switching credentials. Exiting...\n')
-                    break
-
-            else:
-                logging.error('Error fetching artist: %s, %s\n',
-                                response.status_code, response.text)
-                break
-
-        except requests.exceptions.RequestException as e:
-            logging.error('Network error occurred: %s', e)
-            continue
+    result = await client.get('/v1/artists', params=params)
 
-    logging.error('Failed to fetch artists after multiple attempts.')
-    return None
+    if result is None:
+        logging.error('Failed to fetch artists after multiple attempts.')
+        return None
 
-def save_artists_to_postgres(artists_data):
-    insert_query = """
-    INSERT INTO artists (
-        artist_id,         artist_uri, 
-        artist_name,       artist_genres,  
-        artist_popularity, artist_follower,
-        artist_image_url
-    ) 
-    VALUES (%s, %s, %s, %s, %s, %s, %s)
-    ON CONFLICT (artist_id) DO NOTHING;
-    """
-    connection = None
-    cursor = None
+    artists = result.get('artists', [])
+    artists_list = []
+
+    for artist in artists:
+        if artist:
+            artist_info = {
+                'artist_id': artist.get('id', 'Unknown'),
+                'artist_uri': artist.get('uri', 'Unknown'),
+                'artist_name': artist.get('name', 'Unknown'),
+                'artist_genres': artist.get('genres', []),
+                'artist_popularity': artist.get('popularity', 0),
+                'artist_follower': artist.get('followers', {}).get('total', 0),
+                'artist_image_url': artist['images'][0]['url'] if artist['images'] else ''
+            }
+            
+            artists_list.append(artist_info)
 
-    try:
-        insert_values = [
-            (artist['artist_id'],           artist['artist_uri'], 
-             artist['artist_name'],         artist['artist_genres'],  
-             artist['artist_popularity'],   artist['artist_follower'],
-             artist['artist_image_url'])
-            for artist in artists_data
-        ]
-        
-        # Get the database connection
-        connection = psycopg2.connect(**connection_params)
-        cursor = connection.cursor()
-        
-        # Execute the batch insert
-        cursor.executemany(insert_query, insert_values)
-        # Commit the transaction
-        connection.commit()
-    except Exception as e:
-        logging.error('An error occurred: %s', e)
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
-    
-    return True
+    return artists_list
 
-def fetch_artists(**kwargs):
-    retry_attempts = 3
-    for attempt in range(retry_attempts):
-        access_token = refresh_access_token()
-        
-        if access_token:
-            break  # Exit the loop if we successfully get an access token
-        else:
-            logging.error(f'Failed to obtain access token on attempt {attempt + 1}/{retry_attempts}.')
-            
-            if attempt < retry_attempts - 1:
-                time.sleep(60)
-                switch_client_credentials()
-    else:
-        logging.error('Exhausted all attempts to obtain access token. Exiting...')
-        return []
+def save_artists_to_postgres(artists_data):
+    return upsert_records(
+        connection_params, 'artists',
+        ['artist_id',         'artist_uri',
+         'artist_name',       'artist_genres',
+         'artist_popularity', 'artist_follower',
+         'artist_image_url'],
+        artists_data,
+        conflict_columns=['artist_id']
+    )
 
-    headers = {'Authorization': f'Bearer {access_token}'}
-    all_artists = []
-    batch_size = 50
-    
-    tracks_df = pd.DataFrame(kwargs['ti'].xcom_pull(key='tracks_df', task_ids='fetch_tracks'))
-    tracks_df_exploded = tracks_df.copy()
-    
-    tracks_df_exploded['artist_id'] = tracks_df_exploded['artists_id'].str.split(', ')
-    tracks_df_exploded = tracks_df_exploded.explode('artist_id')
-    tracks_df_exploded = tracks_df_exploded.reset_index(drop=True)
-    tracks_df_exploded['artist_id'] = tracks_df_exploded['artist_id'].str.strip()
-    
-    unique_artist_ids = tracks_df_exploded['artist_id'].unique()
-    
-    for batch_start in range(0, len(unique_artist_ids), batch_size):
-        batch_artists_id = unique_artist_ids[batch_start : batch_start + batch_size]
+# Fan a list of IDs out in fixed-size batches through one of the batch getters;
+# with `checkpoints`, batches completed by an earlier attempt are not requested again
+# IDs of the batches Spotify answered are appended to `answered_ids`, so IDs it answered
+# with null can be told apart from IDs whose batch failed
+async def get_batches(client, batch_getter, ids, batch_size, label, checkpoints=None, answered_ids=None):
+    async def fetch(batch_start):
         now = datetime.now(hochiminh_tz)
         readable_time = now.strftime('%Y-%m-%d %H:%M:%S')
         logging.info(f"Processing batch starting at index {batch_start}...\nStart time: {readable_time}")
+        batch_ids = list(ids[batch_start : batch_start + batch_size])
+        if checkpoints is None:
+            batch = await batch_getter(client, batch_ids)
+        else:
+            batch = await checkpoints.run(batch_unit(batch_ids), batch_getter, client, batch_ids)
+        if batch is not None and answered_ids is not None:
+            answered_ids.extend(batch_ids)
 
-        batch_artists = get_artists_from_batch_artists_id(batch_artists_id, headers)
-
-        if batch_artists:
-            logging.info(f'Total number of unique artists processed in batch: {len(batch_artists)}')
-            
-            for artist in batch_artists:
-                all_artists.append(artist)
+        if batch:
+            logging.info(f'Total number of unique {label} processed in batch: {len(batch)}')
         else:
-            logging.info(f'No artists found for batch starting at index {batch_start}\n')
+            logging.info(f'No {label} found for batch starting at index {batch_start}\n')
+        return batch or []
+
+    batches = await asyncio.gather(*(fetch(batch_start) for batch_start in range(0, len(ids), batch_size)))
+    return [record for batch in batches for record in batch]
+
+# Mapped per chunk of artist IDs; results go to the entity index
+@instrumented_task
+def fetch_artist_batch(artist_ids, **kwargs):
+    checkpoints = open_checkpoints(checkpoint_path, 'fetch_artist_batch', kwargs)
+    answered_ids = []
+    try:
+        artists = run_with_client(
+            get_batches, get_artists_from_batch_artists_id, artist_ids, artist_batch_size, 'artists', checkpoints,
+            answered_ids
+        )
+    except SpotifyAuthError:
+        logging.error('Exhausted all attempts to obtain access token. Exiting...')
+        return 0
+    finally:
+        checkpoints.log_skipped(-(-len(artist_ids) // artist_batch_size))
+        checkpoints.close()
+    store_entities(entity_index_path, 'artists', artists, 'artist_id', answered_ids)
+    return len(artists)
+
+@instrumented_task
+def fetch_artists(**kwargs):
+    batch_size = artist_batch_size
+    
+    tracks_df = pull_artifact(kwargs['ti'], 'tracks_df', 'combine_tracks', columns=['artists_id'])
+    if tracks_df.empty:
+        logging.info('No tracks to fetch artists for.')
+        return False
+    unique_artist_ids = get_unique_artist_ids(tracks_df)
+
+    try:
+        # The mapped batches already filled the index; anything they missed is fetched here
+        all_artists = fetch_with_index(
+            entity_index_path, 'artists', unique_artist_ids, 'artist_id',
+            lambda missing_ids, answered_ids: run_with_client(
+                get_batches, get_artists_from_batch_artists_id, missing_ids, batch_size, 'artists', None, answered_ids
+            ),
+            batch_size, ttl=artist_ttl_hours * 3600, log_hits=False, not_found_ttl=not_found_ttl_hours * 3600
+        )
+    except SpotifyAuthError:
+        logging.error('Exhausted all attempts to obtain access token. Exiting...')
+        return []
     
     if all_artists:
         artists_df = pd.DataFrame(all_artists)
         artists_data = artists_df.to_dict(orient='records')
         
-        file_path = './data/artists.csv'
-    
-        if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
-            existing_artists_df = pd.read_csv(file_path)
-            artists_df = pd.concat([existing_artists_df, artists_df], ignore_index=True)
-            
-        artists_df.drop_duplicates(subset='artist_id', inplace=True)
-        artists_df.sort_values(by='artist_id', ascending=True, inplace=True)
-        artists_df.to_csv(file_path, mode='w', index=False, header=True)
+        # Only the run's partition is written; read_latest('artists', 'artist_id') gives the current record
+        date_str = run_date(kwargs)
+        write_partitions(artists_df.assign(date=date_str), 'artists')
         
-        kwargs['ti'].xcom_push(key='artists_df', value=artists_data)
+        push_artifact(kwargs['ti'], 'artists_df', artists_df, kwargs['run_id'])
         logging.info('Artists dataframe saved successfully.')
         
         save_artists_to_postgres(artists_data)
@@ -641,191 +485,112 @@ def fetch_artists(**kwargs):
         return False
 
 # Task 4: fetch tracks audio features from specific tracks
-def get_tracks_audio_feature_from_batch(batch_tracks_id, headers):
-    url = 'https://api.spotify.com/v1/audio-features'
+async def get_tracks_audio_feature_from_batch(client, batch_tracks_id):
     params = {'ids': ','.join(batch_tracks_id)}  # Join IDs into a comma-separated string
-    retry_attempts = 3
-
-    for attempt in range(retry_attempts):
-        try:
-            check_rate_limit()
-            response = requests.get(url, headers=headers, params=params, timeout=15)
-
-            if response.status_code == 200:
-                audio_features = response.json().get('audio_features', [])
-                audio_features_list = []
-
-                for feature in audio_features:
-                    if feature:  # Ensure the feature object isn't None
-                        audio_feature_info = {
-                            'track_id': feature.get('id', 'Unknown'),
-                            'danceability': feature.get('danceability', 0.0),
-                            'energy': feature.get('energy', 0.0),
-                            'key': feature.get('key', 'Unknown'),
-                            'loudness': feature.get('loudness', 0.0),
-                            'mode': feature.get('mode', 0),
-                            'speechiness': feature.get('speechiness', 0.0),
-                            'acousticness': feature.get('acousticness', 0.0),
-                            'instrumentalness': feature.get('instrumentalness', 0.0),
-                            'liveness': feature.get('liveness', 0.0),
-                            'valence': feature.get('valence', 0.0),
-                            'tempo': feature.get('tempo', 0.0),
-                            'duration_ms': feature.get('duration_ms', 0),
-                            'time_signature': feature.get('time_signature', 4)
-                        }
-                        audio_features_list.append(audio_feature_info)
-
-                return audio_features_list
-
-            elif response.status_code == 401:  # Access token expired
-                logging.warning(f'Attempt {attempt + 1}/{retry_attempts}: Access token expired. Refreshing...')
-                time.sleep(60)
-                access_token = refresh_access_token()
-                if access_token:
-                    headers['Authorization'] = f'Bearer {access_token}'
-                    continue
-                else:
-                    logging.error('Failed to refresh access token. Exiting...\n')
-                    break
-
-            elif response.status_code == 429:  # Too many requests
-                logging.warning(f'Attempt {attempt + 1}/{retry_attempts}: Rate limit exceeded. Switching credentials...')
-                time.sleep(60)
-                switch_client_credentials()
-                access_token = refresh_access_token()
-                if access_token:
-                    headers['Authorization'] = f'Bearer {access_token}'
-                    continue
-                else:
-                    logging.error('Failed to refresh access token after switching credentials. Exiting...\n')
-                    break
-
-            else:
-                logging.error('Error fetching audio features: %s, %s\n',
-                              response.status_code, response.text)
-                break
-
-        except requests.exceptions.RequestException as e:
-            logging.error('Network error occurred: %s', e)
-            continue
-        
-    logging.error('Failed to fetch audio features after multiple attempts.')
-    return None
+    result = await client.get('/v1/audio-features', params=params)
+
+    if result is None:
+        logging.error('Failed to fetch audio features after multiple attempts.')
+        return None
+
+    audio_features = result.get('audio_features', [])
+    audio_features_list = []
+
+    for feature in audio_features:
+        if feature:  # Ensure the feature object isn't None
+            audio_feature_info = {
+                'track_id': feature.get('id', 'Unknown'),
+                'danceability': feature.get('danceability', 0.0),
+                'energy': feature.get('energy', 0.0),
+                'key': feature.get('key', 'Unknown'),
+                'loudness': feature.get('loudness', 0.0),
+                'mode': feature.get('mode', 0),
+                'speechiness': feature.get('speechiness', 0.0),
+                'acousticness': feature.get('acousticness', 0.0),
+                'instrumentalness': feature.get('instrumentalness', 0.0),
+                'liveness': feature.get('liveness', 0.0),
+                'valence': feature.get('valence', 0.0),
+                'tempo': feature.get('tempo', 0.0),
+                'duration_ms': feature.get('duration_ms', 0),
+                'time_signature': feature.get('time_signature', 4)
+            }
+            audio_features_list.append(audio_feature_info)
+
+    return audio_features_list
 
 def save_tracks_audio_feature_to_postgres(tracks_audio_feature_data):
-    insert_query = """
-    INSERT INTO tracks_audio_feature (
-        artists_id,         album_id, 
-        track_id,           track_uri, 
-        track_name,         track_release_date, 
-        track_date_added,   track_duration_ms, 
-        track_popularity,   track_position, 
-        is_explicit,        country, 
-        date,               danceability, 
-        energy,             key, 
-        loudness,           mode, 
-        speechiness,        acousticness, 
-        instrumentalness,   liveness, 
-        valence,            tempo, 
-        duration_ms,        time_signature
-    ) 
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    ON CONFLICT (track_id, country, date) DO NOTHING;
-    """
-    connection = None
-    cursor = None
-    
+    return upsert_records(
+        connection_params, 'tracks_audio_feature',
+        ['artists_id',         'album_id',
+         'track_id',           'track_uri',
+         'track_name',         'track_release_date',
+         'track_date_added',   'track_duration_ms',
+         'track_popularity',   'track_position',
+         'is_explicit',        'country',
+         'date',               'danceability',
+         'energy',             'key',
+         'loudness',           'mode',
+         'speechiness',        'acousticness',
+         'instrumentalness',   'liveness',
+         'valence',            'tempo',
+         'duration_ms',        'time_signature'],
+        tracks_audio_feature_data,
+        conflict_columns=['track_id', 'country', 'date']
+    )
+
+# Mapped per chunk of track IDs; results go to the entity index
+@instrumented_task
+def fetch_audio_feature_batch(track_ids, **kwargs):
+    checkpoints = open_checkpoints(checkpoint_path, 'fetch_audio_feature_batch', kwargs)
+    answered_ids = []
     try:
-        insert_values = [
-            (track['artists_id'],       track['album_id'], 
-             track['track_id'],         track['track_uri'], 
-             track['track_name'],       track['track_release_date'], 
-             track['track_date_added'], track['track_duration_ms'], 
-             track['track_popularity'], track['track_position'], 
-             track['is_explicit'],      track['country'], 
-             track['date'],        track['danceability'],
-             track['energy'],           track['key'], 
-             track['loudness'],         track['mode'], 
-             track['speechiness'],      track['acousticness'], 
-             track['instrumentalness'], track['liveness'], 
-             track['valence'],          track['tempo'], 
-             track['duration_ms'],      track['time_signature'])
-            for track in tracks_audio_feature_data
-        ]
-        
-        # Get the database connection
-        connection = psycopg2.connect(**connection_params)
-        cursor = connection.cursor()
-        
-        # Execute the batch insert
-        cursor.executemany(insert_query, insert_values)
-        # Commit the transaction
-        connection.commit()
-    except Exception as e:
-        logging.error('An error occurred: %s', e)
+        audio_features = run_with_client(
+            get_batches, get_tracks_audio_feature_from_batch, track_ids, audio_feature_batch_size, 'audio features',
+            checkpoints, answered_ids
+        )
+    except SpotifyAuthError:
+        logging.error('Exhausted all attempts to obtain access token. Exiting...')
+        return 0
     finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
-            
-    return True
+        checkpoints.log_skipped(-(-len(track_ids) // audio_feature_batch_size))
+        checkpoints.close()
+    store_entities(entity_index_path, 'audio_features', audio_features, 'track_id', answered_ids)
+    return len(audio_features)
 
+@instrumented_task
 def fetch_tracks_audio_feature(**kwargs):
-    retry_attempts = 3
-    for attempt in range(retry_attempts):
-        access_token = refresh_access_token()
-        
-        if access_token:
-            break  # Exit the loop if we successfully get an access token
-        else:
-            logging.error(f'Failed to obtain access token on attempt {attempt + 1}/{retry_attempts}.')
-            
-            if attempt < retry_attempts - 1:
-                time.sleep(60)
-                switch_client_credentials()
-    else:
-        logging.error('Exhausted all attempts to obtain access token. Exiting...')
-        return []
-
-    headers = {'Authorization': f'Bearer {access_token}'}
-    all_tracks_audio_features = []
-    batch_size = 100
+    batch_size = audio_feature_batch_size
     
-    tracks_df = pd.DataFrame(kwargs['ti'].xcom_pull(key='tracks_df', task_ids='fetch_tracks'))
+    tracks_df = pull_artifact(kwargs['ti'], 'tracks_df', 'combine_tracks')
+    if tracks_df.empty:
+        logging.info('No tracks to fetch audio features for.')
+        return False
     unique_tracks_id = tracks_df['track_id'].unique()
-    
-    for batch_start in range(0, len(unique_tracks_id), batch_size):
-        batch_tracks_id = unique_tracks_id[batch_start : batch_start + batch_size]
-        now = datetime.now(hochiminh_tz)
-        readable_time = now.strftime('%Y-%m-%d %H:%M:%S')
-        logging.info(f"Processing batch starting at index {batch_start}...\nStart time: {readable_time}")
-
-        batch_audio_features = get_tracks_audio_feature_from_batch(batch_tracks_id, headers)
 
-        if batch_audio_features:
-            logging.info(f'Total number of unique audio features processed in batch {len(batch_audio_features)}')
-            
-            for track_audio_feature in batch_audio_features:
-                all_tracks_audio_features.append(track_audio_feature)
-        else:
-            logging.info(f'No audio features found for batch starting at index {batch_start}\n')
+    try:
+        # Audio features never change, so known tracks are never requested again
+        all_tracks_audio_features = fetch_with_index(
+            entity_index_path, 'audio_features', unique_tracks_id, 'track_id',
+            lambda missing_ids, answered_ids: run_with_client(
+                get_batches, get_tracks_audio_feature_from_batch, missing_ids, batch_size, 'audio features', None,
+                answered_ids
+            ),
+            batch_size, log_hits=False, not_found_ttl=not_found_ttl_hours * 3600
+        )
+    except SpotifyAuthError:
+        logging.error('Exhausted all attempts to obtain access token. Exiting...')
+        return []
     
     if all_tracks_audio_features:
         tracks_audio_features_df = pd.DataFrame(all_tracks_audio_features)
         tracks_audio_feature_df = pd.merge(tracks_df, tracks_audio_features_df, on='track_id', how='left')
-        date_str = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        date_str = run_date(kwargs)
         tracks_audio_feature_df['date'] = date_str
         tracks_audio_feature_data = tracks_audio_feature_df.to_dict(orient='records')
         
-        file_path = './data/tracks_audio_feature.csv'
-    
-        if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
-            tracks_audio_feature_df.to_csv(file_path, mode='a', index=False, header=False)
-        else:
-            tracks_audio_feature_df.to_csv(file_path, mode='w', index=False, header=True)
+        write_partitions(tracks_audio_feature_df, 'tracks_audio_feature')
         
-        kwargs['ti'].xcom_push(key='full_tracks_df', value=tracks_audio_feature_data)
+        push_artifact(kwargs['ti'], 'full_tracks_df', tracks_audio_feature_df, kwargs['run_id'])
         logging.info('Audio features tracks dataframe saved successfully.')
         
         save_tracks_audio_feature_to_postgres(tracks_audio_feature_data)
@@ -835,147 +600,70 @@ def fetch_tracks_audio_feature(**kwargs):
         return False
 
 # Task 5: fetch tracks stream counts in the previous day from specific tracks
-def get_stream_track_count(track_id, start_date, end_date):
-    url = f'https://www.mystreamcount.com/api/track/{track_id}/streams'
-    retry_attempts = 3
-    interval = 30
-
-    for attempt in range(retry_attempts):
-        try:
-            check_rate_limit(60, 20)
-            response = requests.get(url, timeout=30)
-
-            if response.status_code == 200:
-                json_response = response.json()
-
-                if json_response.get('error') or (json_response.get('status') and json_response['status'] == 'processing'):
-                    logging.warning(f"Attempt {attempt + 1}/{retry_attempts}: Status is 'processing' for track_id: {track_id}. Retrying after waiting.")
-                    time.sleep(interval)
-                    interval *= 2
-                    continue
-                else:
-                    dates = json_response.get('data', {})
-
-                    if not dates:
-                        logging.warning("No stream data available.")
-                        return []
-
-                    stream_list = []
-                    specific_date = start_date
-
-                    while specific_date <= end_date:
-                        date_str = specific_date.strftime('%Y-%m-%d')
-                        stream_info = dates.get(date_str)
-
-                        if stream_info:
-                            stream_entry = {
-                                'track_id': track_id,
-                                'date': date_str,
-                                'stream_daily': stream_info.get('daily') if not pd.isna(stream_info.get('daily')) else 0,
-                                'stream_total': stream_info.get('total') if not pd.isna(stream_info.get('total')) else 0
-                            }
-                            
-                            stream_list.append(stream_entry)
-                            
-                        specific_date += timedelta(days=1)
-
-                    return stream_list
-
-            else:
-                logging.error('Error fetching stream data: %s, %s', 
-                              response.status_code, response.text)
-
-        except requests.exceptions.RequestException as e:
-            logging.error('Request failed: %s', e)
-
-    logging.error('Failed to fetch stream data after multiple attempts.')
-    return None
-
 def save_stream_to_postgres(tracks_stream_data):
-    insert_query = """
-    INSERT INTO tracks_stream (
-        artists_id,     album_id,
-        track_id,       track_uri,
-        track_name,     date,
-        stream_daily,   stream_total
+    return upsert_records(
+        connection_params, 'tracks_stream',
+        ['artists_id',     'album_id',
+         'track_id',       'track_uri',
+         'track_name',     'date',
+         'stream_daily',   'stream_total'],
+        tracks_stream_data,
+        conflict_columns=['track_id', 'date']
     )
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-    ON CONFLICT (track_id, date) DO NOTHING;
-    """
-    connection = None
-    cursor = None
-
-    try:
-        insert_values = [
-            (stream['artists_id'],      stream['album_id'], 
-             stream['track_id'],        stream['track_uri'],  
-             stream['track_name'],      stream['date'],
-             stream['stream_daily'],    stream['stream_total'])
-            for stream in tracks_stream_data
-        ]
-        
-        # Get the database connection
-        connection = psycopg2.connect(**connection_params)
-        cursor = connection.cursor()
-        
-        # Execute the batch insert
-        cursor.executemany(insert_query, insert_values)
-        # Commit the transaction
-        connection.commit()
-    except Exception as e:
-        logging.warning(f"An error occurred: {e}")
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
-            
-    return True
 
-def fetch_tracks_stream():
-    in_file_path = './data/tracks.csv'
-    tracks_df = pd.read_csv(in_file_path)
-    
-    tracks_df['date'] = pd.to_datetime(tracks_df['date'])
-    tracks_df['track_release_date'] = pd.to_datetime(tracks_df['track_release_date'])
-    
-    specific_date = datetime.now(timezone.utc).date() - timedelta(days=1)
-    tracks_specific_date_df = tracks_df[tracks_df['date'].dt.date == specific_date].copy()
+@instrumented_task
+def fetch_tracks_stream(**kwargs):
+    specific_date = datetime.strptime(run_date(kwargs), '%Y-%m-%d').date() - timedelta(days=1)
+    # Only the previous day's partitions and the columns needed below are read
+    tracks_specific_date_df = read_dataset(
+        'tracks',
+        columns=['track_id', 'artists_id', 'album_id', 'track_uri', 'track_name', 'track_release_date'],
+        filters=[('date', '=', specific_date.strftime('%Y-%m-%d'))]
+    )
+    tracks_specific_date_df['track_release_date'] = pd.to_datetime(tracks_specific_date_df['track_release_date'])
     
     tracks = tracks_specific_date_df[['track_id', 'track_release_date']].drop_duplicates()
     tracks = tracks.sort_values(by='track_id', ascending=True)
     
-    all_tracks_stream = []
-    track_count = 1
+    # One crawl job per track; windows already in the stream cache are never requested again
+    jobs = []
+    for track in tracks.itertuples(index=False):
+        window = stream_window(track.track_release_date.date(), specific_date)
 
-    for index, track in tracks.iterrows():
-        now = datetime.now(hochiminh_tz)
-        readable_time = now.strftime('%Y-%m-%d %H:%M:%S')
-        logging.info(f"Search stream track number: {track_count}, track_id: {track['track_id']} \nStart time: {readable_time}")
-
-        release_date = track['track_release_date'].date()
-        limit_date = specific_date - timedelta(days=7)
-        nearer_date = min(release_date, limit_date, key=lambda d: abs(specific_date - d))
-
-        if nearer_date <= specific_date:
-            start_date = nearer_date
-            end_date = nearer_date + timedelta(days=6)
-            track_stream_count = get_stream_track_count(track['track_id'], start_date, end_date)
+        if window is not None:
+            jobs.append(StreamJob(track.track_id, *window))
+        else:
+            logging.info(f'No stream date found for track_id: {track.track_id}')
 
-            if track_stream_count:
-                logging.info(f'Number of stream date data collected: {len(track_stream_count)}')
-                all_tracks_stream.extend(track_stream_count)
-            else:
-                logging.info(f'No stream date found')
+    # Tracks finished by an earlier attempt come from the checkpoints; each newly downloaded
+    # track is checkpointed as soon as it completes. A forced run also bypasses the stream cache.
+    checkpoints = open_checkpoints(checkpoint_path, 'fetch_tracks_stream', kwargs)
+    try:
+        stream_results = {job.track_id: checkpoints.completed[job.track_id]
+                          for job in jobs if job.track_id in checkpoints.completed}
+        pending = [job for job in jobs if job.track_id not in stream_results]
+        logging.info(f'Crawling stream counts for {len(pending)} tracks '
+                     f'({len(stream_results)} completed by an earlier attempt)')
+        limiter = create_limiter(rate_limit_store_url, time_window=60, rate_limit=20)
+        stream_results.update(crawl_streams(
+            pending, stream_cache_path, limiter=limiter, refresh=is_forced(kwargs, 'fetch_tracks_stream'),
+            processing_delay=stream_processing_delay,
+            on_complete=lambda job, rows: checkpoints.record(job.track_id, rows)
+        ))
+    finally:
+        checkpoints.close()
 
+    all_tracks_stream = []
+    for job in jobs:
+        track_stream_count = stream_results.get(job.track_id)
+        if track_stream_count:
+            all_tracks_stream.extend(track_stream_count)
         else:
-            logging.info(f'No stream date found')
-
-        track_count += 1
+            logging.info(f'No stream date found for track_id: {job.track_id}')
 
     if all_tracks_stream:
         tracks_stream_df = pd.DataFrame(all_tracks_stream)
-        tracks_df_unique = tracks_df[['track_id', 'artists_id', 'album_id', 'track_uri', 'track_name']].drop_duplicates(subset='track_id')
+        tracks_df_unique = tracks_specific_date_df[['track_id', 'artists_id', 'album_id', 'track_uri', 'track_name']].drop_duplicates(subset='track_id')
         tracks_stream_df = pd.merge(
             tracks_stream_df, 
             tracks_df_unique, 
@@ -984,15 +672,8 @@ def fetch_tracks_stream():
         )
         tracks_stream_data = tracks_stream_df.to_dict(orient='records')
         
-        out_file_path = './data/tracks_stream.csv'
-        
-        if os.path.exists(out_file_path) and os.path.getsize(out_file_path) > 0:
-            existing_tracks_stream_df = pd.read_csv(out_file_path)
-            tracks_stream_df = pd.concat([existing_tracks_stream_df, tracks_stream_df], ignore_index=True)
-            
-        tracks_stream_df.drop_duplicates(subset=['track_id', 'date'], inplace=True)
-        tracks_stream_df.sort_values(by=['track_id', 'date'], ascending=True, inplace=True)
-        tracks_stream_df.to_csv(out_file_path, mode='w', index=False, header=True)
+        # Merges into the touched date partitions only, replacing rows with the same track_id
+        write_partitions(tracks_stream_df, 'tracks_stream')
         
         logging.info('Tracks stream dataframe saved successfully.')
         
@@ -1002,6 +683,12 @@ def fetch_tracks_stream():
         logging.info('No stream to save.')
         return False
 
+# Task 6: drop artifacts and checkpoints of runs older than their retention periods
+@instrumented_task
+def cleanup_run_state():
+    cleanup_artifacts()
+    prune_checkpoints(checkpoint_path, checkpoint_retention_days)
+
 # Set up DAG
 dag = DAG(
     dag_id='Spotify_Data_Collection_ETL_Pipeline',
@@ -1021,29 +708,64 @@ fetch_playlists_task = PythonOperator(
     python_callable=fetch_playlists,
     dag=dag
 )
-# Task 2
-fetch_tracks_task = PythonOperator(
+# Task 2: one mapped task per country, then one task joining their tracks
+fetch_tracks_task = PythonOperator.partial(
     task_id='fetch_tracks',
     python_callable=fetch_tracks,
     dag=dag
+).expand(op_kwargs=fetch_playlists_task.output)
+
+combine_tracks_task = PythonOperator(
+    task_id='combine_tracks',
+    python_callable=combine_tracks,
+    dag=dag
 )
-# Task 3
+# Task 3: mapped artist batches, then the artists output. none_failed so the output is
+# still written when every artist was already in the index and no batch was mapped; it
+# also starts when combine_tracks pushed no tracks, so both outputs return early on an
+# empty tracks frame. Task 4 uses the same rule for audio features.
+fetch_artist_batch_task = PythonOperator.partial(
+    task_id='fetch_artist_batch',
+    python_callable=fetch_artist_batch,
+    dag=dag
+).expand(op_kwargs=XComArg(combine_tracks_task, key='artist_batches'))
+
 fetch_artists_task = PythonOperator(
     task_id='fetch_artists',
     python_callable=fetch_artists,
+    trigger_rule='none_failed',
     dag=dag
 )
-# Task 4
+# Task 4: mapped audio feature batches, then the audio features output
+fetch_audio_feature_batch_task = PythonOperator.partial(
+    task_id='fetch_audio_feature_batch',
+    python_callable=fetch_audio_feature_batch,
+    dag=dag
+).expand(op_kwargs=XComArg(combine_tracks_task, key='audio_feature_batches'))
+
 fetch_tracks_audio_feature_task = PythonOperator(
     task_id='fetch_tracks_audio_features',
     python_callable=fetch_tracks_audio_feature,
+    trigger_rule='none_failed',
     dag=dag
 )
-# Task 5
+# Task 5: reads the previous day's tracks partition, so it runs alongside the other tasks
 fetch_tracks_stream_task = PythonOperator(
     task_id='fetch_tracks_stream',
     python_callable=fetch_tracks_stream,
     dag=dag
 )
+# Task 6: clean up old run state, even if a crawl task failed
+cleanup_artifacts_task = PythonOperator(
+    task_id='cleanup_artifacts',
+    python_callable=cleanup_run_state,
+    trigger_rule='all_done',
+    dag=dag
+)
 
-fetch_playlists_task >> fetch_tracks_task >> fetch_artists_task >> fetch_tracks_audio_feature_task >> fetch_tracks_stream_task
\ No newline at end of file
+# Artists and audio features only depend on the tracks, so the daily wall time is the
+# longest branch instead of the sum of all stages
+fetch_tracks_task >> combine_tracks_task
+combine_tracks_task >> fetch_artist_batch_task >> fetch_artists_task
+combine_tracks_task >> fetch_audio_feature_batch_task >> fetch_tracks_audio_feature_task
+[fetch_artists_task, fetch_tracks_audio_feature_task, fetch_tracks_stream_task] >> cleanup_artifacts_task
\ No newline at end of file
@@ -0,0 +1,127 @@
+# Pool of Spotify client credentials: cached tokens, least-loaded hand-out and per-credential health
+import asyncio
+import logging
+import time
+from collections import deque
+
+
+class SpotifyAuthError(Exception):
+    pass
+
+
+class Credential:
+    def __init__(self, client_id, client_secret, weight=1):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.weight = weight
+        self.access_token = None
+        self.expires_at = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.recent_throttles = deque()
+        self.cooldown_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def load(self, throttle_window, now):
+        # Forget throttles that fell out of the health window
+        while self.recent_throttles and self.recent_throttles[0] < now - throttle_window:
+            self.recent_throttles.popleft()
+        # Weighted least-loaded: busy or recently throttled credentials rank lower
+        return (self.in_flight + 1) / self.weight * (1 + len(self.recent_throttles))
+
+
+class CredentialPool:
+    def __init__(self, credentials, token_fetcher, refresh_margin=60, throttle_window=300,
+                 failure_cooldown=60, refresh_attempts=3):
+        self.credentials = [
+            Credential(creds['client_id'], creds['client_secret'], creds.get('weight', 1))
+            for creds in credentials
+        ]
+        # token_fetcher(client_id, client_secret) -> (access_token, expires_in) or (None, 0)
+        self.token_fetcher = token_fetcher
+        self.refresh_margin = refresh_margin
+        self.throttle_window = throttle_window
+        self.failure_cooldown = failure_cooldown
+        # Failed token refreshes per credential before acquire() gives up on it
+        self.refresh_attempts = refresh_attempts
+
+    def __len__(self):
+        return len(self.credentials)
+
+    async def refresh(self, credential, stale_token=None):
+        async with credential.lock:
+            # Already replaced by another request while we waited for the lock
+            if stale_token is not None and credential.access_token != stale_token:
+                return credential.access_token
+            if stale_token is None and credential.expires_at - time.time() > self.refresh_margin:
+                return credential.access_token
+
+            access_token, expires_in = await self.token_fetcher(credential.client_id, credential.client_secret)
+            if access_token:
+                credential.access_token = access_token
+                credential.expires_at = time.time() + expires_in
+            else:
+                logging.error('Failed to obtain access token for client ID: %s', credential.client_id)
+                credential.access_token = None
+                credential.expires_at = 0.0
+                credential.cooldown_until = time.time() + self.failure_cooldown
+            return credential.access_token
+
+    # Fetch tokens for every credential at once; True if at least one is usable
+    async def refresh_all(self):
+        tokens = await asyncio.gather(*(self.refresh(credential) for credential in self.credentials))
+        return any(tokens)
+
+    # Hand out the least-loaded healthy credential with a token that is not about to expire.
+    # Callers must release() it once their request is done. Raises SpotifyAuthError once the
+    # token of every credential failed to refresh refresh_attempts times.
+    async def acquire(self):
+        failures = {credential: 0 for credential in self.credentials}
+        while True:
+            candidates = [credential for credential in self.credentials
+                          if failures[credential] < self.refresh_attempts]
+            if not candidates:
+                raise SpotifyAuthError('Exhausted all attempts to obtain access token.')
+
+            now = time.time()
+            available = [credential for credential in candidates if credential.cooldown_until <= now]
+            if not available:
+                wait_time = min(credential.cooldown_until for credential in candidates) - now
+                logging.warning(f'All credentials are cooling down. Waiting for {wait_time:.3f} seconds.')
+                await asyncio.sleep(wait_time)
+                continue
+
+            credential = min(available, key=lambda credential: credential.load(self.throttle_window, now))
+            credential.in_flight += 1
+
+            # Refresh ahead of expiry instead of waiting for a 401
+            if credential.expires_at - now <= self.refresh_margin:
+                if not await self.refresh(credential):
+                    credential.in_flight -= 1
+                    failures[credential] += 1
+                    continue
+
+            credential.requests += 1
+            return credential
+
+    def release(self, credential):
+        credential.in_flight -= 1
+
+    # Take the credential out of rotation for `seconds`
+    def cool_down(self, credential, seconds):
+        credential.cooldown_until = max(credential.cooldown_until, time.time() + seconds)
+
+    # 429: out of rotation until Retry-After has passed, and ranked lower for a while after
+    def report_throttled(self, credential, retry_after):
+        credential.recent_throttles.append(time.time())
+        self.cool_down(credential, retry_after)
+        logging.warning('Client ID %s throttled; out of rotation for %.1f seconds.', credential.client_id, retry_after)
+
+    # 401: the cached token is no longer accepted, fetch a new one
+    async def report_unauthorized(self, credential, stale_token):
+        return await self.refresh(credential, stale_token=stale_token)
+
+    def log_stats(self):
+        for credential in self.credentials:
+            logging.info('Client ID %s: %s requests, %s recent 429s',
+                         credential.client_id, credential.requests, len(credential.recent_throttles))
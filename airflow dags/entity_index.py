@@ -0,0 +1,124 @@
+# Local index of entities already fetched from Spotify (audio features per track_id, artist
+# records per artist_id), so the daily tasks only request IDs they have not seen yet.
+# IDs Spotify answered with null (e.g. tracks without audio features) are stored as a null
+# record and not asked for again until NOT_FOUND_TTL has passed.
+import json
+import logging
+import math
+import os
+import sqlite3
+import time
+
+NOT_FOUND_TTL = 7 * 86400
+
+
+class EntityIndex:
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Mapped batch tasks write to the same index concurrently
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS entities (
+                kind TEXT NOT NULL,
+                entity_id TEXT NOT NULL,
+                record TEXT NOT NULL,
+                refreshed_at REAL NOT NULL,
+                PRIMARY KEY (kind, entity_id)
+            )
+        """)
+        self.connection.commit()
+
+    # Split `ids` into stored records and IDs to fetch. Records refreshed more than `ttl`
+    # seconds ago count as missing; ttl=None keeps them forever (e.g. audio features).
+    # IDs stored as not found map to None in `known` until `not_found_ttl` has passed.
+    def lookup(self, kind, ids, ttl=None, not_found_ttl=NOT_FOUND_TTL):
+        ids = list(dict.fromkeys(ids))
+        now = time.time()
+        oldest = now - ttl if ttl is not None else float('-inf')
+        oldest_not_found = now - not_found_ttl
+        known = {}
+
+        # Stay under SQLite's bound parameter limit
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            rows = self.connection.execute(
+                f"SELECT entity_id, record, refreshed_at FROM entities "
+                f"WHERE kind = ? AND entity_id IN ({','.join('?' * len(chunk))})",
+                [kind, *chunk]
+            ).fetchall()
+            for entity_id, record, refreshed_at in rows:
+                record = json.loads(record)
+                if refreshed_at >= (oldest if record is not None else oldest_not_found):
+                    known[entity_id] = record
+
+        missing = [entity_id for entity_id in ids if entity_id not in known]
+        return known, missing
+
+    # `answered_ids` are IDs of requests Spotify answered; those without a record are stored as not found
+    def store(self, kind, records, id_column, answered_ids=()):
+        now = time.time()
+        found = {record[id_column] for record in records}
+        not_found = [entity_id for entity_id in dict.fromkeys(answered_ids) if entity_id not in found]
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO entities (kind, entity_id, record, refreshed_at) VALUES (?, ?, ?, ?)',
+            [(kind, record[id_column], json.dumps(record), now) for record in records]
+            + [(kind, entity_id, json.dumps(None), now) for entity_id in not_found]
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def log_delta(label, total, hits, batch_size):
+    calls_needed = math.ceil(total / batch_size)
+    calls_made = math.ceil((total - hits) / batch_size)
+    hit_ratio = hits / total if total else 0.0
+    logging.info(f'{label}: {hits}/{total} from the entity index (hit ratio {hit_ratio:.1%}), '
+                 f'{calls_made} API calls instead of {calls_needed} ({calls_needed - calls_made} saved)')
+
+
+# Records for every ID in `ids` (in that order): known ones from the index, the rest via
+# `fetch_missing(missing_ids, answered_ids)`, whose results are written back to the index.
+# fetch_missing appends the IDs of the requests Spotify answered to `answered_ids`.
+# log_hits=False when plan_fetch already reported the hit ratio for these IDs.
+def fetch_with_index(index_path, kind, ids, id_column, fetch_missing, batch_size, ttl=None, log_hits=True,
+                     not_found_ttl=NOT_FOUND_TTL):
+    index = EntityIndex(index_path)
+    try:
+        known, missing = index.lookup(kind, ids, ttl=ttl, not_found_ttl=not_found_ttl)
+        if log_hits:
+            log_delta(kind, len(known) + len(missing), len(known), batch_size)
+        elif missing:
+            logging.warning(f'{kind}: {len(missing)} IDs not fetched by the mapped batches, fetching them now')
+
+        answered_ids = []
+        fetched = fetch_missing(missing, answered_ids) if missing else []
+        index.store(kind, fetched, id_column, answered_ids)
+    finally:
+        index.close()
+
+    records = {**known, **{record[id_column]: record for record in fetched}}
+    return [records[entity_id] for entity_id in dict.fromkeys(ids) if records.get(entity_id) is not None]
+
+
+# IDs still to fetch, split into chunks of `chunk_size` for mapped batch tasks
+def plan_fetch(index_path, kind, ids, chunk_size, batch_size, ttl=None, not_found_ttl=NOT_FOUND_TTL):
+    index = EntityIndex(index_path)
+    try:
+        known, missing = index.lookup(kind, ids, ttl=ttl, not_found_ttl=not_found_ttl)
+    finally:
+        index.close()
+
+    log_delta(kind, len(known) + len(missing), len(known), batch_size)
+    return [missing[start : start + chunk_size] for start in range(0, len(missing), chunk_size)]
+
+
+def store_entities(index_path, kind, records, id_column, answered_ids=()):
+    index = EntityIndex(index_path)
+    try:
+        index.store(kind, records, id_column, answered_ids)
+    finally:
+        index.close()
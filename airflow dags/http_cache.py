@@ -0,0 +1,165 @@
+# On-disk cache of Spotify Web API responses for endpoints whose data rarely or never changes,
+# so re-runs neither repeat those requests nor spend rate budget on them, e.g.
+#   python "airflow dags/http_cache.py" --path ./data/http_cache.sqlite
+# prints what the cache holds per endpoint.
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from collections import namedtuple
+
+# (path pattern, seconds a response is served without asking Spotify; None = forever).
+# Expired responses with an ETag are revalidated with If-None-Match, and a 304 renews them.
+# Endpoints not listed (e.g. /v1/artists, whose popularity changes) are never cached.
+CACHE_RULES = [
+    # Audio features of a track never change
+    (r'/v1/audio-features$', None),
+    # The Top 50 search finds the same playlist IDs every day
+    (r'/v1/search$', 7 * 86400),
+    # Playlist names; items change with every snapshot, so they are always revalidated
+    (r'/v1/playlists/[^/]+$', 86400),
+    (r'/v1/playlists/[^/]+/tracks$', 0),
+]
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag', 'fresh', 'size'])
+
+
+class HttpCache:
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, rules=None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.rules = [(re.compile(pattern), ttl) for pattern, ttl in (rules or CACHE_RULES)]
+        # Mapped tasks of one run read and write the same file concurrently
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                body TEXT NOT NULL,
+                etag TEXT,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self.connection.commit()
+        self.stats = dict.fromkeys(['hits', 'stale', 'revalidated', 'misses', 'stored', 'evicted', 'bytes_served'], 0)
+
+    # (endpoint pattern, ttl) of the first matching rule, or None when the URL is not cached
+    def rule(self, url):
+        for pattern, ttl in self.rules:
+            if pattern.search(url.split('?', 1)[0]):
+                return pattern.pattern, ttl
+        return None
+
+    @staticmethod
+    def key(url, params):
+        return f'{url}?{json.dumps(params or {}, sort_keys=True)}'
+
+    def get(self, url, params=None):
+        row = self.connection.execute(
+            'SELECT body, etag, expires_at, size FROM responses WHERE key = ?', (self.key(url, params),)
+        ).fetchone()
+        if row is None:
+            self.stats['misses'] += 1
+            return None
+
+        body, etag, expires_at, size = row
+        fresh = expires_at is None or expires_at > time.time()
+        if fresh:
+            self.stats['hits'] += 1
+            self.served(url, params, size)
+        elif etag is None:
+            self.stats['misses'] += 1
+            return None
+        else:
+            self.stats['stale'] += 1
+        return CachedResponse(json.loads(body), etag, fresh, size)
+
+    def put(self, url, params, body, etag, ttl):
+        # Always-revalidated endpoints are of no use without an ETag to revalidate with
+        if ttl == 0 and etag is None:
+            return
+        now = time.time()
+        self.connection.execute(
+            'INSERT OR REPLACE INTO responses (key, endpoint, body, etag, size, expires_at, accessed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (self.key(url, params), self.rule(url)[0], body, etag, len(body.encode()),
+             now + ttl if ttl is not None else None, now)
+        )
+        self.stats['stored'] += 1
+        self.evict()
+        self.connection.commit()
+
+    # Spotify answered 304 Not Modified: the stored body is good for another ttl
+    def revalidated(self, url, params, cached, ttl):
+        now = time.time()
+        self.connection.execute(
+            'UPDATE responses SET expires_at = ? WHERE key = ?',
+            (now + ttl if ttl is not None else None, self.key(url, params))
+        )
+        self.stats['revalidated'] += 1
+        self.served(url, params, cached.size)
+
+    def served(self, url, params, size):
+        self.connection.execute(
+            'UPDATE responses SET accessed_at = ?, hits = hits + 1 WHERE key = ?',
+            (time.time(), self.key(url, params))
+        )
+        self.connection.commit()
+        self.stats['bytes_served'] += size
+
+    # Least recently used responses go first until the cache fits in max_bytes
+    def evict(self):
+        evicted = self.connection.execute("""
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC, key) AS kept FROM responses
+                ) WHERE kept > ?
+            )
+        """, (self.max_bytes,)).rowcount
+        self.stats['evicted'] += evicted
+
+    def log_stats(self):
+        stats = self.stats
+        lookups = stats['hits'] + stats['stale'] + stats['misses']
+        hit_ratio = stats['hits'] / lookups if lookups else 0.0
+        logging.info(f"HTTP cache: {stats['hits']}/{lookups} responses served without a request (hit ratio "
+                     f"{hit_ratio:.1%}), {stats['revalidated']}/{stats['stale']} expired ones still current "
+                     f"(304), {stats['bytes_served'] / 1024:.0f} KiB not downloaded, {stats['stored']} stored, "
+                     f"{stats['evicted']} evicted")
+
+    # Entries, size, hits and expired entries per endpoint rule
+    def summary(self):
+        return self.connection.execute("""
+            SELECT endpoint, COUNT(*), SUM(size), SUM(hits), SUM(expires_at IS NOT NULL AND expires_at <= ?)
+            FROM responses GROUP BY endpoint ORDER BY SUM(size) DESC
+        """, (time.time(),)).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show what the Spotify HTTP response cache holds.')
+    parser.add_argument('--path', default=os.environ.get('HTTP_CACHE_PATH', './data/http_cache.sqlite'))
+    parser.add_argument('--clear', action='store_true', help='delete every cached response')
+    args = parser.parse_args()
+
+    cache = HttpCache(args.path)
+    try:
+        if args.clear:
+            cache.connection.execute('DELETE FROM responses')
+            cache.connection.commit()
+        print(f"{'endpoint':<32} {'entries':>8} {'KiB':>10} {'hits':>8} {'expired':>8}")
+        for endpoint, entries, size, hits, expired in cache.summary():
+            print(f'{endpoint:<32} {entries:>8} {size / 1024:>10.1f} {hits:>8} {expired:>8}')
+    finally:
+        cache.close()
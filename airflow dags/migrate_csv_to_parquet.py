@@ -0,0 +1,71 @@
+# One-time migration of the CSV files under data/ and data/old/ into the partitioned Parquet layout.
+#   python "airflow dags/migrate_csv_to_parquet.py" --csv-dir ./data --data-dir ./data
+import argparse
+import ast
+import logging
+import os
+
+import pandas as pd
+
+from storage import DATASETS, write_partitions
+
+# (csv file relative to --csv-dir, dataset). Old crawls go first so current files win on duplicates.
+MIGRATIONS = [
+    ('old/playlist.csv', 'playlists'),
+    ('old/artists.csv', 'artists'),
+    ('old/full_tracks.csv', 'tracks_audio_feature'),
+    ('old/stream_tracks.csv', 'legacy_stream_tracks'),
+    ('old/clean_data.csv', 'legacy_clean_data'),
+    ('playlists.csv', 'playlists'),
+    ('tracks.csv', 'tracks'),
+    ('artists.csv', 'artists'),
+    ('tracks_audio_feature.csv', 'tracks_audio_feature'),
+    ('tracks_stream.csv', 'tracks_stream'),
+]
+
+
+def parse_genres(value):
+    if isinstance(value, str) and value.startswith('['):
+        return ast.literal_eval(value)
+    return []
+
+
+def prepare(df, dataset, default_date):
+    # Old crawls called the crawl date 'timestamp'
+    if 'timestamp' in df.columns:
+        df = df.rename(columns={'timestamp': 'date'})
+    # Files rewritten in place (playlists, artists) never carried a crawl date
+    if 'date' not in df.columns and 'date' in DATASETS[dataset]['partition_cols']:
+        df['date'] = default_date
+    if 'artist_genres' in df.columns:
+        df['artist_genres'] = df['artist_genres'].map(parse_genres)
+    return df
+
+
+def migrate(csv_dir, data_dir, default_date=None):
+    if default_date is None:
+        tracks_path = os.path.join(csv_dir, 'tracks.csv')
+        default_date = pd.read_csv(tracks_path, usecols=['date'])['date'].min() \
+            if os.path.exists(tracks_path) else pd.Timestamp.utcnow().strftime('%Y-%m-%d')
+
+    for file_name, dataset in MIGRATIONS:
+        path = os.path.join(csv_dir, file_name)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            logging.info('Skipping missing %s', path)
+            continue
+
+        df = prepare(pd.read_csv(path), dataset, default_date)
+        written = write_partitions(df, dataset, data_dir=data_dir)
+        logging.info('Migrated %s (%s rows) into %s partitions of %s', path, len(df), len(written), dataset)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrate the crawled CSV files to partitioned Parquet.')
+    parser.add_argument('--csv-dir', default='./data')
+    parser.add_argument('--data-dir', default='./data')
+    parser.add_argument('--default-date', default=None,
+                        help='crawl date for files without one (default: first date in tracks.csv)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    migrate(args.csv_dir, args.data_dir, args.default_date)
@@ -0,0 +1,147 @@
+# Bulk loader shared by every save_*_to_postgres function: pooled connections and
+# COPY into a staging table followed by one INSERT ... SELECT ... ON CONFLICT per table
+import csv
+import io
+import logging
+import time
+from contextlib import contextmanager
+
+from psycopg2 import errors, pool, sql
+from psycopg2.extras import execute_values
+
+from telemetry import stage
+
+connection_pools = {}
+
+
+class LoadResult:
+    def __init__(self, table, rows, inserted, seconds, method):
+        self.table = table
+        self.rows = rows
+        self.inserted = inserted
+        self.skipped = rows - inserted
+        self.seconds = seconds
+        self.method = method
+
+    def __repr__(self):
+        return (f'LoadResult(table={self.table!r}, rows={self.rows}, inserted={self.inserted}, '
+                f'skipped={self.skipped}, seconds={self.seconds:.3f}, method={self.method!r})')
+
+
+def get_pool(connection_params, minconn=1, maxconn=4):
+    key = tuple(sorted(connection_params.items()))
+    if key not in connection_pools:
+        connection_pools[key] = pool.ThreadedConnectionPool(minconn, maxconn, **connection_params)
+    return connection_pools[key]
+
+
+@contextmanager
+def pooled_connection(connection_params):
+    connection_pool = get_pool(connection_params)
+    connection = connection_pool.getconn()
+    try:
+        yield connection
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        connection_pool.putconn(connection)
+
+
+# COPY text for one value: lists become Postgres array literals, None becomes \N
+def copy_value(value):
+    if value is None:
+        return r'\N'
+    if isinstance(value, (list, tuple)):
+        items = ('"' + str(item).replace('\\', '\\\\').replace('"', '\\"') + '"' for item in value)
+        return '{' + ','.join(items) + '}'
+    return value
+
+
+def copy_rows(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([copy_value(value) for value in row])
+    buffer.seek(0)
+
+    cursor.copy_expert(
+        sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')").format(
+            sql.Identifier(table), sql.SQL(', ').join(map(sql.Identifier, columns))
+        ),
+        buffer
+    )
+
+
+def insert_from_staging(cursor, table, staging_table, columns, conflict_columns):
+    column_list = sql.SQL(', ').join(map(sql.Identifier, columns))
+    cursor.execute(
+        sql.SQL('INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT ({}) DO NOTHING').format(
+            sql.Identifier(table), column_list, column_list, sql.Identifier(staging_table),
+            sql.SQL(', ').join(map(sql.Identifier, conflict_columns))
+        )
+    )
+    return cursor.rowcount
+
+
+def insert_values(cursor, table, columns, rows, conflict_columns, page_size=1000):
+    query = sql.SQL('INSERT INTO {} ({}) VALUES %s ON CONFLICT ({}) DO NOTHING RETURNING 1').format(
+        sql.Identifier(table),
+        sql.SQL(', ').join(map(sql.Identifier, columns)),
+        sql.SQL(', ').join(map(sql.Identifier, conflict_columns))
+    )
+    inserted = execute_values(cursor, query.as_string(cursor), rows, page_size=page_size, fetch=True)
+    return len(inserted)
+
+
+# Insert `rows` (tuples in `columns` order) into `table`, skipping rows that hit `conflict_columns`.
+# method='copy' goes through a temporary staging table and falls back to execute_values when COPY
+# is not available. Errors propagate to the caller.
+def upsert_rows(connection_params, table, columns, rows, conflict_columns, method='copy'):
+    rows = list(rows)
+    started = time.perf_counter()
+
+    if not rows:
+        return LoadResult(table, 0, 0, 0.0, 'none')
+
+    with stage('postgres'), pooled_connection(connection_params) as connection:
+        with connection.cursor() as cursor:
+            if method == 'copy':
+                staging_table = f'{table}_staging'
+                try:
+                    cursor.execute('SAVEPOINT bulk_copy')
+                    cursor.execute(
+                        sql.SQL('CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP').format(
+                            sql.Identifier(staging_table), sql.Identifier(table)
+                        )
+                    )
+                    copy_rows(cursor, staging_table, columns, rows)
+                    inserted = insert_from_staging(cursor, table, staging_table, columns, conflict_columns)
+                    cursor.execute('RELEASE SAVEPOINT bulk_copy')
+                except (errors.FeatureNotSupported, errors.InsufficientPrivilege) as e:
+                    logging.warning('COPY into %s unavailable (%s); falling back to execute_values.', table, e)
+                    cursor.execute('ROLLBACK TO SAVEPOINT bulk_copy')
+                    method = 'execute_values'
+
+            if method == 'execute_values':
+                inserted = insert_values(cursor, table, columns, rows, conflict_columns)
+
+    result = LoadResult(table, len(rows), inserted, time.perf_counter() - started, method)
+    logging.info('Saved %s: %s rows, %s inserted, %s skipped in %.3f seconds (%s).',
+                 table, result.rows, result.inserted, result.skipped, result.seconds, result.method)
+    return result
+
+
+def upsert_records(connection_params, table, columns, records, conflict_columns):
+    return upsert_rows(
+        connection_params, table, columns,
+        (tuple(record[column] for column in columns) for record in records),
+        conflict_columns
+    )
+
+
+def close_pools():
+    for connection_pool in connection_pools.values():
+        connection_pool.closeall()
+    connection_pools.clear()
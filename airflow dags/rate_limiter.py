@@ -0,0 +1,239 @@
+# Token-bucket rate limiting shared across credentials, worker processes and hosts
+import asyncio
+import email.utils
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+class RateLimitWait(Exception):
+    def __init__(self, key, wait_time):
+        super().__init__(f'{key} is rate limited for {wait_time:.3f} more seconds')
+        self.key = key
+        self.wait_time = wait_time
+
+
+# Refill the bucket for the time elapsed and try to take one token.
+# Returns the new state and how long the caller has to wait (0 when a token was taken).
+def take_token(tokens, updated, blocked_until, capacity, refill_rate, now):
+    if now < blocked_until:
+        return tokens, updated, blocked_until - now
+
+    tokens = min(capacity, tokens + (now - updated) * refill_rate)
+    if tokens >= 1:
+        return tokens - 1, now, 0.0
+    return tokens, now, (1 - tokens) / refill_rate
+
+
+# Retry-After is either a number of seconds or an HTTP date
+def parse_retry_after(value, default=60):
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+# Single process: buckets live in a dict
+class MemoryStore:
+    blocking = False
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, refill_rate):
+        with self.lock:
+            now = time.time()
+            tokens, updated, blocked_until = self.buckets.get(key, (capacity, now, 0.0))
+            tokens, updated, wait_time = take_token(tokens, updated, blocked_until, capacity, refill_rate, now)
+            self.buckets[key] = (tokens, updated, blocked_until)
+            return wait_time
+
+    def block(self, key, seconds):
+        with self.lock:
+            now = time.time()
+            tokens, updated, blocked_until = self.buckets.get(key, (0.0, now, 0.0))
+            self.buckets[key] = (0.0, now, max(blocked_until, now + seconds))
+
+
+# Several processes on one host: buckets live in a SQLite file, BEGIN IMMEDIATE serialises updates
+class SQLiteStore:
+    blocking = True
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection().execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                blocked_until REAL NOT NULL
+            )
+        """)
+
+    def connection(self):
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return self.local.connection
+
+    def update(self, key, default, change):
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = connection.execute(
+                'SELECT tokens, updated, blocked_until FROM buckets WHERE key = ?', (key,)
+            ).fetchone()
+            state, result = change(row or default(now), now)
+            connection.execute(
+                'INSERT OR REPLACE INTO buckets (key, tokens, updated, blocked_until) VALUES (?, ?, ?, ?)',
+                (key, *state)
+            )
+            connection.execute('COMMIT')
+            return result
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def take(self, key, capacity, refill_rate):
+        def change(row, now):
+            tokens, updated, blocked_until = row
+            tokens, updated, wait_time = take_token(tokens, updated, blocked_until, capacity, refill_rate, now)
+            return (tokens, updated, blocked_until), wait_time
+
+        return self.update(key, lambda now: (capacity, now, 0.0), change)
+
+    def block(self, key, seconds):
+        def change(row, now):
+            return (0.0, now, max(row[2], now + seconds)), None
+
+        self.update(key, lambda now: (0.0, now, 0.0), change)
+
+
+# Several hosts: the bucket update runs atomically inside Redis, on the Redis clock
+class RedisStore:
+    blocking = True
+
+    TAKE_SCRIPT = """
+    local now_parts = redis.call('TIME')
+    local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+    local capacity = tonumber(ARGV[1])
+    local refill_rate = tonumber(ARGV[2])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated', 'blocked_until')
+    local tokens = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    local blocked_until = tonumber(state[3]) or 0
+    local wait_time = 0
+    if now < blocked_until then
+        wait_time = blocked_until - now
+    else
+        tokens = math.min(capacity, tokens + (now - updated) * refill_rate)
+        updated = now
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait_time = (1 - tokens) / refill_rate
+        end
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', updated, 'blocked_until', blocked_until)
+    redis.call('EXPIRE', KEYS[1], 86400)
+    return tostring(wait_time)
+    """
+
+    BLOCK_SCRIPT = """
+    local now_parts = redis.call('TIME')
+    local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+    local blocked_until = tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0
+    blocked_until = math.max(blocked_until, now + tonumber(ARGV[1]))
+    redis.call('HSET', KEYS[1], 'tokens', 0, 'updated', now, 'blocked_until', blocked_until)
+    redis.call('EXPIRE', KEYS[1], 86400)
+    return 1
+    """
+
+    def __init__(self, url, prefix='spotify:ratelimit:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.take_script = self.client.register_script(self.TAKE_SCRIPT)
+        self.block_script = self.client.register_script(self.BLOCK_SCRIPT)
+
+    def take(self, key, capacity, refill_rate):
+        return float(self.take_script(keys=[self.prefix + key], args=[capacity, refill_rate]))
+
+    def block(self, key, seconds):
+        self.block_script(keys=[self.prefix + key], args=[seconds])
+
+
+# memory://, sqlite:///path/to/file.sqlite or redis://host:port/db
+def create_store(url):
+    if url.startswith('memory://'):
+        return MemoryStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore(url)
+    raise ValueError(f'Unsupported rate limit store: {url}')
+
+
+# At most `rate_limit` requests per `time_window` seconds for every key (one key per credential)
+class TokenBucketLimiter:
+    def __init__(self, store=None, time_window=30, rate_limit=60):
+        self.store = store or MemoryStore()
+        self.capacity = rate_limit
+        self.refill_rate = rate_limit / time_window
+
+    async def call(self, function, *args):
+        if self.store.blocking:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    # Wait (without blocking the event loop) until a token for `key` is available.
+    # Returns the total time spent waiting; raises RateLimitWait instead when a single wait
+    # would be longer than max_wait, so the caller can move on to another key.
+    async def acquire(self, key='default', max_wait=None):
+        waited = 0.0
+        while True:
+            wait_time = await self.call(self.store.take, key, self.capacity, self.refill_rate)
+            if wait_time <= 0:
+                return waited
+            if max_wait is not None and wait_time > max_wait:
+                raise RateLimitWait(key, wait_time)
+            if waited == 0:
+                logging.info(f'Rate limit reached for {key}. Waiting for {wait_time:.3f} seconds.')
+            await asyncio.sleep(wait_time)
+            waited += wait_time
+
+    # Synchronous acquire for callers that are not running an event loop
+    def acquire_blocking(self, key='default'):
+        waited = 0.0
+        while True:
+            wait_time = self.store.take(key, self.capacity, self.refill_rate)
+            if wait_time <= 0:
+                return waited
+            if waited == 0:
+                logging.info(f'Rate limit reached for {key}. Waiting for {wait_time:.3f} seconds.')
+            time.sleep(wait_time)
+            waited += wait_time
+
+    # Empty the bucket and hold it closed for `seconds` (e.g. the Retry-After of a 429), for every worker
+    async def penalize(self, key, seconds):
+        logging.warning(f'Holding requests for {key} for {seconds:.1f} seconds.')
+        await self.call(self.store.block, key, seconds)
+
+
+def create_limiter(url=None, time_window=30, rate_limit=60):
+    url = url or os.environ.get('SPOTIFY_RATE_LIMIT_STORE', 'memory://')
+    return TokenBucketLimiter(create_store(url), time_window=time_window, rate_limit=rate_limit)
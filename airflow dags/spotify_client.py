@@ -0,0 +1,170 @@
+# Async Spotify Web API client shared by every fetch_* task of the crawling DAG
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+
+import aiohttp
+
+from credential_pool import CredentialPool, SpotifyAuthError
+from rate_limiter import RateLimitWait, TokenBucketLimiter, parse_retry_after
+from telemetry import record_request, record_retry, record_wait
+
+# Endpoints can be pointed at a local stub server (see benchmarks/stub_server.py)
+API_BASE_URL = os.environ.get('SPOTIFY_API_URL', 'https://api.spotify.com')
+TOKEN_URL = os.environ.get('SPOTIFY_TOKEN_URL', 'https://accounts.spotify.com/api/token')
+
+
+class SpotifyClient:
+    def __init__(self, credentials, max_concurrency=None, retry_attempts=3, timeout=15,
+                 limiter=None, throttle_penalty=60, max_bucket_wait=5, cache=None):
+        # Every credential brings its own rate budget, so allow a few requests in flight per credential
+        self.max_concurrency = max_concurrency or 4 * len(credentials)
+        self.retry_attempts = retry_attempts
+        self.timeout = timeout
+        self.limiter = limiter or TokenBucketLimiter()
+        self.throttle_penalty = throttle_penalty
+        self.max_bucket_wait = max_bucket_wait
+        # Optional http_cache.HttpCache; fresh cached responses skip the rate limiter entirely
+        self.cache = cache
+        self.pool = CredentialPool(credentials, self.request_access_token, failure_cooldown=throttle_penalty,
+                                   refresh_attempts=retry_attempts)
+        self.session = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        # One keep-alive connection pool for the whole task instead of a handshake per request
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        try:
+            await self.open()
+        except BaseException:
+            await self.session.close()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.pool.log_stats()
+        if self.cache is not None:
+            self.cache.log_stats()
+        await self.session.close()
+
+    async def open(self):
+        for attempt in range(self.retry_attempts):
+            if await self.pool.refresh_all():
+                return
+
+            logging.error(f'Failed to obtain access token on attempt {attempt + 1}/{self.retry_attempts}.')
+            if attempt < self.retry_attempts - 1:
+                await asyncio.sleep(self.throttle_penalty)
+
+        raise SpotifyAuthError('Exhausted all attempts to obtain access token.')
+
+    async def request_access_token(self, client_id, client_secret):
+        auth_string = f'{client_id}:{client_secret}'
+        auth_encoded = base64.b64encode(auth_string.encode()).decode()
+
+        try:
+            async with self.session.post(
+                TOKEN_URL,
+                headers={
+                    'Authorization': f'Basic {auth_encoded}',
+                    'Content-Type': 'application/x-www-form-urlencoded'
+                },
+                data={'grant_type': 'client_credentials'}
+            ) as response:
+                if response.status == 200:
+                    token = await response.json(content_type=None)
+                    return token.get('access_token'), token.get('expires_in', 3600)
+                return None, 0
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error('Network error occurred while requesting access token: %s', e)
+            return None, 0
+
+    # Least-loaded credential whose rate bucket has a token. A credential whose bucket stays
+    # closed for longer than max_bucket_wait (e.g. another worker got a 429 on it) is benched
+    # for that long and the next one is tried.
+    async def acquire_credential(self):
+        started = time.perf_counter()
+        while True:
+            credential = await self.pool.acquire()
+            max_wait = self.max_bucket_wait if len(self.pool) > 1 else None
+            try:
+                await self.limiter.acquire(credential.client_id, max_wait=max_wait)
+                record_wait(credential.client_id, time.perf_counter() - started)
+                return credential
+            except RateLimitWait as e:
+                self.pool.cool_down(credential, e.wait_time)
+                self.pool.release(credential)
+
+    # GET a Spotify endpoint and return the decoded JSON body, or None once retries are exhausted.
+    # 401 refreshes the token and 429 benches the credential, for every endpoint in one place.
+    async def get(self, url, params=None):
+        if not url.startswith('http'):
+            url = f'{API_BASE_URL}{url}'
+
+        rule = self.cache.rule(url) if self.cache is not None else None
+        cached = self.cache.get(url, params) if rule is not None else None
+        if cached is not None and cached.fresh:
+            record_request(url, 'cache', size=0)
+            return cached.body
+
+        for attempt in range(self.retry_attempts):
+            async with self.semaphore:
+                # Every credential has its own bucket, shared with the other workers using it
+                credential = await self.acquire_credential()
+                access_token = credential.access_token
+                headers = {'Authorization': f'Bearer {access_token}'}
+                if cached is not None:
+                    headers['If-None-Match'] = cached.etag
+                started = time.perf_counter()
+                try:
+                    async with self.session.get(url, params=params, headers=headers) as response:
+                        status = response.status
+                        body = await response.read()
+                        record_request(url, status, time.perf_counter() - started, len(body))
+                        if status == 304 and cached is not None:
+                            self.cache.revalidated(url, params, cached, rule[1])
+                            return cached.body
+                        if status == 200:
+                            if rule is not None:
+                                self.cache.put(url, params, body.decode(), response.headers.get('ETag'), rule[1])
+                            return json.loads(body)
+                        text = body.decode(errors='replace')
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'), self.throttle_penalty)
+
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logging.error('Network error occurred: %s', e)
+                    record_request(url, 'error', time.perf_counter() - started)
+                    record_retry(url, 'error')
+                    continue
+
+                finally:
+                    self.pool.release(credential)
+
+            if status in (401, 429):
+                record_retry(url, status)
+
+            if status == 401:  # Access token expired
+                logging.warning(f'Attempt {attempt + 1}/{self.retry_attempts}: Access token expired. Refreshing...')
+                await self.pool.report_unauthorized(credential, access_token)
+
+            elif status == 429:  # Too many requests
+                logging.warning(f'Attempt {attempt + 1}/{self.retry_attempts}: Rate limit exceeded for client ID {credential.client_id}.')
+                # Bench only this credential; the others keep serving requests
+                self.pool.report_throttled(credential, retry_after)
+                await self.limiter.penalize(credential.client_id, retry_after)
+
+            else:
+                logging.error('Error requesting %s: %s, %s\n', url, status, text)
+                break
+
+        logging.error('Failed to fetch %s after multiple attempts.', url)
+        return None
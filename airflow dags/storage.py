@@ -0,0 +1,154 @@
+# Partitioned Parquet storage for the crawled datasets.
+# Layout: <data_dir>/<dataset>/date=YYYY-MM-DD[/country=<name>]/part-0.parquet
+import os
+import uuid
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from telemetry import stage
+
+DATA_DIR = os.environ.get('SPOTIFY_DATA_DIR', './data')
+PART_FILE = 'part-0.parquet'
+
+# partition_cols: directory levels; keys: columns identifying a row inside one partition.
+# The datasets stay in the wide layout of the Postgres tables; `spotify-analysis star-schema`
+# normalizes them into registry-keyed dimensions and narrow facts for analysis.
+DATASETS = {
+    'playlists': {'partition_cols': ['date'], 'keys': ['playlist_id']},
+    'tracks': {'partition_cols': ['date', 'country'], 'keys': ['track_id']},
+    'artists': {'partition_cols': ['date'], 'keys': ['artist_id']},
+    'tracks_audio_feature': {'partition_cols': ['date', 'country'], 'keys': ['track_id']},
+    'tracks_stream': {'partition_cols': ['date'], 'keys': ['track_id']},
+    # Pre-2024-11-04 crawls kept by the CSV migration
+    'legacy_stream_tracks': {'partition_cols': ['date', 'country'], 'keys': ['track_id']},
+    'legacy_clean_data': {'partition_cols': ['country'], 'keys': None},
+}
+
+# Consistent column types across partitions, whatever pandas inferred for one day's frame
+INT_COLUMNS = [
+    'track_duration_ms', 'track_popularity', 'track_position', 'artist_popularity', 'artist_follower',
+    'key', 'mode', 'duration_ms', 'time_signature', 'stream_daily', 'stream_total', 'stream_count'
+]
+FLOAT_COLUMNS = [
+    'danceability', 'energy', 'loudness', 'speechiness', 'acousticness', 'instrumentalness',
+    'liveness', 'valence', 'tempo'
+]
+
+
+def dataset_dir(name, data_dir=None):
+    return os.path.join(data_dir or DATA_DIR, name)
+
+
+def partition_dir(name, values, data_dir=None):
+    parts = [f'{column}={quote(str(value), safe="")}' for column, value in values.items()]
+    return os.path.join(dataset_dir(name, data_dir), *parts)
+
+
+def normalize_types(df):
+    df = df.copy()
+    for column in df.columns.intersection(INT_COLUMNS):
+        df[column] = pd.to_numeric(df[column], errors='coerce').astype('Int64')
+    for column in df.columns.intersection(FLOAT_COLUMNS):
+        df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+    return df
+
+
+# Write to a hidden temp file next to the target and rename it into place, so readers and
+# retries never see a half-written partition (dot-prefixed files are ignored by readers)
+def atomic_write(df, file_path):
+    directory = os.path.dirname(file_path)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f'.{uuid.uuid4().hex}.tmp')
+    try:
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# Write only the partitions present in `df`. Rows already stored in a touched partition are
+# kept unless `df` has a row with the same keys, so re-running a day is idempotent.
+def write_partitions(df, name, data_dir=None):
+    spec = DATASETS[name]
+    partition_cols = spec['partition_cols']
+    df = normalize_types(df)
+    written = []
+
+    with stage('parquet'):
+        for values, partition_df in df.groupby(partition_cols, sort=False):
+            values = values if isinstance(values, tuple) else (values,)
+            file_path = os.path.join(partition_dir(name, dict(zip(partition_cols, values)), data_dir), PART_FILE)
+            partition_df = partition_df.drop(columns=partition_cols)
+
+            if spec['keys'] and os.path.exists(file_path):
+                existing_df = pq.read_table(file_path).to_pandas()
+                partition_df = pd.concat([existing_df, partition_df], ignore_index=True)
+                partition_df = partition_df.drop_duplicates(subset=spec['keys'], keep='last')
+
+            atomic_write(partition_df, file_path)
+            written.append(file_path)
+
+    return written
+
+
+def filter_expression(filters):
+    if not filters:
+        return None
+
+    operators = {
+        '=': lambda field, value: field == value,
+        '==': lambda field, value: field == value,
+        '!=': lambda field, value: field != value,
+        '<': lambda field, value: field < value,
+        '<=': lambda field, value: field <= value,
+        '>': lambda field, value: field > value,
+        '>=': lambda field, value: field >= value,
+        'in': lambda field, value: field.isin(list(value)),
+    }
+    expression = None
+    for column, op, value in filters:
+        condition = operators[op](ds.field(column), value)
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def open_dataset(name, data_dir=None):
+    partitioning = ds.partitioning(
+        pa.schema([(column, pa.string()) for column in DATASETS[name]['partition_cols']]),
+        flavor='hive'
+    )
+    return ds.dataset(dataset_dir(name, data_dir), format='parquet', partitioning=partitioning)
+
+
+# Read a dataset with column pruning and predicate pushdown, e.g.
+#   read_dataset('tracks', columns=['track_id', 'country'], filters=[('date', '=', '2024-11-06')])
+# Partition filters skip whole directories; other filters are pushed into the Parquet scan.
+def read_dataset(name, columns=None, filters=None, data_dir=None):
+    if not os.path.isdir(dataset_dir(name, data_dir)):
+        return pd.DataFrame(columns=columns or [])
+    with stage('parquet'):
+        table = open_dataset(name, data_dir).to_table(columns=columns, filter=filter_expression(filters))
+        return table.to_pandas()
+
+
+# Most recent row per key across all partitions (e.g. the current record of every artist)
+def read_latest(name, key, columns=None, filters=None, data_dir=None):
+    if columns is not None and 'date' not in columns:
+        columns = [*columns, 'date']
+    df = read_dataset(name, columns=columns, filters=filters, data_dir=data_dir)
+    return df.sort_values('date').drop_duplicates(subset=key, keep='last').reset_index(drop=True)
+
+
+def partition_values(name, column, data_dir=None):
+    root = dataset_dir(name, data_dir)
+    if not os.path.isdir(root):
+        return []
+    return sorted({
+        ds.get_partition_keys(fragment.partition_expression)[column]
+        for fragment in open_dataset(name, data_dir).get_fragments()
+    })
@@ -0,0 +1,244 @@
+# Concurrent mystreamcount crawler with a persistent (track_id, date) stream cache
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from datetime import date, timedelta
+
+import aiohttp
+
+from rate_limiter import TokenBucketLimiter, parse_retry_after
+from telemetry import record_request, record_retry, record_wait, stage
+
+MYSTREAMCOUNT_URL = os.environ.get('MYSTREAMCOUNT_URL', 'https://www.mystreamcount.com')
+
+
+# Every (track_id, date) stream value ever downloaded. The endpoint returns a track's full
+# history, so one fetch fills all older dates too and those are never requested again.
+class StreamCache:
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS streams (
+                track_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                stream_daily INTEGER,
+                stream_total INTEGER,
+                PRIMARY KEY (track_id, date)
+            )
+        """)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS fetched (track_id TEXT PRIMARY KEY, fetched_on TEXT NOT NULL)'
+        )
+        self.connection.commit()
+
+    def get(self, track_id, start_date, end_date):
+        rows = self.connection.execute(
+            'SELECT date, stream_daily, stream_total FROM streams '
+            'WHERE track_id = ? AND date BETWEEN ? AND ? ORDER BY date',
+            (track_id, start_date.isoformat(), end_date.isoformat())
+        ).fetchall()
+        return [
+            {'track_id': track_id, 'date': date_str, 'stream_daily': daily, 'stream_total': total}
+            for date_str, daily, total in rows
+        ]
+
+    # A window is served from the cache when every date is stored, or when the history was
+    # downloaded after the window ended (dates still missing then have no data at all)
+    def covers(self, track_id, start_date, end_date):
+        count, = self.connection.execute(
+            'SELECT COUNT(*) FROM streams WHERE track_id = ? AND date BETWEEN ? AND ?',
+            (track_id, start_date.isoformat(), end_date.isoformat())
+        ).fetchone()
+        if count == (end_date - start_date).days + 1:
+            return True
+        row = self.connection.execute(
+            'SELECT fetched_on FROM fetched WHERE track_id = ?', (track_id,)
+        ).fetchone()
+        return row is not None and row[0] > end_date.isoformat()
+
+    # `history` is the endpoint's {date: {'daily': ..., 'total': ...}} mapping
+    def put_history(self, track_id, history):
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO streams (track_id, date, stream_daily, stream_total) VALUES (?, ?, ?, ?)',
+            [
+                (track_id, date_str, stream_info.get('daily') or 0, stream_info.get('total') or 0)
+                for date_str, stream_info in history.items() if stream_info
+            ]
+        )
+        self.connection.execute(
+            'INSERT OR REPLACE INTO fetched (track_id, fetched_on) VALUES (?, ?)',
+            (track_id, date.today().isoformat())
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+# Stream dates crawled for a track charting on `chart_date`: the week starting at its release
+# when that is closer to chart_date than a week before it, otherwise the week before chart_date.
+# None for tracks released after chart_date.
+def stream_window(release_date, chart_date):
+    limit_date = chart_date - timedelta(days=7)
+    nearer_date = min(release_date, limit_date, key=lambda d: abs(chart_date - d))
+    if nearer_date > chart_date:
+        return None
+    return nearer_date, nearer_date + timedelta(days=6)
+
+
+class StreamJob:
+    def __init__(self, track_id, start_date, end_date):
+        self.track_id = track_id
+        self.start_date = start_date
+        self.end_date = end_date
+        self.attempt = 0
+
+
+class StreamCrawler:
+    def __init__(self, cache, limiter=None, concurrency=4, retry_attempts=3, processing_delay=30,
+                 timeout=30, refresh=False, on_complete=None):
+        self.cache = cache
+        # refresh=True downloads every job again even when the cache covers its window
+        self.refresh = refresh
+        # Called with (job, rows) as soon as each downloaded job finishes, e.g. to checkpoint it
+        self.on_complete = on_complete
+        # mystreamcount allows about 20 requests per minute
+        self.limiter = limiter or TokenBucketLimiter(time_window=60, rate_limit=20)
+        self.concurrency = concurrency
+        self.retry_attempts = retry_attempts
+        self.processing_delay = processing_delay
+        self.timeout = timeout
+        self.stats = {'cached': 0, 'requests': 0, 'requeued': 0, 'failed': 0}
+
+    @staticmethod
+    def url(job):
+        return f'{MYSTREAMCOUNT_URL}/api/track/{job.track_id}/streams'
+
+    # One request for a track's full history; returns 'done' or 'retry'
+    async def fetch(self, session, job):
+        url = self.url(job)
+        record_wait('mystreamcount', await self.limiter.acquire('mystreamcount'))
+        self.stats['requests'] += 1
+
+        started = time.perf_counter()
+        try:
+            async with session.get(url) as response:
+                body = await response.read()
+                record_request(url, response.status, time.perf_counter() - started, len(body))
+                if response.status == 429:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'), self.processing_delay)
+                    await self.limiter.penalize('mystreamcount', retry_after)
+                    return 'retry'
+                if response.status != 200:
+                    logging.error('Error fetching stream data: %s, %s', response.status, body.decode(errors='replace'))
+                    return 'retry'
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error('Request failed: %s', e)
+            record_request(url, 'error', time.perf_counter() - started)
+            return 'retry'
+
+        # A 200 can still carry an error page or a payload of another shape
+        try:
+            json_response = json.loads(body)
+            if json_response.get('error') or json_response.get('status') == 'processing':
+                logging.warning(f"Attempt {job.attempt + 1}/{self.retry_attempts}: Status is 'processing' for track_id: {job.track_id}. Re-queued.")
+                return 'retry'
+
+            history = json_response.get('data', {})
+            if not history:
+                logging.warning('No stream data available for track_id: %s', job.track_id)
+            self.cache.put_history(job.track_id, history)
+        except (ValueError, AttributeError) as e:
+            logging.error('Malformed stream data for track_id %s: %s', job.track_id, e)
+            return 'retry'
+        return 'done'
+
+    # Crawl all jobs; returns {track_id: [stream rows within the job's window]}.
+    # Tracks still 'processing' go back on the queue after a growing delay instead of
+    # blocking a worker, so the other tracks keep moving.
+    async def crawl(self, jobs):
+        results = {}
+        queue = asyncio.Queue()
+        remaining = 0
+
+        for job in jobs:
+            if not self.refresh and self.cache.covers(job.track_id, job.start_date, job.end_date):
+                self.stats['cached'] += 1
+                results[job.track_id] = self.cache.get(job.track_id, job.start_date, job.end_date)
+            else:
+                queue.put_nowait(job)
+                remaining += 1
+
+        if remaining == 0:
+            self.log_stats()
+            return results
+
+        finished = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def complete(job, rows):
+            nonlocal remaining
+            results[job.track_id] = rows
+            if self.on_complete is not None and rows is not None:
+                self.on_complete(job, rows)
+            remaining -= 1
+            if remaining == 0:
+                finished.set()
+
+        async def worker(session):
+            while True:
+                job = await queue.get()
+                try:
+                    outcome = await self.fetch(session, job)
+                    job.attempt += 1
+
+                    if outcome == 'done':
+                        complete(job, self.cache.get(job.track_id, job.start_date, job.end_date))
+                    elif job.attempt < self.retry_attempts:
+                        self.stats['requeued'] += 1
+                        record_retry(self.url(job), 'requeued')
+                        delay = self.processing_delay * 2 ** (job.attempt - 1)
+                        loop.call_later(delay, queue.put_nowait, job)
+                    else:
+                        logging.error('Failed to fetch stream data for %s after multiple attempts.', job.track_id)
+                        self.stats['failed'] += 1
+                        complete(job, None)
+                except Exception:
+                    # Anything unexpected fails this track only; crawl() waits for every job to complete
+                    logging.exception('Unexpected error crawling stream data for %s', job.track_id)
+                    self.stats['failed'] += 1
+                    complete(job, None)
+
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        ) as session:
+            workers = [asyncio.create_task(worker(session)) for _ in range(self.concurrency)]
+            try:
+                await finished.wait()
+            finally:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+        self.log_stats()
+        return results
+
+    def log_stats(self):
+        logging.info('Stream crawl: %s tracks from cache, %s requests, %s re-queued, %s failed',
+                     self.stats['cached'], self.stats['requests'], self.stats['requeued'], self.stats['failed'])
+
+
+def crawl_streams(jobs, cache_path, limiter=None, **options):
+    cache = StreamCache(cache_path)
+    try:
+        with stage('fetch'):
+            return asyncio.run(StreamCrawler(cache, limiter=limiter, **options).crawl(jobs))
+    finally:
+        cache.close()
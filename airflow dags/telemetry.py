@@ -0,0 +1,219 @@
+# OpenTelemetry metrics and spans of the crawler: per-endpoint request latency, bytes, status codes
+# and retries, time blocked on the rate limiter per credential, and per-stage durations of every
+# task (fetch, parquet, artifacts, postgres; the rest of the task is reported as transform).
+# TELEMETRY_EXPORTER selects where they go besides the summary table logged at the end of a task:
+#   file (default)  one JSON document per export appended to TELEMETRY_PATH
+#   console         the task log (stdout)
+#   otlp            an OpenTelemetry collector, configured by the usual OTEL_EXPORTER_OTLP_* variables
+#   none            only the summary table
+import functools
+import logging
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+
+from opentelemetry import metrics, trace
+from opentelemetry.sdk.metrics import Counter, Histogram, MeterProvider
+from opentelemetry.sdk.metrics.export import (
+    AggregationTemporality,
+    ConsoleMetricExporter,
+    InMemoryMetricReader,
+    PeriodicExportingMetricReader,
+)
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from tabulate import tabulate
+
+TELEMETRY_EXPORTER = os.environ.get('TELEMETRY_EXPORTER', 'file')
+TELEMETRY_PATH = os.environ.get('TELEMETRY_PATH', './data/telemetry.jsonl')
+TELEMETRY_EXPORT_INTERVAL = float(os.environ.get('TELEMETRY_EXPORT_INTERVAL', 60))
+
+# Instruments bind to the SDK provider once setup() installs it; until then they are no-ops
+meter = metrics.get_meter('spotify_crawler')
+tracer = trace.get_tracer('spotify_crawler')
+request_duration = meter.create_histogram('crawler.request.duration', unit='ms',
+                                          description='Latency of one HTTP request by endpoint and status')
+requests_counter = meter.create_counter('crawler.requests', description='HTTP requests and cache hits by status')
+response_bytes = meter.create_counter('crawler.response.size', unit='By', description='Response bytes downloaded')
+retries_counter = meter.create_counter('crawler.retries', description='Attempts repeated after 401, 429 or errors')
+rate_limit_wait = meter.create_histogram('crawler.rate_limit.wait', unit='s',
+                                         description='Time blocked waiting for a rate limit token per key')
+stage_duration = meter.create_histogram('crawler.stage.duration', unit='s',
+                                        description='Time spent per task and stage')
+
+# Deltas since the previous task in this process feed the summary table
+summary_reader = None
+current_task = 'none'
+
+# Spotify and mystreamcount IDs are 22 base62 characters
+ID_SEGMENT = re.compile(r'/[0-9A-Za-z]{22}(?=/|$)')
+
+
+def setup():
+    global summary_reader
+    if summary_reader is not None:
+        return
+
+    summary_reader = InMemoryMetricReader(
+        preferred_temporality={Counter: AggregationTemporality.DELTA, Histogram: AggregationTemporality.DELTA}
+    )
+    readers, span_exporter = [summary_reader], None
+    if TELEMETRY_EXPORTER in ('file', 'console'):
+        if TELEMETRY_EXPORTER == 'file':
+            directory = os.path.dirname(TELEMETRY_PATH)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            out = open(TELEMETRY_PATH, 'a')
+        else:
+            out = sys.stdout
+
+        # One line per export so several task processes can append to the same file
+        def formatter(item):
+            return item.to_json(indent=None) + '\n'
+
+        readers.append(PeriodicExportingMetricReader(
+            ConsoleMetricExporter(out=out, formatter=formatter),
+            export_interval_millis=TELEMETRY_EXPORT_INTERVAL * 1000
+        ))
+        span_exporter = ConsoleSpanExporter(out=out, formatter=formatter)
+    elif TELEMETRY_EXPORTER == 'otlp':
+        from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+
+        readers.append(PeriodicExportingMetricReader(
+            OTLPMetricExporter(), export_interval_millis=TELEMETRY_EXPORT_INTERVAL * 1000
+        ))
+        span_exporter = OTLPSpanExporter()
+
+    resource = Resource.create({'service.name': 'spotify-crawler'})
+    metrics.set_meter_provider(MeterProvider(metric_readers=readers, resource=resource))
+    tracer_provider = TracerProvider(resource=resource)
+    if span_exporter is not None:
+        tracer_provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    trace.set_tracer_provider(tracer_provider)
+
+
+# '/v1/playlists/{id}/tracks' for 'https://api.spotify.com/v1/playlists/37i9.../tracks?offset=0'
+def endpoint_name(url):
+    path = re.sub(r'^[a-z]+://[^/]+', '', url).split('?', 1)[0]
+    return ID_SEGMENT.sub('/{id}', path)
+
+
+# status is the HTTP status, 'error' for network errors or 'cache' for responses served from a cache
+def record_request(url, status, seconds=None, size=0):
+    attributes = {'endpoint': endpoint_name(url), 'status': str(status)}
+    requests_counter.add(1, attributes)
+    if seconds is not None:
+        request_duration.record(seconds * 1000, attributes)
+    if size:
+        response_bytes.add(size, {'endpoint': attributes['endpoint']})
+
+
+def record_retry(url, reason):
+    retries_counter.add(1, {'endpoint': endpoint_name(url), 'reason': str(reason)})
+
+
+def record_wait(key, seconds):
+    rate_limit_wait.record(seconds, {'key': key})
+
+
+# Time a stage of the current task, e.g. `with stage('postgres'): ...`
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    with tracer.start_as_current_span(name, attributes={'task': current_task}):
+        try:
+            yield
+        finally:
+            stage_duration.record(time.perf_counter() - started, {'task': current_task, 'stage': name})
+
+
+# Wrap a task callable: one span for the task, and the summary table logged when it ends.
+# functools.wraps keeps the signature Airflow inspects to pass the context.
+def instrumented_task(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        global current_task
+        setup()
+        summary_reader.get_metrics_data()  # drop what earlier tasks of this process recorded
+        current_task = function.__name__
+        started = time.perf_counter()
+        try:
+            with tracer.start_as_current_span(current_task):
+                return function(*args, **kwargs)
+        finally:
+            stage_duration.record(time.perf_counter() - started, {'task': current_task, 'stage': 'total'})
+            log_summary(current_task)
+            metrics.get_meter_provider().force_flush()
+            trace.get_tracer_provider().force_flush()
+            current_task = 'none'
+
+    return wrapper
+
+
+def data_points(metrics_data):
+    points = {}
+    for resource_metrics in (metrics_data.resource_metrics if metrics_data else []):
+        for scope_metrics in resource_metrics.scope_metrics:
+            for metric in scope_metrics.metrics:
+                points.setdefault(metric.name, []).extend(metric.data.data_points)
+    return points
+
+
+def summary_tables(points):
+    endpoints = {}
+    for point in points.get('crawler.requests', []):
+        row = endpoints.setdefault(point.attributes['endpoint'], {})
+        row[point.attributes['status']] = row.get(point.attributes['status'], 0) + point.value
+    for point in points.get('crawler.retries', []):
+        row = endpoints.setdefault(point.attributes['endpoint'], {})
+        row['retries'] = row.get('retries', 0) + point.value
+    for point in points.get('crawler.request.duration', []):
+        row = endpoints[point.attributes['endpoint']]
+        row['count'] = row.get('count', 0) + point.count
+        row['sum'] = row.get('sum', 0) + point.sum
+        row['max'] = max(row.get('max', 0), point.max)
+    for point in points.get('crawler.response.size', []):
+        endpoints[point.attributes['endpoint']]['bytes'] = point.value
+
+    request_rows = []
+    for endpoint, row in sorted(endpoints.items()):
+        statuses = ', '.join(f'{status}: {row[status]}' for status in sorted(row)
+                             if status not in ('retries', 'count', 'sum', 'max', 'bytes'))
+        request_rows.append([
+            endpoint, statuses, row.get('retries', 0),
+            row['sum'] / row['count'] if row.get('count') else None, row.get('max'),
+            row.get('bytes', 0) / 1024
+        ])
+
+    wait_rows = sorted(
+        ([point.attributes['key'], point.count, point.sum, point.max]
+         for point in points.get('crawler.rate_limit.wait', [])),
+        key=lambda row: -row[2]
+    )
+
+    stages = {point.attributes['stage']: point.sum for point in points.get('crawler.stage.duration', [])}
+    total = stages.pop('total', 0.0)
+    stage_rows = [[name, seconds, seconds / total if total else None] for name, seconds in stages.items()]
+    # Whatever the timed stages do not cover is the task's own pandas work
+    transform = max(0.0, total - sum(stages.values()))
+    stage_rows.append(['transform', transform, transform / total if total else None])
+    stage_rows.append(['total', total, 1.0 if total else None])
+    return request_rows, wait_rows, stage_rows
+
+
+def log_summary(task):
+    request_rows, wait_rows, stage_rows = summary_tables(data_points(summary_reader.get_metrics_data()))
+    tables = [tabulate(stage_rows, headers=['stage', 'seconds', 'share'], floatfmt=('', '.3f', '.1%'))]
+    if request_rows:
+        tables.append(tabulate(
+            request_rows, headers=['endpoint', 'requests by status', 'retries', 'mean ms', 'max ms', 'KiB'],
+            floatfmt=('', '', '', '.1f', '.1f', '.1f')
+        ))
+    if wait_rows:
+        tables.append(tabulate(wait_rows, headers=['rate limit key', 'acquires', 'waited s', 'max wait s'],
+                               floatfmt=('', '', '.3f', '.3f')))
+    logging.info(f'Telemetry summary of {task}:\n' + '\n\n'.join(tables))
@@ -0,0 +1,66 @@
+# Startup cost of `spotify-analysis --help` from `python -X importtime`, checked against a
+# budget so a stray top-level import of pandas & co. in the CLI fails loudly, e.g.
+#   python benchmarks/bench_cli_startup.py --budget-ms 150 --repeat 5
+# Exits with status 1 when the median import time is over budget or a heavy module is imported.
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Spotify_Analysis')
+
+# Only the subcommands need these; `--help` must not import them
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'duckdb', 'matplotlib', 'typer', 'aiohttp']
+
+
+def import_times(args):
+    """Total import ms, top-level module -> cumulative ms and all modules of one run."""
+    env = dict(os.environ, PYTHONPATH=PACKAGE_DIR)
+    result = subprocess.run([sys.executable, '-X', 'importtime', *args], env=env,
+                            capture_output=True, text=True, check=True)
+    total, top_level, modules = 0, {}, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        total += int(self_us)
+        modules.add(name.strip())
+        # Nesting is shown by indentation; top-level imports have exactly one leading space
+        if not name[1:].startswith(' '):
+            top_level[name.strip()] = int(cumulative_us) / 1000
+    return total / 1000, top_level, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import time of the CLI --help.')
+    parser.add_argument('--budget-ms', type=float, default=150)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline', default='spotify_analysis.dataset',
+                        help='Single-command module whose --help is timed for comparison.')
+    args = parser.parse_args()
+
+    runs = [import_times(['-m', 'spotify_analysis.cli', '--help']) for _ in range(args.repeat)]
+    median_ms = statistics.median(total for total, _, _ in runs)
+    baseline_ms = statistics.median(
+        import_times(['-m', args.baseline, '--help'])[0] for _ in range(args.repeat)
+    )
+    print(f"{'spotify-analysis --help':<44} {median_ms:>8.1f} ms")
+    print(f"{f'python -m {args.baseline} --help':<44} {baseline_ms:>8.1f} ms")
+    print('slowest top-level imports:')
+    for name, ms in sorted(runs[-1][1].items(), key=lambda item: -item[1])[:5]:
+        print(f'    {name:<40} {ms:>8.1f} ms')
+
+    failures = []
+    heavy = sorted(name for name in runs[-1][2] if name in HEAVY_MODULES)
+    if heavy:
+        failures.append(f'--help imports {", ".join(heavy)}')
+    if median_ms > args.budget_ms:
+        failures.append(f'--help imports take {median_ms:.1f} ms, budget is {args.budget_ms} ms')
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
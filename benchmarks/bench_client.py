@@ -0,0 +1,66 @@
+# Compare the old serial requests.get loop with SpotifyClient fan-out against the stub server
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import requests
+
+from stub_server import fake_id, start_in_thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'airflow dags'))
+
+
+def run_serial(base_url, batches):
+    session_token = requests.post(f'{base_url}/api/token').json()['access_token']
+    headers = {'Authorization': f'Bearer {session_token}'}
+    for batch in batches:
+        response = requests.get(f'{base_url}/v1/artists', headers=headers,
+                                params={'ids': ','.join(batch)}, timeout=15)
+        response.raise_for_status()
+
+
+def run_concurrent(batches, max_concurrency):
+    import rate_limiter
+    import spotify_client
+
+    async def runner():
+        limiter = rate_limiter.TokenBucketLimiter(time_window=1, rate_limit=10_000)
+        async with spotify_client.SpotifyClient(
+            [{'client_id': 'stub', 'client_secret': 'stub'}],
+            max_concurrency=max_concurrency, limiter=limiter
+        ) as client:
+            await asyncio.gather(*(client.get('/v1/artists', params={'ids': ','.join(batch)})
+                                   for batch in batches))
+
+    asyncio.run(runner())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SpotifyClient against the stub server.')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    base_url, stop = start_in_thread(latency=args.latency)
+    os.environ['SPOTIFY_API_URL'] = base_url
+    os.environ['SPOTIFY_TOKEN_URL'] = f'{base_url}/api/token'
+    batches = [[fake_id('ar', i * 50 + j) for j in range(50)] for i in range(args.requests)]
+
+    try:
+        for name, run in [('serial requests.get', lambda: run_serial(base_url, batches)),
+                          (f'SpotifyClient x{args.concurrency}',
+                           lambda: run_concurrent(batches, args.concurrency))]:
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            print(f'{name:<24} {args.requests} requests in {elapsed:.2f}s '
+                  f'({args.requests / elapsed:.1f} req/s)')
+    finally:
+        stop()
+
+
+if __name__ == '__main__':
+    main()
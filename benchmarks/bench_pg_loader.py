@@ -0,0 +1,95 @@
+# Per-row executemany vs. the bulk pg_loader paths against a local Postgres, e.g.
+#   docker run --rm -d -p 5432:5432 -e POSTGRES_PASSWORD=bench postgres:16
+#   python benchmarks/bench_pg_loader.py --dsn "host=localhost user=postgres password=bench"
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'airflow dags'))
+
+import pg_loader  # noqa: E402
+
+COLUMNS = ['artists_id', 'album_id', 'track_id', 'track_uri', 'track_name',
+           'date', 'stream_daily', 'stream_total']
+
+CREATE_TABLE = """
+DROP TABLE IF EXISTS bench_tracks_stream;
+CREATE TABLE bench_tracks_stream (
+    artists_id TEXT,
+    album_id TEXT,
+    track_id TEXT NOT NULL,
+    track_uri TEXT,
+    track_name TEXT,
+    date DATE NOT NULL,
+    stream_daily BIGINT,
+    stream_total BIGINT,
+    PRIMARY KEY (track_id, date)
+);
+"""
+
+
+def make_rows(count):
+    start = date(2024, 11, 6)
+    for i in range(count):
+        track_id = f'{i // 30:022d}'
+        yield (f'{i % 997:022d}', f'{i % 503:022d}', track_id, f'spotify:track:{track_id}',
+               f'Track {i // 30}', start + timedelta(days=i % 30), 1000 + i, 1_000_000 + i)
+
+
+def per_row(dsn, rows):
+    connection = psycopg2.connect(dsn)
+    with connection, connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO bench_tracks_stream VALUES (%s, %s, %s, %s, %s, %s, %s, %s) '
+            'ON CONFLICT (track_id, date) DO NOTHING',
+            rows
+        )
+    connection.close()
+
+
+def reset(dsn):
+    connection = psycopg2.connect(dsn)
+    with connection, connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE)
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-row vs bulk Postgres loading.')
+    parser.add_argument('--dsn', default='host=localhost user=postgres password=bench dbname=postgres')
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--skip-per-row-above', type=int, default=100000,
+                        help='per-row inserts of larger sizes take too long to be worth waiting for')
+    args = parser.parse_args()
+
+    connection_params = {'dsn': args.dsn}
+
+    print(f"{'rows':>10} {'method':>16} {'seconds':>10} {'rows/s':>12}")
+    for size in map(int, args.sizes.split(',')):
+        rows = list(make_rows(size))
+        methods = [
+            ('copy', lambda: pg_loader.upsert_rows(connection_params, 'bench_tracks_stream', COLUMNS,
+                                                   rows, ['track_id', 'date'])),
+            ('execute_values', lambda: pg_loader.upsert_rows(connection_params, 'bench_tracks_stream',
+                                                             COLUMNS, rows, ['track_id', 'date'],
+                                                             method='execute_values')),
+        ]
+        if size <= args.skip_per_row_above:
+            methods.insert(0, ('per-row', lambda: per_row(args.dsn, rows)))
+
+        for name, run in methods:
+            reset(args.dsn)
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            print(f'{size:>10} {name:>16} {elapsed:>10.2f} {size / elapsed:>12.0f}')
+
+    pg_loader.close_pools()
+
+
+if __name__ == '__main__':
+    main()
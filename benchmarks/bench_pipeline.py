@@ -0,0 +1,375 @@
+# End-to-end benchmark of the crawling DAG against local stand-ins: the stub Spotify Web API and
+# mystreamcount (stub_server.py) and a throwaway SQLite or Postgres target, e.g.
+#   python benchmarks/bench_pipeline.py --scales 1 10 --output bench_pipeline.json
+#   python benchmarks/bench_pipeline.py --scales 1 --compare bench_pipeline.json
+# Scale s crawls s playlists per country (6 * s in total) of 50 * s tracks each: 300 tracks at
+# scale 1, 60 playlists and 30,000 tracks at scale 10. Every task instance runs in its own process,
+# as under Airflow, so wall time and peak RSS are per task. Needs the DAG's environment (Airflow,
+# psycopg2); the report is JSON with the commit it was measured on, for comparing across commits.
+import argparse
+import importlib.util
+import json
+import os
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+from stub_server import fake_id, start_in_thread
+
+DAG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'airflow dags')
+sys.path.insert(0, DAG_DIR)
+
+from charts import DEFAULT_CHARTS  # noqa: E402
+
+# (task_id, callable in the DAG file, (task_id, XCom key) of the op_kwargs list of mapped tasks)
+CHAIN = [
+    ('fetch_playlists', 'fetch_playlists', None),
+    ('fetch_tracks', 'fetch_tracks', ('fetch_playlists', 'return_value')),
+    ('combine_tracks', 'combine_tracks', None),
+    ('fetch_artist_batch', 'fetch_artist_batch', ('combine_tracks', 'artist_batches')),
+    ('fetch_artists', 'fetch_artists', None),
+    ('fetch_audio_feature_batch', 'fetch_audio_feature_batch', ('combine_tracks', 'audio_feature_batches')),
+    ('fetch_tracks_audio_features', 'fetch_tracks_audio_feature', None),
+    ('fetch_tracks_stream', 'fetch_tracks_stream', None),
+]
+BENCH_SCHEMA = 'bench'
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+# XCom of the whole run in one JSON file, shared by the task processes
+class XCom:
+    def __init__(self, path):
+        self.path = path
+        self.values = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self.values = json.load(file)
+
+    def save(self):
+        with open(self.path, 'w') as file:
+            json.dump(self.values, file, default=str)
+
+
+class TaskInstance:
+    def __init__(self, xcom, task_id, mapped):
+        self.xcom = xcom
+        self.task_id = task_id
+        self.mapped = mapped
+
+    def xcom_push(self, key, value):
+        name = f'{self.task_id}.{key}'
+        if self.mapped:
+            self.xcom.values.setdefault(name, []).append(value)
+        else:
+            self.xcom.values[name] = value
+
+    def xcom_pull(self, key, task_ids):
+        return self.xcom.values.get(f'{task_ids}.{key}')
+
+
+class DagRun:
+    conf = None
+
+    def __init__(self):
+        self.start_date = datetime.now(timezone.utc)
+
+
+# Stand-ins for pg_loader.upsert_records: tables are created on first use with TEXT columns
+class SQLiteTarget:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.rows = 0
+
+    def upsert(self, connection_params, table, columns, records, conflict_columns):
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(f'{column} TEXT' for column in columns)}, "
+            f"PRIMARY KEY ({', '.join(conflict_columns)}))"
+        )
+        rows = [
+            tuple(value if value is None or isinstance(value, (int, float, str)) else str(value)
+                  for value in (record[column] for column in columns))
+            for record in records
+        ]
+        self.connection.executemany(
+            f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+        )
+        self.connection.commit()
+        self.rows += len(rows)
+        return len(rows)
+
+
+class PostgresTarget:
+    def __init__(self, dsn):
+        import psycopg2
+        from psycopg2.extensions import parse_dsn
+
+        self.connect = lambda: psycopg2.connect(dsn, options=f'-c search_path={BENCH_SCHEMA}')
+        self.connection_params = {**parse_dsn(dsn), 'options': f'-c search_path={BENCH_SCHEMA}'}
+        self.tables = set()
+        self.rows = 0
+
+    def upsert(self, connection_params, table, columns, records, conflict_columns):
+        import pg_loader
+        from psycopg2 import sql
+
+        if table not in self.tables:
+            connection = self.connect()
+            with connection, connection.cursor() as cursor:
+                cursor.execute(sql.SQL('CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY ({}))').format(
+                    sql.Identifier(table),
+                    sql.SQL(', ').join(sql.SQL('{} TEXT').format(sql.Identifier(column)) for column in columns),
+                    sql.SQL(', ').join(map(sql.Identifier, conflict_columns))
+                ))
+            connection.close()
+            self.tables.add(table)
+        result = pg_loader.upsert_records(self.connection_params, table, columns, records, conflict_columns)
+        self.rows += result.rows
+        return result
+
+
+def reset_postgres(dsn):
+    import psycopg2
+
+    connection = psycopg2.connect(dsn)
+    with connection, connection.cursor() as cursor:
+        cursor.execute(f'DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE; CREATE SCHEMA {BENCH_SCHEMA}')
+    connection.close()
+
+
+# Runs one task instance in this process and prints its measurements as JSON
+def run_worker(args):
+    os.chdir(args.state_dir)
+    spec = importlib.util.spec_from_file_location('crawling_dag', os.path.join(DAG_DIR, 'crawling dags.py'))
+    dag = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(dag)
+
+    import rate_limiter
+
+    # The limiter keeps its store and windows; only the budgets are scaled
+    def create_limiter(url=None, time_window=30, rate_limit=60):
+        return rate_limiter.create_limiter(url, time_window, rate_limit * args.rate_limit_scale)
+
+    dag.create_limiter = create_limiter
+    target = PostgresTarget(args.dsn) if args.dsn else SQLiteTarget(os.path.join(args.state_dir, 'target.sqlite'))
+    dag.upsert_records = target.upsert
+
+    xcom = XCom(os.path.join(args.state_dir, 'xcom.json'))
+    context = {
+        'ti': TaskInstance(xcom, args.task_id, args.op_kwargs is not None),
+        'run_id': 'bench',
+        'data_interval_end': datetime.fromisoformat(args.run_end),
+        'dag_run': DagRun(),
+    }
+    baseline_mb = peak_rss_mb()
+    started = time.perf_counter()
+    result = getattr(dag, args.callable)(**json.loads(args.op_kwargs or '{}'), **context)
+    wall = time.perf_counter() - started
+    if result is not None:
+        context['ti'].xcom_push('return_value', result)
+    xcom.save()
+
+    # Rows loaded into the target, or the records a batch task fetched into the entity index
+    rows = target.rows
+    if not rows and isinstance(result, int) and not isinstance(result, bool):
+        rows = result
+    print(json.dumps({'wall_s': wall, 'peak_rss_mb': peak_rss_mb(), 'import_rss_mb': baseline_mb, 'rows': rows}))
+
+
+def server_stats(base_url):
+    with urllib.request.urlopen(f'{base_url}/_stats') as response:
+        return json.load(response)
+
+
+def write_charts(path, scale):
+    charts = []
+    for number, chart in enumerate(DEFAULT_CHARTS):
+        charts.append(dict(chart))  # the first chart of a country is found by search
+        charts.extend({**chart, 'playlist_id': fake_id('pl', number * 1000 + index)} for index in range(1, scale))
+    with open(path, 'w') as file:
+        json.dump(charts, file)
+    return len(charts)
+
+
+def run_task(args, state_dir, base_url, task_id, callable_name, run_end, op_kwargs, log):
+    command = [sys.executable, os.path.abspath(__file__), 'worker', '--state-dir', state_dir,
+               '--task-id', task_id, '--callable', callable_name, '--run-end', run_end.isoformat(),
+               '--rate-limit-scale', str(args.rate_limit_scale)]
+    if op_kwargs is not None:
+        command += ['--op-kwargs', json.dumps(op_kwargs, default=str)]
+    if args.dsn:
+        command += ['--dsn', args.dsn]
+
+    before = server_stats(base_url)
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=log, text=True, check=True)
+    after = server_stats(base_url)
+
+    measurement = json.loads(result.stdout.strip().splitlines()[-1])
+    measurement['api_calls'] = {
+        endpoint: count - before['endpoints'].get(endpoint, 0)
+        for endpoint, count in after['endpoints'].items() if count > before['endpoints'].get(endpoint, 0)
+    }
+    measurement['throttled'] = after['throttled'] - before['throttled']
+    return measurement
+
+
+def summarize(task_id, scale, measurements, **extra):
+    wall = sum(measurement['wall_s'] for measurement in measurements)
+    rows = sum(measurement['rows'] for measurement in measurements)
+    api_calls = {}
+    for measurement in measurements:
+        for endpoint, count in measurement['api_calls'].items():
+            api_calls[endpoint] = api_calls.get(endpoint, 0) + count
+    return {
+        'scale': scale, 'task': task_id, 'instances': len(measurements), **extra,
+        'wall_s': round(wall, 4),
+        'api_calls': api_calls,
+        'api_calls_total': sum(api_calls.values()),
+        'throttled': sum(measurement['throttled'] for measurement in measurements),
+        'peak_rss_mb': round(max((measurement['peak_rss_mb'] for measurement in measurements), default=0), 1),
+        'import_rss_mb': round(max((measurement['import_rss_mb'] for measurement in measurements), default=0), 1),
+        'rows': rows,
+        'rows_per_s': round(rows / wall, 1) if rows and wall else None,
+    }
+
+
+def run_scale(args, scale):
+    state_dir = tempfile.mkdtemp(prefix=f'bench_pipeline_{scale}_')
+    playlists = write_charts(os.path.join(state_dir, 'charts.json'), scale)
+    base_url, stop = start_in_thread(
+        latency=args.latency, tracks_per_playlist=50 * scale, processing_rate=args.processing_rate,
+        throttle_rate=args.throttle_rate, retry_after=args.retry_after, distinct_tracks=True, replay=args.replay
+    )
+    os.environ.update({
+        'SPOTIFY_API_URL': base_url,
+        'SPOTIFY_TOKEN_URL': f'{base_url}/api/token',
+        'MYSTREAMCOUNT_URL': base_url,
+        'SPOTIFY_CHARTS_CONFIG': os.path.join(state_dir, 'charts.json'),
+        'STREAM_PROCESSING_DELAY': str(args.processing_delay),
+        'TELEMETRY_EXPORTER': os.environ.get('TELEMETRY_EXPORTER', 'none'),
+    })
+    if args.dsn:
+        reset_postgres(args.dsn)
+
+    # The chart day is today, so the stub's stream history covers the stream windows; the stream
+    # task belongs to the next day's run, which crawls the streams of this run's chart tracks
+    run_end = datetime.now(timezone.utc).replace(hour=13, minute=30, second=0, microsecond=0)
+    results = []
+    try:
+        with open(os.path.join(state_dir, 'tasks.log'), 'w') as log:
+            for task_id, callable_name, mapped_from in CHAIN:
+                end = run_end + timedelta(days=1) if task_id == 'fetch_tracks_stream' else run_end
+                if mapped_from is None:
+                    instances = [None]
+                else:
+                    instances = XCom(os.path.join(state_dir, 'xcom.json')).values.get('.'.join(mapped_from)) or []
+                measurements = [
+                    run_task(args, state_dir, base_url, task_id, callable_name, end, op_kwargs, log)
+                    for op_kwargs in instances
+                ]
+                results.append(summarize(task_id, scale, measurements))
+                print(f"scale {scale:<3} {task_id:<28} {results[-1]['wall_s']:>9.2f} s "
+                      f"{results[-1]['api_calls_total']:>7} calls {results[-1]['peak_rss_mb']:>8.1f} MB "
+                      f"{results[-1]['rows']:>8} rows", flush=True)
+    finally:
+        stop()
+        if args.keep:
+            print(f'State of scale {scale} kept in {state_dir}')
+        else:
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+    chain = summarize('chain', scale, results, playlists=playlists, tracks=playlists * 50 * scale)
+    chain['instances'] = sum(result['instances'] for result in results)
+    results.append(chain)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=DAG_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    previous = {(result['scale'], result['task']): result for result in baseline['results']}
+    print(f"\ncompared with {baseline_path} ({(baseline.get('commit') or 'unknown')[:12]})")
+    print(f"{'scale':<6} {'task':<28} {'wall s (change)':>25} {'API calls':>16} {'peak RSS MB':>20}")
+    if not any((result['scale'], result['task']) in previous for result in results):
+        print('no scale of this run is in the baseline')
+    for result in results:
+        old = previous.get((result['scale'], result['task']))
+        if old is None:
+            continue
+        change = (result['wall_s'] / old['wall_s'] - 1) if old['wall_s'] else 0.0
+        print(f"{result['scale']:<6} {result['task']:<28} "
+              f"{old['wall_s']:>7.2f} -> {result['wall_s']:<7.2f}{change:>+7.1%} "
+              f"{old['api_calls_total']:>6} -> {result['api_calls_total']:<6}"
+              f"{old['peak_rss_mb']:>8.1f} -> {result['peak_rss_mb']:<8.1f}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        parser = argparse.ArgumentParser(description='Run one DAG task instance for bench_pipeline.')
+        parser.add_argument('--state-dir', required=True)
+        parser.add_argument('--task-id', required=True)
+        parser.add_argument('--callable', required=True)
+        parser.add_argument('--run-end', required=True)
+        parser.add_argument('--op-kwargs')
+        parser.add_argument('--rate-limit-scale', type=float, default=1)
+        parser.add_argument('--dsn')
+        run_worker(parser.parse_args(sys.argv[2:]))
+        return
+
+    parser = argparse.ArgumentParser(description='Benchmark the crawling DAG end to end against local stand-ins.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1],
+                        help='s playlists per country of 50 * s tracks each')
+    parser.add_argument('--latency', type=float, default=0.05, help='stub response latency in seconds')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of requests answered 429')
+    parser.add_argument('--retry-after', type=float, default=1, help='Retry-After of the 429 answers')
+    parser.add_argument('--processing-rate', type=float, default=0.0,
+                        help="share of tracks answering 'processing' to their first stream request")
+    parser.add_argument('--processing-delay', type=float, default=1,
+                        help="seconds before a 'processing' track is asked again (30 in production)")
+    parser.add_argument('--rate-limit-scale', type=float, default=100,
+                        help='multiplier of the DAG rate limits; 1 reproduces the production budgets')
+    parser.add_argument('--replay', help='HTTP cache file of recorded Spotify responses to serve')
+    parser.add_argument('--dsn', help='throwaway Postgres to load into (schema "bench" is recreated); '
+                                      'SQLite in the run directory when omitted')
+    parser.add_argument('--output', default='bench_pipeline.json')
+    parser.add_argument('--compare', help='earlier --output file to compare against')
+    parser.add_argument('--keep', action='store_true', help='keep the data directory of every scale')
+    args = parser.parse_args()
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    results = [result for scale in args.scales for result in run_scale(args, scale)]
+    report = {
+        'commit': git_commit(),
+        'started_at': started_at,
+        'python': sys.version.split()[0],
+        'config': {name: value for name, value in vars(args).items() if name not in ('output', 'compare', 'dsn')},
+        'target': 'postgres' if args.dsn else 'sqlite',
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'Wrote {args.output}')
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Latency of the spotify_analysis scoring server (modeling/predict.py serve) at 1, 10 and 100
+# concurrent clients, each sending single-track GET /predict/<track_id> requests, e.g.
+#   python benchmarks/bench_predict.py --features-dir <features> --model-path <model.pkl> \
+#       --registry-dir <id_registry> --requests 2000
+# Run after `predict batch` (or once before), so the server starts from a warm feature lookup.
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import numpy as np
+import pandas as pd
+
+PACKAGE_DIR = os.path.join(os.path.dirname(__file__), '..', 'Spotify_Analysis')
+
+
+def start_server(args, socket_path):
+    command = [sys.executable, '-m', 'spotify_analysis.modeling.predict', 'serve',
+               '--socket', socket_path, '--max-batch-size', str(args.max_batch_size),
+               '--max-wait-ms', str(args.max_wait_ms)]
+    for option in ('features_dir', 'model_path', 'registry_dir', 'lookup_path'):
+        if getattr(args, option):
+            command += [f"--{option.replace('_', '-')}", getattr(args, option)]
+    env = {**os.environ, 'PYTHONPATH': os.path.abspath(PACKAGE_DIR)}
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_until_healthy(session, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get('http://scorer/health') as response:
+                if response.status == 200:
+                    return await response.json()
+        except aiohttp.ClientConnectionError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError('Scoring server did not come up')
+
+
+async def run_clients(session, track_ids, clients, total_requests):
+    latencies = []
+    per_client = max(total_requests // clients, 1)
+
+    async def client():
+        for _ in range(per_client):
+            track_id = random.choice(track_ids)
+            started = time.perf_counter()
+            async with session.get(f'http://scorer/predict/{track_id}') as response:
+                response.raise_for_status()
+                await response.read()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return np.array(latencies) * 1000, time.perf_counter() - started
+
+
+async def benchmark(args, socket_path, track_ids):
+    connector = aiohttp.UnixConnector(path=socket_path, limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        health = await wait_until_healthy(session)
+        print(f"model {health['model_version']}, features {health['features']}, "
+              f"max batch {args.max_batch_size}, max wait {args.max_wait_ms} ms")
+        # Warm up connections and the event loop before measuring
+        await run_clients(session, track_ids, 10, 100)
+
+        print(f"{'clients':>7} {'requests':>9} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>9}")
+        for clients in args.clients:
+            latencies, elapsed = await run_clients(session, track_ids, clients, args.requests)
+            p50, p99 = np.percentile(latencies, [50, 99])
+            print(f'{clients:>7} {len(latencies):>9} {p50:>8.2f} {p99:>8.2f} '
+                  f'{len(latencies) / elapsed:>9.0f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the micro-batching scoring server.')
+    parser.add_argument('--features-dir')
+    parser.add_argument('--model-path')
+    parser.add_argument('--registry-dir')
+    parser.add_argument('--lookup-path')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per concurrency level')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-wait-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    sys.path.insert(0, PACKAGE_DIR)
+    from spotify_analysis.schema import ID_REGISTRY_DIR
+
+    registry_dir = args.registry_dir or ID_REGISTRY_DIR
+    track_ids = pd.read_parquet(os.path.join(registry_dir, 'track.parquet'))['id'].tolist()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, 'scorer.sock')
+        server = start_server(args, socket_path)
+        try:
+            asyncio.run(benchmark(args, socket_path, track_ids))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
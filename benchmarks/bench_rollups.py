@@ -0,0 +1,83 @@
+# The notebook's top-N and trend queries run as full-table groupbys over the crawled CSVs vs.
+# answered by spotify_analysis.rollups from the materialized rollups, e.g.
+#   python benchmarks/bench_rollups.py --data-dir ./data --repeat 20
+# Builds the fact table and rollups into a temporary directory first.
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'Spotify_Analysis'))
+
+from spotify_analysis import dataset, rollups  # noqa: E402
+from spotify_analysis.schema import IdRegistry  # noqa: E402
+
+
+def timed(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def raw_queries(data_dir):
+    def load():
+        streams = pd.read_csv(data_dir / 'tracks_stream.csv')
+        artists = pd.read_csv(data_dir / 'artists.csv').rename(columns={'artist_id': 'artists_id'})
+        return streams.merge(artists, on='artists_id', how='left')
+
+    def top_tracks():
+        return load().groupby('track_name')['stream_total'].max().nlargest(10)
+
+    def top_artists():
+        return load().groupby('artist_name')['stream_total'].max().nlargest(10)
+
+    def daily_leaders():
+        df = load()
+        return df.loc[df.groupby('date')['stream_daily'].idxmax()]
+
+    def by_release_date():
+        tracks = pd.read_csv(data_dir / 'tracks.csv')[['track_id', 'track_release_date']]
+        df = load().merge(tracks.drop_duplicates('track_id'), on='track_id')
+        return df.groupby('track_release_date')['stream_daily'].sum()
+
+    return {'top 10 tracks': top_tracks, 'top 10 artists': top_artists,
+            'daily leaders': daily_leaders, 'streams by release': by_release_date}
+
+
+def rollup_queries(query):
+    return {'top 10 tracks': lambda: query.top_tracks(10),
+            'top 10 artists': lambda: query.top_artists(10),
+            'daily leaders': query.daily_leaders,
+            'streams by release': query.streams_by_release_date}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark rollup queries against raw groupbys.')
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(__file__), '..', 'data'))
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    data_dir = Path(args.data_dir)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_dir = Path(tmp_dir)
+        dataset.main(raw_dir=data_dir, output_dir=output_dir, chunksize=100_000)
+        started = time.perf_counter()
+        rollups.main(fact_path=output_dir / 'tracks_stream_fact.parquet', raw_dir=data_dir,
+                     output_dir=output_dir / 'rollups', full=True)
+        print(f'rollups built in {time.perf_counter() - started:.2f}s')
+
+        query = rollups.Rollups(output_dir / 'rollups', IdRegistry(output_dir / 'id_registry'))
+        print(f"{'query':<20} {'raw ms':>9} {'rollup ms':>10} {'speedup':>8}")
+        for (name, raw), rolled in zip(raw_queries(data_dir).items(),
+                                       rollup_queries(query).values()):
+            raw_ms, rollup_ms = timed(raw, args.repeat), timed(rolled, args.repeat)
+            print(f'{name:<20} {raw_ms:>9.2f} {rollup_ms:>10.2f} {raw_ms / rollup_ms:>7.0f}x')
+
+
+if __name__ == '__main__':
+    main()
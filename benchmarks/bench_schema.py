@@ -0,0 +1,68 @@
+# Memory and groupby/join time of the crawled CSVs read as plain object columns vs. through
+# spotify_analysis.schema (int32 ID codes, categoricals, datetime64, float32), e.g.
+#   python benchmarks/bench_schema.py --data-dir ./data --repeat 20
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'Spotify_Analysis'))
+
+from spotify_analysis.schema import IdRegistry, read_table  # noqa: E402
+
+DATASETS = ['tracks', 'artists', 'tracks_audio_feature', 'tracks_stream']
+
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+def timed(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def workloads(frames):
+    streams, features = frames['tracks_stream'], frames['tracks_audio_feature']
+    return {
+        'streams by track': lambda: streams.groupby('track_id')['stream_daily'].sum(),
+        'streams by date': lambda: streams.groupby('date')['stream_daily'].sum(),
+        'features by country': lambda: features.groupby('country')['danceability'].mean(),
+        'streams join features': lambda: streams.merge(
+            features.drop_duplicates('track_id')[['track_id', 'energy']], on='track_id'
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the typed schema layer against plain CSV reads.')
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(__file__), '..', 'data'))
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    data_dir = Path(args.data_dir)
+
+    before = {name: pd.read_csv(data_dir / f'{name}.csv') for name in DATASETS}
+    with tempfile.TemporaryDirectory() as registry_dir:
+        registry = IdRegistry(Path(registry_dir))
+        after = {name: read_table(data_dir, name, registry) for name in DATASETS}
+
+    print(f"{'dataset':<22} {'rows':>7} {'before MB':>10} {'after MB':>10} {'ratio':>7}")
+    for name in DATASETS:
+        old, new = memory_mb(before[name]), memory_mb(after[name])
+        print(f'{name:<22} {len(before[name]):>7} {old:>10.2f} {new:>10.2f} {old / new:>6.1f}x')
+
+    print()
+    print(f"{'workload':<22} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+    for (name, old), new in zip(workloads(before).items(), workloads(after).values()):
+        old_ms, new_ms = timed(old, args.repeat), timed(new, args.repeat)
+        print(f'{name:<22} {old_ms:>10.2f} {new_ms:>10.2f} {old_ms / new_ms:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
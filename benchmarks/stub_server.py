@@ -0,0 +1,234 @@
+# Local stand-in for the Spotify Web API (and mystreamcount) so the crawler can be exercised
+# without network access
+import asyncio
+import argparse
+import json
+import random
+import sqlite3
+import threading
+import zlib
+from collections import Counter
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+
+from aiohttp import web
+
+
+def fake_id(prefix, number):
+    return f'{prefix}{number:0>{22 - len(prefix)}}'
+
+
+# Recorded Spotify responses from an HTTP cache file of the DAG (airflow dags/http_cache.py),
+# as {(path, sorted query items): body}
+def load_replay(path):
+    connection = sqlite3.connect(path)
+    try:
+        rows = connection.execute('SELECT key, body FROM responses').fetchall()
+    finally:
+        connection.close()
+
+    responses = {}
+    for key, body in rows:
+        url, params = key.split('?', 1)
+        query = tuple(sorted((name, str(value)) for name, value in json.loads(params).items()))
+        responses[(urlsplit(url).path, query)] = body
+    return responses
+
+
+# processing_rate: share of tracks whose first stream count request answers 'processing'
+# malformed_rate: share of tracks whose first stream count request answers 200 with a body that
+# is not a JSON object (an HTML error page or a JSON list, alternately)
+# throttle_rate: share of API requests answered 429 with a Retry-After of `retry_after` seconds
+# distinct_tracks: every playlist has its own tracks and artists instead of the same ones
+# replay: HTTP cache file whose recorded responses are served instead of synthetic ones
+def create_app(latency=0.05, tracks_per_playlist=50, processing_rate=0.0, history_days=60,
+               throttle_rate=0.0, retry_after=1, distinct_tracks=False, replay=None, seed=0,
+               malformed_rate=0.0):
+    routes = web.RouteTableDef()
+    app = web.Application()
+    app['stats'] = {'requests': 0, 'not_modified': 0, 'throttled': 0, 'replayed': 0,
+                    'endpoints': Counter(), 'stream_requests': {}}
+    replayed = load_replay(replay) if replay else {}
+    throttle = random.Random(seed)
+
+    @web.middleware
+    async def simulate_latency(request, handler):
+        if request.path == '/_stats':
+            return await handler(request)
+        app['stats']['requests'] += 1
+        resource = request.match_info.route.resource
+        app['stats']['endpoints'][resource.canonical if resource else request.path] += 1
+        await asyncio.sleep(latency)
+
+        if request.path != '/api/token' and throttle.random() < throttle_rate:
+            app['stats']['throttled'] += 1
+            return web.json_response({'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                                     status=429, headers={'Retry-After': str(retry_after)})
+        body = replayed.get((request.path, tuple(sorted(request.query.items()))))
+        if body is not None:
+            app['stats']['replayed'] += 1
+            return web.Response(text=body, content_type='application/json')
+        return await handler(request)
+
+    # Request counters for benchmarks running the crawler in other processes
+    @routes.get('/_stats')
+    async def stats(request):
+        return web.json_response({name: value for name, value in app['stats'].items() if name != 'stream_requests'})
+
+    @routes.post('/api/token')
+    async def token(request):
+        return web.json_response({'access_token': 'stub-token', 'token_type': 'Bearer', 'expires_in': 3600})
+
+    @routes.get('/v1/search')
+    async def search(request):
+        country = request.query['q'].replace('Top 50 - ', '')
+        return web.json_response({'playlists': {'items': [{
+            'id': fake_id('pl', sum(map(ord, country))),
+            'name': f'Top 50 - {country}',
+            'owner': {'id': 'spotify'},
+            'description': f'Your daily update of the most played tracks right now - {country}.'
+        }]}})
+
+    def playlist_item(position, playlist_id):
+        number = position
+        if distinct_tracks:
+            number += zlib.crc32(playlist_id.encode()) % 10 ** 9 * 100000
+        return {
+            'added_at': '2024-11-06T12:00:00Z',
+            'track': {
+                'id': fake_id('tr', number),
+                'uri': f"spotify:track:{fake_id('tr', number)}",
+                'name': f'Track {number}',
+                'duration_ms': 180000,
+                'popularity': 100 - position % 100,
+                'explicit': False,
+                'album': {'id': fake_id('al', number), 'release_date': '2024-10-18'},
+                'artists': [{'id': fake_id('ar', number)}, {'id': fake_id('ar', number + 1)}]
+            }
+        }
+
+    # Playlists carry an ETag that changes with the daily snapshot, like the real API;
+    # a matching If-None-Match is answered with 304 Not Modified
+    def snapshot_response(request, body):
+        etag = f'"{date.today().isoformat()}"'
+        if request.headers.get('If-None-Match') == etag:
+            app['stats']['not_modified'] += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.json_response(body, headers={'ETag': etag})
+
+    @routes.get('/v1/playlists/{playlist_id}')
+    async def playlist(request):
+        playlist_id = request.match_info['playlist_id']
+        items = [playlist_item(position, playlist_id) for position in range(min(tracks_per_playlist, 100))]
+        return snapshot_response(request, {
+            'id': playlist_id, 'name': f'Playlist {playlist_id}', 'snapshot_id': date.today().isoformat(),
+            'tracks': {'items': items, 'total': tracks_per_playlist}
+        })
+
+    # Paged like the real endpoint: at most 100 items per page, `fields` is accepted and ignored
+    @routes.get('/v1/playlists/{playlist_id}/tracks')
+    async def playlist_tracks(request):
+        playlist_id = request.match_info['playlist_id']
+        offset = int(request.query.get('offset', 0))
+        limit = min(int(request.query.get('limit', 100)), 100)
+        items = [playlist_item(position, playlist_id)
+                 for position in range(offset, min(offset + limit, tracks_per_playlist))]
+        return snapshot_response(
+            request, {'items': items, 'total': tracks_per_playlist, 'offset': offset, 'limit': limit}
+        )
+
+    @routes.get('/v1/artists')
+    async def artists(request):
+        return web.json_response({'artists': [{
+            'id': artist_id,
+            'uri': f'spotify:artist:{artist_id}',
+            'name': f'Artist {artist_id}',
+            'genres': ['pop'],
+            'popularity': 50,
+            'followers': {'total': 1000},
+            'images': [{'url': 'https://i.scdn.co/image/stub'}]
+        } for artist_id in request.query['ids'].split(',')]})
+
+    @routes.get('/v1/audio-features')
+    async def audio_features(request):
+        return web.json_response({'audio_features': [{
+            'id': track_id, 'danceability': 0.5, 'energy': 0.5, 'key': 1, 'loudness': -5.0,
+            'mode': 1, 'speechiness': 0.05, 'acousticness': 0.1, 'instrumentalness': 0.0,
+            'liveness': 0.1, 'valence': 0.5, 'tempo': 120.0, 'duration_ms': 180000,
+            'time_signature': 4
+        } for track_id in request.query['ids'].split(',')]})
+
+    # mystreamcount: the full daily history of a track up to yesterday
+    @routes.get('/api/track/{track_id}/streams')
+    async def track_streams(request):
+        track_id = request.match_info['track_id']
+        stream_requests = app['stats']['stream_requests']
+        stream_requests[track_id] = stream_requests.get(track_id, 0) + 1
+
+        if stream_requests[track_id] == 1 and zlib.crc32(track_id.encode()) % 100 < processing_rate * 100:
+            return web.json_response({'status': 'processing'})
+        malformed = zlib.crc32(f'malformed:{track_id}'.encode()) % 100
+        if stream_requests[track_id] == 1 and malformed < malformed_rate * 100:
+            if malformed % 2:
+                return web.Response(text='<html>Bad gateway</html>', content_type='text/html')
+            return web.json_response([])
+
+        yesterday = date.today() - timedelta(days=1)
+        history = {}
+        for days_back in range(history_days, 0, -1):
+            day = yesterday - timedelta(days=days_back - 1)
+            history[day.isoformat()] = {'daily': 1000 + days_back, 'total': 1000 * (history_days - days_back + 1)}
+        return web.json_response({'status': 'done', 'data': history})
+
+    app.middlewares.append(simulate_latency)
+    app.add_routes(routes)
+    return app
+
+
+# Serve the app from a background thread; returns (base_url, stop)
+def start_in_thread(host='127.0.0.1', port=0, **app_options):
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(create_app(**app_options))
+    started = threading.Event()
+    address = {}
+
+    async def serve():
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        address['port'] = site._server.sockets[0].getsockname()[1]
+        started.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(serve())
+        loop.run_forever()
+        loop.run_until_complete(runner.cleanup())
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    started.wait()
+
+    def stop():
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+    return f"http://{host}:{address['port']}", stop
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the stub Spotify Web API and mystreamcount endpoint.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--processing-rate', type=float, default=0.0)
+    parser.add_argument('--tracks-per-playlist', type=int, default=50)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=1)
+    parser.add_argument('--distinct-tracks', action='store_true')
+    parser.add_argument('--replay', help='HTTP cache file of recorded Spotify responses to serve')
+    args = parser.parse_args()
+    web.run_app(create_app(latency=args.latency, processing_rate=args.processing_rate,
+                           tracks_per_playlist=args.tracks_per_playlist, throttle_rate=args.throttle_rate,
+                           retry_after=args.retry_after, distinct_tracks=args.distinct_tracks,
+                           replay=args.replay),
+                host='127.0.0.1', port=args.port)
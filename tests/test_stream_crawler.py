@@ -0,0 +1,146 @@
+# StreamCrawler against the stub mystreamcount endpoint of benchmarks/stub_server.py, e.g.
+#   python -m pytest tests
+import asyncio
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'airflow dags'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+import stream_crawler  # noqa: E402
+from rate_limiter import TokenBucketLimiter  # noqa: E402
+from stream_crawler import StreamCache, StreamCrawler, StreamJob  # noqa: E402
+from stub_server import fake_id, start_in_thread  # noqa: E402
+
+YESTERDAY = date.today() - timedelta(days=1)
+WINDOW = (YESTERDAY - timedelta(days=6), YESTERDAY)
+
+
+# Records (time, track_id, outcome) of every request the crawler makes
+class RecordingCrawler(StreamCrawler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.log = []
+
+    async def fetch(self, session, job):
+        outcome = await super().fetch(session, job)
+        self.log.append((time.perf_counter(), job.track_id, outcome))
+        return outcome
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    def start(**options):
+        base_url, stop = start_in_thread(latency=0.01, **options)
+        monkeypatch.setattr(stream_crawler, 'MYSTREAMCOUNT_URL', base_url)
+        stops.append(stop)
+
+    stops = []
+    yield start
+    for stop in stops:
+        stop()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = StreamCache(str(tmp_path / 'stream_cache.sqlite'))
+    yield cache
+    cache.close()
+
+
+# A crawl that never finishes fails the test instead of hanging it
+def crawl(cache, jobs, crawler_class=None, **options):
+    crawler_class = crawler_class or RecordingCrawler
+    crawler = crawler_class(cache, limiter=TokenBucketLimiter(time_window=1, rate_limit=1000), **options)
+    results = asyncio.run(asyncio.wait_for(crawler.crawl(jobs), timeout=30))
+    return crawler, results
+
+
+def test_processing_tracks_are_requeued_without_blocking_the_others(stub, cache):
+    stub(processing_rate=0.5)
+    jobs = [StreamJob(fake_id('tr', number), *WINDOW) for number in range(12)]
+
+    # One worker: a track waiting for its 'processing' retry must not hold it
+    crawler, results = crawl(cache, jobs, concurrency=1, processing_delay=1)
+
+    processing = {track_id for _, track_id, outcome in crawler.log if outcome == 'retry'}
+    assert 0 < len(processing) < len(jobs)
+    assert crawler.stats['requeued'] == len(processing)
+    assert all(len(results[job.track_id]) == 7 for job in jobs)
+
+    first_attempts = {}
+    for at, track_id, _ in crawler.log:
+        first_attempts.setdefault(track_id, at)
+    retried_at = min(at for at, track_id, _ in crawler.log if track_id in processing and at > first_attempts[track_id])
+    done_at = max(at for at, track_id, outcome in crawler.log if track_id not in processing and outcome == 'done')
+    assert done_at < retried_at
+    assert retried_at - min(first_attempts[track_id] for track_id in processing) >= 1
+
+
+def test_covered_windows_issue_no_request(stub, cache):
+    stub()
+    track_id = fake_id('tr', 1)
+    history = {
+        (WINDOW[0] + timedelta(days=offset)).isoformat(): {'daily': 10 + offset, 'total': 100 + offset}
+        for offset in range(7)
+    }
+    cache.put_history(track_id, history)
+
+    crawler, results = crawl(cache, [StreamJob(track_id, *WINDOW)])
+
+    assert crawler.log == []
+    assert crawler.stats == {'cached': 1, 'requests': 0, 'requeued': 0, 'failed': 0}
+    assert [row['stream_daily'] for row in results[track_id]] == list(range(10, 17))
+
+
+def test_full_history_payload_backfills_older_dates(stub, cache):
+    stub(history_days=60)
+    track_id = fake_id('tr', 2)
+    older_window = (YESTERDAY - timedelta(days=40), YESTERDAY - timedelta(days=34))
+
+    crawler, _ = crawl(cache, [StreamJob(track_id, *WINDOW)])
+    assert crawler.stats['requests'] == 1
+
+    # The one download stored the whole history, so an older window is already there
+    assert cache.covers(track_id, *older_window)
+    assert len(cache.get(track_id, YESTERDAY - timedelta(days=59), YESTERDAY)) == 60
+
+    crawler, results = crawl(cache, [StreamJob(track_id, *older_window)])
+    assert crawler.stats['requests'] == 0
+    assert [row['date'] for row in results[track_id]] == [
+        (older_window[0] + timedelta(days=offset)).isoformat() for offset in range(7)
+    ]
+
+
+def test_malformed_payloads_are_retried(stub, cache):
+    stub(malformed_rate=0.5)
+    jobs = [StreamJob(fake_id('tr', number), *WINDOW) for number in range(12)]
+
+    crawler, results = crawl(cache, jobs, processing_delay=0.01)
+
+    malformed = {track_id for _, track_id, outcome in crawler.log if outcome == 'retry'}
+    assert 0 < len(malformed) < len(jobs)
+    assert crawler.stats['failed'] == 0
+    assert all(len(results[job.track_id]) == 7 for job in jobs)
+
+
+def test_an_unexpected_error_fails_only_its_track(stub, cache):
+    stub()
+    broken = fake_id('tr', 3)
+
+    class BrokenCrawler(RecordingCrawler):
+        async def fetch(self, session, job):
+            if job.track_id == broken:
+                raise RuntimeError('unexpected')
+            return await super().fetch(session, job)
+
+    jobs = [StreamJob(fake_id('tr', number), *WINDOW) for number in range(6)]
+    crawler, results = crawl(cache, jobs, crawler_class=BrokenCrawler, concurrency=1)
+
+    assert results[broken] is None
+    assert crawler.stats['failed'] == 1
+    assert all(len(results[job.track_id]) == 7 for job in jobs if job.track_id != broken)